@@ -0,0 +1,246 @@
+"""Relaying attachments sent to the bot by DM.
+
+Attachments are streamed from Discord's CDN in chunks into a spool that stays in memory while
+small and moves to a temporary file once it grows past SPOOL_SIZE, so a large file never sits in
+memory as a whole. Downloads are bounded in number and size, and cached by content, so a file
+relayed to a room and to every occupant's DMs is downloaded once, and each send uploads it from
+the cached copy. A cached attachment is pinned until every send it was fetched for has opened
+it, so it is never evicted from under a send still waiting in a queue.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from collections import Counter, OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Optional
+
+import aiohttp
+import discord
+
+log = logging.getLogger(__name__)
+
+# Largest attachment relayed, in bytes (Discord's upload limit without boosts)
+MAX_ATTACHMENT_SIZE = 10 * 1024 * 1024
+
+# Size of the chunks read from the CDN
+CHUNK_SIZE = 64 * 1024
+
+# Downloads are kept in memory up to this size, and spooled to a temporary file beyond it
+SPOOL_SIZE = 1024 * 1024
+
+# Total size of the downloaded attachments kept for reuse, in memory and on disk
+CACHE_SIZE = 64 * 1024 * 1024
+
+# Maximum number of attachments downloading at once
+DOWNLOAD_CONCURRENCY = 4
+
+
+class AttachmentTooLarge(Exception):
+    """Raised when an attachment is larger than the relay allows."""
+
+
+class CachedAttachment:
+    """A downloaded attachment, held in memory or in a temporary file."""
+
+    __slots__ = ("digest", "filename", "size", "spoiler", "data", "path", "opened")
+
+    def __init__(self, digest: str, filename: str, size: int, spoiler: bool,
+                 data: Optional[bytes] = None, path: Optional[Path] = None,
+                 opened: Optional[Callable[[str], None]] = None) -> None:
+        self.digest = digest
+        self.filename = filename
+        self.size = size
+        self.spoiler = spoiler
+        self.data = data
+        self.path = path
+        # Called with the digest every time the attachment is opened for an upload
+        self.opened = opened
+
+    def file(self) -> discord.File:
+        """Return a new discord.File for one upload of the attachment.
+
+        Raises:
+            OSError: If the temporary file was already removed from the cache.
+        """
+        if self.data is not None:
+            file = discord.File(BytesIO(self.data), filename=self.filename, spoiler=self.spoiler)
+        else:
+            # Once open, the upload can still read the file if it is removed from the cache
+            file = discord.File(str(self.path), filename=self.filename, spoiler=self.spoiler)
+        if self.opened is not None:
+            self.opened(self.digest)
+        return file
+
+    def discard(self) -> None:
+        """Remove the temporary file, if any."""
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+
+
+class AttachmentCache:
+    """Downloads attachments once each and keeps them for the sends that relay them."""
+
+    def __init__(self, max_size: int = MAX_ATTACHMENT_SIZE, cache_size: int = CACHE_SIZE,
+                 concurrency: int = DOWNLOAD_CONCURRENCY,
+                 session_factory: Callable[[], aiohttp.ClientSession] = aiohttp.ClientSession) -> None:
+        """Initialize the cache.
+
+        Args:
+            max_size (int): Largest attachment downloaded, in bytes.
+            cache_size (int): Total size of the attachments kept, in bytes.
+            concurrency (int): Maximum number of attachments downloading at once.
+            session_factory (Callable[[], aiohttp.ClientSession]): Creates the HTTP session.
+        """
+        self.max_size = max_size
+        self.cache_size = cache_size
+        self.session_factory = session_factory
+        self.downloads = 0
+        self.reused = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Digest -> attachment, least recently used first
+        self._entries: OrderedDict[str, CachedAttachment] = OrderedDict()
+        self._size = 0
+        # Attachment id -> download (or finished download) of that attachment
+        self._fetches: dict[int, asyncio.Task] = {}
+        # Digest -> number of sends that have yet to open the attachment, and attachment id ->
+        # the same for downloads still in progress
+        self._pins: Counter[str] = Counter()
+        self._pending_pins: Counter[int] = Counter()
+
+    def too_large(self, attachment: discord.Attachment) -> bool:
+        """Return whether an attachment is declared larger than the relay allows."""
+        return attachment.size > self.max_size
+
+    def fetch(self, attachment: discord.Attachment, sends: int = 1) -> "asyncio.Task[CachedAttachment]":
+        """Start downloading an attachment, or return the download already started for it.
+
+        The returned task can be awaited by any number of sends. The attachment is kept in the
+        cache until it has been opened (with CachedAttachment.file) `sends` times.
+
+        Args:
+            attachment (discord.Attachment): The attachment to download.
+            sends (int): Number of sends the attachment is fetched for.
+        """
+        task = self._fetches.get(attachment.id)
+        if task is None:
+            task = asyncio.create_task(self._download(attachment.id, attachment.url, attachment.filename,
+                                                      attachment.is_spoiler()))
+            self._fetches[attachment.id] = task
+            task.add_done_callback(lambda done: self._fetch_done(attachment.id, done))
+        if sends and not task.done():
+            self._pending_pins[attachment.id] += sends
+        elif sends and not task.cancelled() and task.exception() is None:
+            self._pins[task.result().digest] += sends
+        return task
+
+    def _fetch_done(self, attachment_id: int, task: asyncio.Task) -> None:
+        # Failed downloads are not cached, so that a later relay of the attachment can retry
+        if task.cancelled() or task.exception() is not None:
+            self._fetches.pop(attachment_id, None)
+            self._pending_pins.pop(attachment_id, None)
+
+    def _opened(self, digest: str) -> None:
+        """Unpin an attachment opened by one of its sends, evicting it if the cache is full."""
+        if self._pins[digest] > 1:
+            self._pins[digest] -= 1
+            return
+        self._pins.pop(digest, None)
+        self._shrink()
+
+    async def _download(self, attachment_id: int, url: str, filename: str, spoiler: bool) -> CachedAttachment:
+        if self._session is None or self._session.closed:
+            self._session = self.session_factory()
+        async with self._semaphore:
+            digest = hashlib.sha256()
+            buffer, spool, size = BytesIO(), None, 0
+            try:
+                async with self._session.get(url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_size:
+                            raise AttachmentTooLarge(f"{filename} is larger than {self.max_size} bytes")
+                        digest.update(chunk)
+                        if spool is None and buffer.tell() + len(chunk) > SPOOL_SIZE:
+                            # File I/O runs on a thread, so a slow disk never blocks the event loop
+                            spool = await asyncio.to_thread(tempfile.NamedTemporaryFile, prefix="attachment-",
+                                                            delete=False)
+                            await asyncio.to_thread(spool.write, buffer.getvalue())
+                            buffer = None
+                        if spool is not None:
+                            await asyncio.to_thread(spool.write, chunk)
+                        else:
+                            buffer.write(chunk)
+            except BaseException:
+                if spool is not None:
+                    spool.close()
+                    os.unlink(spool.name)
+                raise
+            if spool is not None:
+                await asyncio.to_thread(spool.close)
+            self.downloads += 1
+        entry = CachedAttachment(digest.hexdigest(), filename, size, spoiler,
+                                 data=buffer.getvalue() if buffer is not None else None,
+                                 path=Path(spool.name) if spool is not None else None, opened=self._opened)
+        pins = self._pending_pins.pop(attachment_id, 0)
+        if pins:
+            self._pins[entry.digest] += pins
+        return self._store(entry)
+
+    def _store(self, entry: CachedAttachment) -> CachedAttachment:
+        """Add a download to the cache, reusing an identical one if already cached."""
+        existing = self._entries.get(entry.digest)
+        if existing is not None:
+            entry.discard()
+            self._entries.move_to_end(entry.digest)
+            self.reused += 1
+            if (existing.filename, existing.spoiler) == (entry.filename, entry.spoiler):
+                return existing
+            # Same content under another name, sharing the cached copy
+            return CachedAttachment(existing.digest, entry.filename, existing.size, entry.spoiler,
+                                    data=existing.data, path=existing.path, opened=self._opened)
+        self._entries[entry.digest] = entry
+        self._size += entry.size
+        self._shrink(keep=entry.digest)
+        return entry
+
+    def _shrink(self, keep: Optional[str] = None) -> None:
+        """Evict the least recently used attachments until the cache fits, skipping pinned ones."""
+        for digest in list(self._entries):
+            if self._size <= self.cache_size:
+                return
+            if digest != keep and not self._pins[digest]:
+                self._evict(digest)
+
+    def _evict(self, digest: str) -> None:
+        entry = self._entries.pop(digest)
+        self._size -= entry.size
+        entry.discard()
+        for attachment_id, task in list(self._fetches.items()):
+            if task.done() and not task.cancelled() and task.exception() is None and \
+                    task.result().digest == digest:
+                del self._fetches[attachment_id]
+
+    def stats(self) -> dict:
+        """Return download and cache counters as a dictionary."""
+        return {
+            "downloads": self.downloads,
+            "reused": self.reused,
+            "cached": len(self._entries),
+            "cached_bytes": self._size,
+            "pinned": len(self._pins),
+        }
+
+    async def close(self) -> None:
+        """Close the HTTP session and remove every temporary file."""
+        if self._session is not None:
+            await self._session.close()
+        for digest in list(self._entries):
+            self._evict(digest)
+        self._pins.clear()
+        self._pending_pins.clear()
@@ -0,0 +1,267 @@
+"""Exporting a collection to a compressed file, and restoring it.
+
+An export is a gzip-compressed file of JSON lines (MongoDB Extended JSON, so ObjectIds, dates
+and 64-bit integers survive the round trip):
+
+    {"export": {...}}             header: format version, collection, batch size, export id
+    {...}                         one line per document, batch_size lines per batch
+    {"batch": {"number": 0, "count": ..., "sha256": ...}}
+    ...
+    {"end": {"batches": ..., "documents": ...}}
+
+Documents are read through a batched cursor and written batch by batch, and restores read and
+insert one batch at a time, so memory use does not grow with the collection. Each batch is
+verified against its checksum before it is inserted. A restore records the last inserted batch
+in a progress file next to the export, and an interrupted restore resumes after it.
+
+Restores insert documents as they are, so the bot should be stopped while restoring its own
+collections; its caches and indexes are rebuilt at startup. An export can also be loaded into
+the in-process stand-in database, to run the bot or benchmarks locally against production-sized
+data (set the `memory_db_seed` environment variable to the export's path).
+
+Run with:
+    python backup.py export characters.jsonl.gz [--collection characters] [--batch-size 1000]
+    python backup.py restore characters.jsonl.gz [--collection characters] [--drop]
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Iterator, Optional
+
+from bson import json_util
+from pymongo.errors import BulkWriteError
+
+log = logging.getLogger(__name__)
+
+# Version of the export format
+FORMAT_VERSION = 1
+
+# Documents per batch (and per checksum) when exporting
+DEFAULT_BATCH_SIZE = 1000
+
+# Extended JSON that keeps every BSON type, so documents are restored exactly as exported
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+# Error code of a duplicate key
+DUPLICATE_KEY = 11000
+
+
+class ExportError(Exception):
+    """Raised when an export file is malformed, truncated or fails a checksum."""
+
+
+def _line(document: dict) -> bytes:
+    return json_util.dumps(document, json_options=JSON_OPTIONS).encode() + b"\n"
+
+
+def export_collection(collection: Any, path: str, batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """Write every document of a collection to a compressed export file.
+
+    The file is written under a temporary name and renamed once complete, so a failed export
+    never leaves a truncated file behind under the final name.
+
+    Args:
+        collection (Any): A pymongo Collection or MemoryCollection.
+        path (str): The file to write.
+        batch_size (int): Documents per batch; also the cursor batch size.
+
+    Returns:
+        dict: The export's "end" record, with the number of batches and documents.
+    """
+    header = {"format": FORMAT_VERSION, "collection": collection.name, "batch_size": batch_size,
+              "id": uuid.uuid4().hex, "exported_at": datetime.now(timezone.utc).isoformat()}
+    temporary = f"{path}.partial"
+    batches = documents = 0
+    with gzip.open(temporary, "wb") as output:
+        output.write(_line({"export": header}))
+        batch, digest = 0, hashlib.sha256()
+
+        def end_batch() -> None:
+            nonlocal batch, digest, batches
+            output.write(_line({"batch": {"number": batches, "count": batch, "sha256": digest.hexdigest()}}))
+            batches += 1
+            batch, digest = 0, hashlib.sha256()
+
+        for document in collection.find({}, sort=[("_id", 1)], batch_size=batch_size):
+            line = _line(document)
+            output.write(line)
+            digest.update(line)
+            batch += 1
+            documents += 1
+            if batch == batch_size:
+                end_batch()
+        if batch:
+            end_batch()
+        end = {"batches": batches, "documents": documents}
+        output.write(_line({"end": end}))
+    os.replace(temporary, path)
+    return end
+
+
+def read_batches(path: str) -> Iterator[tuple[dict, int, list[dict]]]:
+    """Yield the header, number and documents of each batch of an export, verifying checksums.
+
+    Raises:
+        ExportError: If the file is not an export, is truncated, or a batch fails its checksum.
+    """
+    with gzip.open(path, "rb") as export:
+        first = export.readline()
+        try:
+            header = json_util.loads(first, json_options=JSON_OPTIONS)["export"]
+        except (ValueError, KeyError):
+            raise ExportError(f"{path} is not an export") from None
+        if header.get("format") != FORMAT_VERSION:
+            raise ExportError(f"{path} has unsupported format {header.get('format')}")
+        batch, digest, number = [], hashlib.sha256(), 0
+        for line in export:
+            record = json_util.loads(line, json_options=JSON_OPTIONS)
+            if "batch" in record and len(record) == 1:
+                check = record["batch"]
+                if check["number"] != number or check["count"] != len(batch) or \
+                        check["sha256"] != digest.hexdigest():
+                    raise ExportError(f"batch {number} of {path} failed its checksum")
+                yield header, number, batch
+                batch, digest, number = [], hashlib.sha256(), number + 1
+            elif "end" in record and len(record) == 1:
+                if batch or record["end"]["batches"] != number:
+                    raise ExportError(f"{path} ends with an incomplete batch")
+                return
+            else:
+                digest.update(line)
+                batch.append(record)
+    raise ExportError(f"{path} is truncated after batch {number - 1}")
+
+
+def _read_progress(progress_path: str, export_id: str) -> int:
+    """Return the number of batches already restored from the export, according to the progress file."""
+    try:
+        with open(progress_path) as progress_file:
+            progress = json.load(progress_file)
+    except FileNotFoundError:
+        return 0
+    if progress.get("id") != export_id:
+        log.warning("Ignoring %s, which records the restore of another export", progress_path)
+        return 0
+    return progress["batches"]
+
+
+def _write_progress(progress_path: str, export_id: str, batches: int, documents: int) -> None:
+    temporary = f"{progress_path}.tmp"
+    with open(temporary, "w") as progress_file:
+        json.dump({"id": export_id, "batches": batches, "documents": documents}, progress_file)
+    os.replace(temporary, progress_path)
+
+
+def _already_restored(failure: dict) -> bool:
+    """Return whether a write error is a duplicate _id, i.e. a document already restored."""
+    if failure.get("code") != DUPLICATE_KEY:
+        return False
+    key_pattern = failure.get("keyPattern")
+    if key_pattern is not None:
+        return list(key_pattern) == ["_id"]
+    # Servers before 4.4 only name the index in the message
+    return "index: _id_ " in failure.get("errmsg", "")
+
+
+def _insert_batch(collection: Any, documents: list[dict]) -> int:
+    """Insert a batch, skipping documents already present, and return how many were inserted.
+
+    Raises:
+        BulkWriteError: If a document could not be inserted for another reason than its _id
+            being present, e.g. it clashes with another document on a unique index.
+    """
+    try:
+        return len(collection.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as error:
+        # Documents with an _id already present are left over from an interrupted restore of
+        # this batch; any other failure (even a duplicate key on another index) is an error
+        failures = [failure for failure in error.details.get("writeErrors", [])
+                    if not _already_restored(failure)]
+        if failures:
+            raise
+        return error.details.get("nInserted", 0)
+
+
+def restore_collection(collection: Any, path: str, drop: bool = False, resumable: bool = True,
+                       progress_path: Optional[str] = None) -> dict:
+    """Insert the documents of an export into a collection, resuming an interrupted restore.
+
+    Args:
+        collection (Any): A pymongo Collection or MemoryCollection.
+        path (str): The export file.
+        drop (bool): Delete every document of the collection first. Ignored when resuming.
+        resumable (bool): Record the restore's progress, and resume from it. Restores into the
+            in-process stand-in, which does not outlive the process, need not be resumable.
+        progress_path (Optional[str]): The file recording the restore's progress; defaults to
+            the export's path with a .progress suffix.
+
+    Returns:
+        dict: The number of batches and documents restored, and of batches skipped as already
+            restored.
+
+    Raises:
+        ExportError: If the export is malformed or fails a checksum. Batches before the bad one
+            stay restored, and are skipped when the restore is run again.
+        BulkWriteError: If a document clashes with an existing one other than by _id (e.g. on
+            a unique index, when restoring into a non-empty collection without dropping it).
+    """
+    progress_path = progress_path or f"{path}.progress"
+    restored = inserted = skipped = 0
+    done = None
+    for header, number, documents in read_batches(path):
+        if done is None:
+            done = _read_progress(progress_path, header["id"]) if resumable else 0
+            if done:
+                log.info("Resuming the restore of %s after batch %d", path, done - 1)
+            elif drop:
+                collection.delete_many({})
+        if number < done:
+            skipped += 1
+            continue
+        inserted += _insert_batch(collection, documents)
+        restored += 1
+        if resumable:
+            _write_progress(progress_path, header["id"], number + 1, inserted)
+    if resumable and os.path.exists(progress_path):
+        os.remove(progress_path)
+    return {"batches": restored, "documents": inserted, "skipped_batches": skipped}
+
+
+def main(arguments: list[str]) -> None:
+    parser = argparse.ArgumentParser(description="Export a collection to a file, or restore it.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write a collection to a compressed file")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--collection", default="characters")
+    export_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    restore_parser = commands.add_parser("restore", help="insert the documents of an export")
+    restore_parser.add_argument("path")
+    restore_parser.add_argument("--collection", default="characters")
+    restore_parser.add_argument("--drop", action="store_true", help="delete the existing documents first")
+    options = parser.parse_args(arguments)
+    logging.basicConfig(level=logging.INFO)
+
+    from config import get_database
+
+    collection = get_database()[options.collection]
+    started = time.perf_counter()
+    if options.command == "export":
+        result = export_collection(collection, options.path, options.batch_size)
+        print(f"Exported {result['documents']} documents in {result['batches']} batches "
+              f"in {time.perf_counter() - started:.2f}s")
+    else:
+        result = restore_collection(collection, options.path, drop=options.drop)
+        print(f"Restored {result['documents']} documents in {result['batches']} batches "
+              f"({result['skipped_batches']} already restored) in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,358 @@
+"""Benchmarks for the bot's hot paths.
+
+Run with:
+    python benchmark.py [characters]
+
+Benchmarks the vectorized stat decay tick against an equivalent per-document loop, checking
+that both produce the same stats, batched relationship updates against nested dicts, room
+relay throughput as the bot alone against a webhook pool, attachment relaying against a
+local stand-in for Discord's CDN, batched event log writes and replay against one insert per
+event, and broadcast delivery against one DM at a time.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import discord
+import numpy as np
+
+from attachments import CHUNK_SIZE, AttachmentCache
+from broadcasts import BroadcastPipeline
+from engine import BASE_DECAY, MAX_STAT, MAX_TRAIT_POINTS, ROOM_RECOVERY, STATS, TRAIT_WEIGHTS, StatDecayEngine, \
+    decay_step
+from events import CHARACTER_SAVED, EventLog, replay
+from outbound import CHANNEL_PER, CHANNEL_RATE, DM_GLOBAL_PER, DM_GLOBAL_RATE, DirectMessageFanout, OutboundRelay, \
+    send_as_bot
+from relationships import MAX_SCORE, MIN_SCORE, RelationshipMatrix
+from store import CharacterStore, MemoryDatabase
+from tests.cdn import StandInAttachment, StandInCDN
+from tests.fakes import FakeClient, FakeRoom, http_error
+from webhooks import POOL_PER, POOL_RATE, WEBHOOKS_PER_ROOM, WebhookPool
+
+TRAITS = list(TRAIT_WEIGHTS)
+
+
+def random_characters(count: int, seed: int = 0) -> list[dict]:
+    """Return `count` random character documents."""
+    rng = random.Random(seed)
+    rooms = list(ROOM_RECOVERY) + ["jury-chat"]
+    return [{
+        "_id": str(index),
+        "character_name": f"Character {index}",
+        "portrait_emoji_pair": index,
+        "current_room": rng.choice(rooms),
+        "status": "in house",
+        "traits": {trait: rng.randint(0, MAX_TRAIT_POINTS) for trait in TRAITS},
+        "stats": {stat: rng.randint(0, MAX_STAT) for stat in STATS},
+    } for index in range(count)]
+
+
+def decay_loop(characters: list[dict]) -> list[dict]:
+    """Reference implementation of one tick, one document at a time."""
+    result = []
+    for character in characters:
+        recovery = ROOM_RECOVERY.get(character["current_room"], [0.0] * len(STATS))
+        stats = {}
+        for column, stat in enumerate(STATS):
+            rate = 1.0 + sum(character["traits"][trait] / MAX_TRAIT_POINTS * TRAIT_WEIGHTS[trait][column]
+                             for trait in TRAITS)
+            value = character["stats"][stat] - BASE_DECAY[column] * max(rate, 0.0) + recovery[column]
+            stats[stat] = min(max(int(np.floor(value + 0.5)), 0), MAX_STAT)
+        result.append({**character, "stats": stats})
+    return result
+
+
+def best_of(function, repeat: int = 5) -> float:
+    """Return the fastest of `repeat` timed calls of the function, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def bench_stat_decay(count: int) -> None:
+    """Compare the vectorized tick against the per-document loop."""
+    characters = random_characters(count)
+    engine = StatDecayEngine(store=None, traits=TRAITS)
+
+    def vectorized() -> np.ndarray:
+        stats, traits, rooms = engine.columns(characters)
+        return decay_step(stats, traits, rooms, engine.trait_weights, engine.room_recovery)
+
+    expected = np.array([[character["stats"][stat] for stat in STATS] for character in decay_loop(characters)])
+    assert np.array_equal(vectorized(), expected), "vectorized tick differs from the per-document loop"
+
+    stats, traits, rooms = engine.columns(characters)
+    step_seconds = best_of(lambda: decay_step(stats, traits, rooms, engine.trait_weights, engine.room_recovery))
+    vectorized_seconds = best_of(vectorized)
+    loop_seconds = best_of(lambda: decay_loop(characters))
+    print(f"stat decay, {count} characters:")
+    print(f"  per-document loop        {loop_seconds * 1000:8.2f} ms")
+    print(f"  vectorized (with arrays) {vectorized_seconds * 1000:8.2f} ms  ({loop_seconds / vectorized_seconds:.1f}x)")
+    print(f"  vectorized (step only)   {step_seconds * 1000:8.2f} ms  ({loop_seconds / step_seconds:.1f}x)")
+
+
+def bench_relationships(count: int, interactions: int = 100_000) -> None:
+    """Compare batched matrix updates against per-document nested relationship dicts."""
+    rng = np.random.default_rng(0)
+    sources = rng.integers(0, count, interactions)
+    targets = rng.integers(0, count, interactions)
+    deltas = rng.integers(-5, 6, interactions)
+
+    def nested() -> list[dict]:
+        relationships = [{} for _ in range(count)]
+        for source, target, delta in zip(sources.tolist(), targets.tolist(), deltas.tolist()):
+            value = relationships[source].get(target, 0) + delta
+            relationships[source][target] = value
+        for row in relationships:
+            for target, value in row.items():
+                row[target] = min(max(value, MIN_SCORE), MAX_SCORE)
+        return relationships
+
+    def batched() -> RelationshipMatrix:
+        matrix = RelationshipMatrix(count)
+        matrix.apply_interactions(sources, targets, deltas)
+        return matrix
+
+    matrix, relationships = batched(), nested()
+    assert all(matrix.get(source, target) == value
+               for source, row in enumerate(relationships) for target, value in row.items()), \
+        "batched relationship updates differ from nested dicts"
+
+    nested_seconds = best_of(nested)
+    batched_seconds = best_of(batched)
+    print(f"relationships, {count} characters, {interactions} interactions:")
+    print(f"  nested dicts             {nested_seconds * 1000:8.2f} ms")
+    print(f"  batched matrix           {batched_seconds * 1000:8.2f} ms  ({nested_seconds / batched_seconds:.1f}x)")
+    print(f"  matrix size              {len(matrix.to_bytes()) / 1024:8.1f} KiB")
+
+
+async def relay_throughput(sender, room, rate: float, per: float, messages: int, authors: int,
+                           time_scale: float) -> float:
+    """Return the messages per (unscaled) second one busy room achieves through the sender."""
+    posted = asyncio.Event()
+    sent = 0
+
+    async def counting_sender(destination, content: str, author, files=()) -> None:
+        nonlocal sent
+        await sender(destination, content, author, files)
+        sent += content.count("\n") + 1
+        if sent == messages:
+            posted.set()
+
+    relay = OutboundRelay(counting_sender, rate=rate, per=per * time_scale)
+    started = time.perf_counter()
+    for index in range(messages):
+        relay.send(room, f"message {index}", author=(f"Character {index % authors}", None))
+    await posted.wait()
+    return messages / ((time.perf_counter() - started) / time_scale)
+
+
+async def pool_throughput(messages: int, authors: int, time_scale: float, manage_webhooks: bool = True,
+                          deleted: bool = False) -> float:
+    """Return the throughput of a room relaying through WebhookPool.send.
+
+    Args:
+        manage_webhooks (bool): Whether the bot may use webhooks in the room; if not, every
+            message falls back to being sent as the bot.
+        deleted (bool): Whether the room's webhooks are deleted just before the relay starts, so
+            the first send fails with NotFound and is retried through new webhooks.
+    """
+    client = FakeClient()
+    pool = WebhookPool(client)
+    room = FakeRoom(client.user, manage_webhooks=manage_webhooks)
+    if deleted:
+        for webhook in await pool.webhooks_for(room):
+            webhook.errors.append(http_error(discord.NotFound, 404, "Unknown Webhook"))
+        room.hooks.clear()
+    throughput = await relay_throughput(pool.send, room, POOL_RATE, POOL_PER, messages, authors, time_scale)
+    if deleted:
+        assert room.created == 2 * pool.size, "deleted webhooks were not replaced"
+    assert manage_webhooks or room.id in pool.unavailable, "the bot did not fall back to sending itself"
+    return throughput
+
+
+def bench_relay(messages: int = 200, authors: int = 8, time_scale: float = 0.01) -> None:
+    """Compare room relay throughput as the bot alone against WebhookPool.send on fake webhooks.
+
+    The pool is also run in a room where the bot cannot manage webhooks (falling back to sending
+    as the bot) and with its webhooks deleted (retrying through new ones). Rate limit windows are
+    shortened by time_scale, so a run takes seconds instead of minutes.
+    """
+    bot_room = FakeRoom(FakeClient().user)
+    bot = asyncio.run(relay_throughput(send_as_bot, bot_room, CHANNEL_RATE, CHANNEL_PER, messages, authors,
+                                       time_scale))
+    pool = asyncio.run(pool_throughput(messages, authors, time_scale))
+    forbidden = asyncio.run(pool_throughput(messages, authors, time_scale, manage_webhooks=False))
+    deleted = asyncio.run(pool_throughput(messages, authors, time_scale, deleted=True))
+    print(f"room relay, {messages} messages from {authors} characters:")
+    print(f"  bot only                 {bot:8.2f} messages/s")
+    print(f"  webhook pool ({WEBHOOKS_PER_ROOM})        {pool:8.2f} messages/s  ({pool / bot:.1f}x)")
+    print(f"  without Manage Webhooks  {forbidden:8.2f} messages/s  ({forbidden / bot:.1f}x)")
+    print(f"  webhooks deleted         {deleted:8.2f} messages/s  ({deleted / bot:.1f}x)")
+
+
+async def relay_attachments(cdn: StandInCDN, players: int, file_size: int,
+                            destinations: int) -> tuple[float, int, dict]:
+    """Relay one file per player to every destination, returning the time, peak memory and stats."""
+    attachments = [cdn.attachment(os.urandom(file_size), f"{player}.bin") for player in range(players)]
+    cache = AttachmentCache()
+    try:
+        tracemalloc.start()
+        started = time.perf_counter()
+
+        async def relay(attachment: StandInAttachment) -> None:
+            download = cache.fetch(attachment, sends=destinations)
+            for _ in range(destinations):
+                file = (await download).file()
+                while file.fp.read(CHUNK_SIZE):
+                    pass
+                file.close()
+
+        await asyncio.gather(*(relay(attachment) for attachment in attachments))
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed, peak, cache.stats()
+    finally:
+        await cache.close()
+
+
+def bench_attachments(players: int = 8, file_size: int = 8 * 1024 * 1024, destinations: int = 6) -> None:
+    """Relay a large file from several players at once, reporting peak memory and downloads."""
+    with StandInCDN() as cdn:
+        elapsed, peak, stats = asyncio.run(relay_attachments(cdn, players, file_size, destinations))
+    total = players * file_size
+    print(f"attachments, {players} players sending {file_size // (1024 * 1024)} MiB to {destinations} destinations:")
+    print(f"  relayed                  {elapsed * 1000:8.2f} ms")
+    print(f"  downloads                {stats['downloads']:8d}     ({players * destinations} sends)")
+    print(f"  peak traced memory       {peak / 1024 / 1024:8.2f} MiB ({total / 1024 / 1024:.0f} MiB of files)")
+
+
+class SlowCollection:
+    """Forwards to a MemoryCollection, sleeping on every call as if it were a database round trip."""
+
+    def __init__(self, collection, latency: float) -> None:
+        self.collection = collection
+        self.latency = latency
+        self.calls = 0
+
+    def __getattr__(self, name: str):
+        method = getattr(self.collection, name)
+
+        def call(*args, **kwargs):
+            self.calls += 1
+            time.sleep(self.latency)
+            return method(*args, **kwargs)
+
+        return call
+
+
+async def log_events(characters: list[dict], writes: int, latency: float) -> tuple[float, float, float, int]:
+    """Record `writes` character writes one insert at a time and batched, then replay them.
+
+    Returns:
+        tuple[float, float, float, int]: Seconds for single inserts, batched inserts and replay,
+            and the number of insert_many calls.
+    """
+    rng = random.Random(0)
+    changes = [dict(rng.choice(characters), stats={stat: rng.randint(0, MAX_STAT) for stat in STATS})
+               for _ in range(writes)]
+    database = MemoryDatabase()
+    store = CharacterStore(database["characters"])
+
+    single = SlowCollection(database["single_events"], latency)
+    started = time.perf_counter()
+    for sequence, character in enumerate(changes, 1):
+        await store.run(single.insert_one, {"_id": sequence, "seq": sequence, "type": CHARACTER_SAVED,
+                                            "character_id": character["_id"], "data": character})
+    single_seconds = time.perf_counter() - started
+
+    event_log = EventLog(store, database["events"], database["event_snapshots"], flush_interval=3600)
+    await event_log.load()
+    # MemoryCollection checks unique indexes by scanning every document, unlike a database, and
+    # the single inserts above have no index either
+    database["events"].drop_index("seq_1")
+    events = event_log.collection = SlowCollection(database["events"], latency)
+    started = time.perf_counter()
+    for character in changes:
+        event_log.character_written(character["_id"], character)
+        await asyncio.sleep(0)
+    await event_log.flush()
+    batched_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    state = await event_log.rebuild()
+    replay_seconds = time.perf_counter() - started
+    expected = replay([], ({"type": CHARACTER_SAVED, "character_id": character["_id"], "data": character}
+                           for character in changes))
+    assert state == expected, "replayed state differs from the recorded writes"
+    store.close()
+    # Less the find_one and find of the rebuild
+    return single_seconds, batched_seconds, replay_seconds, events.calls - 2
+
+
+def bench_event_log(count: int, writes: int = 5000, latency: float = 0.0005) -> None:
+    """Compare batched event log writes against one insert per event, and time a full replay."""
+    single, batched, replayed, calls = asyncio.run(log_events(random_characters(count), writes, latency))
+    print(f"event log, {writes} character writes, {latency * 1000:.1f} ms per round trip:")
+    print(f"  one insert per event     {single * 1000:8.2f} ms  ({writes} inserts)")
+    print(f"  batched inserts          {batched * 1000:8.2f} ms  ({calls} insert_many calls)")
+    print(f"  replay                   {replayed * 1000:8.2f} ms")
+
+
+async def deliver_broadcast(players: int, latency: float, time_scale: float) -> tuple[float, float]:
+    """Return the (unscaled) seconds taken to DM every player one at a time and through the pipeline."""
+    database = MemoryDatabase()
+    store = CharacterStore(database["characters"])
+    database["characters"].insert_many([{"_id": str(user_id), "game_id": "default", "status": "in house"}
+                                        for user_id in range(1, players + 1)])
+
+    class StandInClient:
+        async def create_dm(self, user):
+            return user
+
+    async def sender(destination, content: str, author, files=()) -> None:
+        await asyncio.sleep(latency * time_scale)
+
+    started = time.perf_counter()
+    for _ in range(players):
+        await sender(None, "announcement", None)
+    sequential = (time.perf_counter() - started) / time_scale
+
+    fanout = DirectMessageFanout(StandInClient(), rate=DM_GLOBAL_RATE, per=DM_GLOBAL_PER * time_scale)
+    pipeline = BroadcastPipeline(store, database["broadcasts"], fanout, str, sender=sender)
+    started = time.perf_counter()
+    broadcast = await pipeline.start("default", "announcement")
+    await broadcast.task
+    pipelined = (time.perf_counter() - started) / time_scale
+    assert broadcast.sent == players, "the broadcast did not reach every player"
+    store.close()
+    return sequential, pipelined
+
+
+def bench_broadcast(players: int = 500, latency: float = 0.15, time_scale: float = 0.05) -> None:
+    """Compare broadcast delivery against sending one DM at a time.
+
+    Send latency and the rate limit window are shortened by time_scale, so a run takes seconds.
+    """
+    sequential, pipelined = asyncio.run(deliver_broadcast(players, latency, time_scale))
+    print(f"broadcast to {players} players, {latency * 1000:.0f} ms per DM:")
+    print(f"  one DM at a time         {sequential:8.2f} s")
+    print(f"  pipeline                 {pipelined:8.2f} s  ({sequential / pipelined:.1f}x)")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    bench_stat_decay(count)
+    bench_relationships(min(count, 1000))
+    bench_relay()
+    bench_attachments()
+    bench_event_log(min(count, 1000))
+    bench_broadcast()
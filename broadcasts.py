@@ -0,0 +1,243 @@
+"""Announcements delivered by DM to every player of a game.
+
+A broadcast resolves its recipients with one projected query over the characters in the house,
+and is then delivered by a fixed number of workers sharing the global DM rate limit of the
+DirectMessageFanout, so a full cast is reached in seconds rather than one send at a time.
+Sends that fail with a transient error (a server error, a rate limit or a dropped connection)
+are retried with exponential backoff; recipients who cannot be reached (e.g. with DMs closed)
+are marked as failed.
+
+Each broadcast is stored in the broadcasts collection as
+    {"_id": broadcast id, "game_id": ..., "content": ..., "status": "sending" | "done",
+     "recipients": {character id: "pending" | "sent" | "failed"}, "errors": {character id: ...}}
+Recipient statuses are written in batches every STATUS_INTERVAL seconds. Broadcasts still
+sending when the bot stops are resumed at startup, for the recipients still pending, so a
+recipient may get a broadcast twice if the bot stopped just after sending it.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+import aiohttp
+import discord
+
+from outbound import Sender, default_sender, split_content
+from store import CharacterStore
+
+log = logging.getLogger(__name__)
+
+# Broadcast and recipient statuses
+SENDING = "sending"
+DONE = "done"
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+# Number of DMs of a broadcast being sent at once
+BROADCAST_CONCURRENCY = 16
+
+# Attempts per recipient before a transient failure is recorded as a failure
+MAX_ATTEMPTS = 4
+
+# Seconds before the first retry, doubled on every following one
+RETRY_DELAY = 1.0
+
+# Seconds between writes of recipient statuses
+STATUS_INTERVAL = 1.0
+
+
+def is_transient(error: Exception) -> bool:
+    """Return whether a failed send may succeed if retried."""
+    if isinstance(error, discord.HTTPException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+
+class Broadcast:
+    """The delivery of one broadcast in progress."""
+
+    __slots__ = ("broadcast_id", "game_id", "content", "recipients", "pending", "sent", "failed", "started_at",
+                 "task", "_statuses", "_errors")
+
+    def __init__(self, document: dict) -> None:
+        self.broadcast_id = document["_id"]
+        self.game_id = document["game_id"]
+        self.content = document["content"]
+        recipients = document["recipients"]
+        self.recipients = len(recipients)
+        # Recipients not yet being sent to
+        self.pending = deque(character_id for character_id, status in recipients.items() if status == PENDING)
+        self.sent = sum(status == SENT for status in recipients.values())
+        self.failed = sum(status == FAILED for status in recipients.values())
+        self.started_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        # Statuses not written yet
+        self._statuses: dict[str, str] = {}
+        self._errors: dict[str, str] = {}
+
+    @property
+    def finished(self) -> bool:
+        """Whether every recipient has been sent to, or has failed."""
+        return self.sent + self.failed == self.recipients
+
+    def record(self, character_id: str, error: Optional[Exception]) -> None:
+        """Record the outcome of the delivery to a recipient."""
+        if error is None:
+            self.sent += 1
+            self._statuses[character_id] = SENT
+        else:
+            self.failed += 1
+            self._statuses[character_id] = FAILED
+            self._errors[character_id] = str(error)[:200]
+
+    def status_update(self, done: bool = False) -> Optional[dict]:
+        """Return the update writing the recorded statuses, or None if there is nothing to write."""
+        fields = {f"recipients.{character_id}": status for character_id, status in self._statuses.items()}
+        fields.update({f"errors.{character_id}": error for character_id, error in self._errors.items()})
+        if done:
+            fields.update({"status": DONE, "finished_at": datetime.now(timezone.utc)})
+        self._statuses, self._errors = {}, {}
+        return {"$set": fields} if fields else None
+
+
+class BroadcastPipeline:
+    """Delivers broadcasts by DM, records each recipient's status and resumes unfinished broadcasts."""
+
+    def __init__(self, store: CharacterStore, collection: Any, fanout: Any,
+                 decrypt: Callable[[str], str], sender: Sender = default_sender,
+                 concurrency: int = BROADCAST_CONCURRENCY, attempts: int = MAX_ATTEMPTS,
+                 retry_delay: float = RETRY_DELAY, status_interval: float = STATUS_INTERVAL) -> None:
+        """Initialize the pipeline.
+
+        Args:
+            store (CharacterStore): The character store, whose thread pool also runs the
+                broadcasts collection's driver calls.
+            collection (Any): The broadcasts collection.
+            fanout (Any): The DirectMessageFanout whose DM channels and global rate limit are
+                shared with relayed DMs.
+            decrypt (Callable[[str], str]): Returns the discord user id of a character id.
+            sender (Sender): Coroutine function that delivers one message.
+            concurrency (int): Number of DMs of a broadcast being sent at once.
+            attempts (int): Attempts per recipient before a transient failure is recorded.
+            retry_delay (float): Seconds before the first retry, doubled on every following one.
+            status_interval (float): Seconds between writes of recipient statuses.
+        """
+        self.store = store
+        self.collection = collection
+        self.fanout = fanout
+        self.decrypt = decrypt
+        self.sender = sender
+        self.concurrency = concurrency
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.status_interval = status_interval
+        self.active: dict[str, Broadcast] = {}
+        self.retries = 0
+
+    async def start(self, game_id: str, content: str) -> Broadcast:
+        """Save a broadcast to every character in the house of a game, and start delivering it.
+
+        Args:
+            game_id (str): The game whose players receive the broadcast.
+            content (str): The announcement. Content over Discord's limit is sent in several DMs.
+
+        Returns:
+            Broadcast: The broadcast being delivered; await its task to wait for the delivery.
+        """
+        characters = await self.store.list({"game_id": game_id, "status": "in house"}, {"_id": 1})
+        document = {"_id": uuid.uuid4().hex, "game_id": game_id, "content": content, "status": SENDING,
+                    "created_at": datetime.now(timezone.utc),
+                    "recipients": {character["_id"]: PENDING for character in characters}, "errors": {}}
+        await self.store.run(self.collection.insert_one, document)
+        return self._deliver(document)
+
+    async def resume(self) -> list[Broadcast]:
+        """Resume delivering the broadcasts that were still sending when the bot stopped."""
+        def _unfinished() -> list[dict]:
+            self.collection.create_index("status")
+            return list(self.collection.find({"status": SENDING}))
+
+        broadcasts = []
+        for document in await self.store.run(_unfinished):
+            if document["_id"] not in self.active:
+                broadcast = self._deliver(document)
+                log.info("Resuming broadcast %s to %d remaining players", broadcast.broadcast_id,
+                         len(broadcast.pending))
+                broadcasts.append(broadcast)
+        return broadcasts
+
+    def _deliver(self, document: dict) -> Broadcast:
+        broadcast = Broadcast(document)
+        self.active[broadcast.broadcast_id] = broadcast
+        broadcast.task = asyncio.create_task(self._run(broadcast))
+        return broadcast
+
+    async def _run(self, broadcast: Broadcast) -> None:
+        """Deliver a broadcast to its pending recipients, writing their statuses as they go."""
+        chunks = split_content(broadcast.content)
+
+        async def work() -> None:
+            while broadcast.pending:
+                character_id = broadcast.pending.popleft()
+                broadcast.record(character_id, await self._send(character_id, chunks))
+
+        workers = [asyncio.create_task(work()) for _ in range(min(self.concurrency, len(broadcast.pending)))]
+        writer = asyncio.create_task(self._write_statuses(broadcast))
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # Recipients not reached (e.g. the bot is stopping) stay pending, and are sent to when
+            # the broadcast is resumed
+            for worker in workers:
+                worker.cancel()
+            writer.cancel()
+            update = broadcast.status_update(done=broadcast.finished)
+            if update is not None:
+                await self.store.run(self.collection.update_one, {"_id": broadcast.broadcast_id}, update)
+            del self.active[broadcast.broadcast_id]
+        log.info("Broadcast %s sent to %d of %d players in %.1fs", broadcast.broadcast_id, broadcast.sent,
+                 broadcast.recipients, time.monotonic() - broadcast.started_at)
+
+    async def _write_statuses(self, broadcast: Broadcast) -> None:
+        while True:
+            await asyncio.sleep(self.status_interval)
+            update = broadcast.status_update()
+            if update is not None:
+                try:
+                    await self.store.run(self.collection.update_one, {"_id": broadcast.broadcast_id}, update)
+                except Exception:
+                    log.exception("Failed to save the statuses of broadcast %s", broadcast.broadcast_id)
+
+    async def _send(self, character_id: str, chunks: list[str]) -> Optional[Exception]:
+        """Send the chunks to a character's player, returning the error if it could not be delivered."""
+        sent = 0
+        for attempt in range(self.attempts):
+            try:
+                user_id = int(self.decrypt(character_id))
+                channel = await self.fanout.dm_channel(user_id)
+                # Chunks already sent are not sent again on a retry
+                for chunk in chunks[sent:]:
+                    await self.fanout.limiter.acquire()
+                    await self.sender(channel, chunk, None, ())
+                    sent += 1
+                return None
+            except Exception as error:
+                if not is_transient(error) or attempt == self.attempts - 1:
+                    log.warning("Failed to send a broadcast to %s: %r", character_id, error)
+                    return error
+                self.retries += 1
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    def stats(self) -> dict:
+        """Return the number of broadcasts being delivered and their delivery counters."""
+        return {
+            "active": len(self.active),
+            "pending": sum(broadcast.recipients - broadcast.sent - broadcast.failed
+                           for broadcast in self.active.values()),
+            "retries": self.retries,
+        }
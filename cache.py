@@ -0,0 +1,148 @@
+"""In-process caches used to avoid database round trips on hot paths."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """A thread-safe, size-bounded least-recently-used cache with hit/miss counters."""
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        """Initialize the cache.
+
+        Args:
+            maxsize (int): Maximum number of entries kept before the oldest is evicted.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for the key, counting a hit or a miss."""
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for the key, without counting it or refreshing its position."""
+        with self._lock:
+            return self._entries.get(key, default)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Insert or replace the value for the key, evicting the oldest entry if full."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """Remove the key from the cache, if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Return the cache counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class RenderCache(LRUCache):
+    """Cache of rendered embed payloads, keyed by character id.
+
+    Each entry remembers the fingerprint of the document it was rendered from, so a lookup with
+    an older or newer version of the document misses instead of returning a stale embed.
+    Entries should also be invalidated whenever the character is written.
+    """
+
+    def get_payload(self, character_id: Hashable, fingerprint: Hashable) -> Any:
+        """Return the cached payload if it was rendered from the same fingerprint, else None."""
+        entry = self.get(character_id)
+        if entry is None:
+            return None
+        if entry[0] != fingerprint:
+            # Counted as a hit by get(), but the entry is stale
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return entry[1]
+
+    def put_payload(self, character_id: Hashable, fingerprint: Hashable, payload: Any) -> None:
+        """Cache the payload rendered from the document with the given fingerprint."""
+        self.put(character_id, (fingerprint, payload))
+
+
+class ExpiringValue:
+    """A single cached value that expires after a time to live, or when invalidated.
+
+    Invalidating also discards any value computed from data read before the invalidation:
+    read the generation before computing, and pass it to put().
+    """
+
+    def __init__(self, ttl: float) -> None:
+        """Initialize the cache.
+
+        Args:
+            ttl (float): Seconds a value is kept.
+        """
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._value: Any = None
+        self._expires = 0.0
+
+    def get(self, default: Any = None) -> Any:
+        """Return the cached value, or the default if it expired or was invalidated."""
+        if time.monotonic() < self._expires:
+            self.hits += 1
+            return self._value
+        self.misses += 1
+        return default
+
+    def put(self, value: Any, generation: int) -> None:
+        """Cache a value computed at the given generation, unless it was invalidated since."""
+        if generation == self.generation:
+            self._value = value
+            self._expires = time.monotonic() + self.ttl
+
+    def invalidate(self, *args) -> None:
+        """Discard the cached value. Accepts any arguments, so it can be used as a listener."""
+        self.generation += 1
+        self._value = None
+        self._expires = 0.0
+
+    def stats(self) -> dict:
+        """Return the cache counters as a dictionary."""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / lookups if lookups else 0.0}
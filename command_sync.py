@@ -0,0 +1,76 @@
+"""Syncing the slash command tree only when it has changed.
+
+tree.sync() is slow and globally rate limited, so a stable hash of the command tree is persisted
+locally after each sync, and later syncs are skipped while the hash is unchanged.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+# File holding the hash of the last synced command tree, per scope
+COMMAND_HASH_PATH = Path(__file__).parent / ".command_tree_hash"
+
+
+def command_payload(command: app_commands.Command, tree: app_commands.CommandTree) -> dict:
+    """Return the payload discord.py sends to Discord for a command."""
+    try:
+        return command.to_dict(tree)
+    except TypeError:
+        # discord.py < 2.4 takes no arguments
+        return command.to_dict()
+
+
+def command_tree_hash(tree: app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None) -> str:
+    """Return a stable hash of the commands that would be synced to the given scope.
+
+    Args:
+        tree (app_commands.CommandTree): The command tree.
+        guild (Optional[discord.abc.Snowflake]): The guild to sync to, or None for global commands.
+    """
+    payloads = sorted((command_payload(command, tree) for command in tree.get_commands(guild=guild)),
+                      key=lambda payload: (payload.get("type", 1), payload["name"]))
+    content = json.dumps({"application_id": tree.client.application_id, "commands": payloads},
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _scope(guild: Optional[discord.abc.Snowflake]) -> str:
+    return "global" if guild is None else f"guild:{guild.id}"
+
+
+def _read_hashes() -> dict:
+    try:
+        return json.loads(COMMAND_HASH_PATH.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+async def sync_command_tree(tree: app_commands.CommandTree,
+                            guild: Optional[discord.abc.Snowflake] = None,
+                            force: bool = False) -> bool:
+    """Sync the command tree to Discord, unless it is unchanged since the last sync.
+
+    Args:
+        tree (app_commands.CommandTree): The command tree.
+        guild (Optional[discord.abc.Snowflake]): The guild to sync to (useful for testing, as
+            guild commands update instantly), or None for global commands.
+        force (bool): Sync even if the tree is unchanged.
+
+    Returns:
+        bool: Whether the tree was synced.
+    """
+    if guild is not None:
+        tree.copy_global_to(guild=guild)
+    tree_hash = command_tree_hash(tree, guild)
+    hashes = _read_hashes()
+    if not force and hashes.get(_scope(guild)) == tree_hash:
+        return False
+    await tree.sync(guild=guild)
+    hashes[_scope(guild)] = tree_hash
+    COMMAND_HASH_PATH.write_text(json.dumps(hashes, indent=2))
+    return True
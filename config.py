@@ -5,21 +5,45 @@ Also includes general embeds and functions used across multiple commands.
 This is a parent file to all command files, which is then inherited to main.py.
 """
 
+import asyncio
+import functools
+import logging
 import os
+import sys
+from io import BytesIO
 from pathlib import Path
 from typing import Union, Optional
 
 from abc import ABCMeta, abstractmethod
 import certifi
 import discord.ui
-import pymongo
 from discord import *
 from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
+
+from attachments import MAX_ATTACHMENT_SIZE, AttachmentCache
+from backup import restore_collection
+from broadcasts import Broadcast, BroadcastPipeline
+from cache import ExpiringValue, RenderCache
+from command_sync import sync_command_tree
+from engine import StatDecayEngine
+from games import DEFAULT_GAME_ID, Game, GameRegistry
+from events import BROADCAST_SENT, MESSAGE_RELAYED, EventLog
+from metrics import (DEFAULT_METRICS_PORT, MongoCommandMetrics, RateLimitCounter, registry as metrics,
+                     start_metrics_server, timed)
+from outbound import DirectMessageFanout, OutboundRelay
+from portraits import PortraitAllocator, PortraitAssets, PortraitsExhausted, count_portraits
+from sessions import SESSION_TIMEOUT, SetupSession, SetupSessionManager
+from store import (CharacterStore, LazyCollection, MemoryDatabase, Snapshot, create_mongo_client,
+                   duplicate_key_field)
+from webhooks import POOL_PER, POOL_RATE, WebhookPool
 
 # Set up client and intents for the discord bot
 intents = Intents.default()
 intents.message_content = True
-client = Client(intents=intents)
+# Sharded, so that one process can serve the guilds of many games; with a single guild this
+# is one shard, and behaves like a plain Client
+client = AutoShardedClient(intents=intents)
 
 # Set up command tree for slash commands
 tree = app_commands.CommandTree(client)
@@ -29,8 +53,125 @@ load_dotenv()
 token = os.getenv("token")
 connection_string = os.getenv("connection")
 encryption_key = os.getenv("encryption_key")
-mongo_client = pymongo.MongoClient(connection_string, tlsCAFile=certifi.where())
-characters_db = mongo_client["OI-Big-Brother"]["characters"]
+# Seconds between game ticks evolving character stats; 0 disables the ticks
+tick_interval = float(os.getenv("tick_interval", 0))
+# Sync slash commands even if they have not changed since the last sync
+force_sync = bool(os.getenv("force_sync")) or "--force-sync" in sys.argv
+# Sync slash commands to this guild only, where changes show up instantly (for testing)
+sync_guild = Object(id=int(os.getenv("sync_guild"))) if os.getenv("sync_guild") else None
+# Guild the default game is played in; found from its channels at startup if not set
+default_guild_id = int(os.getenv("default_guild")) if os.getenv("default_guild") else None
+# Port of the metrics endpoint on localhost; 0 disables it
+metrics_port = int(os.getenv("metrics_port", DEFAULT_METRICS_PORT))
+
+# Count the rate limit hits discord.py logs
+logging.getLogger("discord").addHandler(RateLimitCounter())
+
+
+@functools.lru_cache(maxsize=None)
+def get_database():
+    """Return the bot's database, connecting to MongoDB on the first call.
+
+    Nothing connects at import time; the first call is made from on_ready, on the
+    store's thread pool.
+    """
+    if os.getenv("memory_db"):
+        # Run against an in-process stand-in instead of MongoDB (for local testing),
+        # optionally seeded with the characters of an export (see backup.py)
+        database = MemoryDatabase()
+        if os.getenv("memory_db_seed"):
+            restore_collection(database["characters"], os.getenv("memory_db_seed"), resumable=False)
+        return database
+    mongo_client = create_mongo_client(connection_string, tlsCAFile=certifi.where(),
+                                       event_listeners=[MongoCommandMetrics()])
+    return mongo_client["OI-Big-Brother"]
+
+
+characters_db = LazyCollection(get_database, "characters")
+counters_db = LazyCollection(get_database, "counters")
+assets_db = LazyCollection(get_database, "assets")
+setup_sessions_db = LazyCollection(get_database, "setup_sessions")
+relationships_db = LazyCollection(get_database, "relationships")
+events_db = LazyCollection(get_database, "events")
+event_snapshots_db = LazyCollection(get_database, "event_snapshots")
+games_db = LazyCollection(get_database, "games")
+broadcasts_db = LazyCollection(get_database, "broadcasts")
+
+# All commands and views should access characters through this store,
+# so that database calls never block the event loop
+character_store = CharacterStore(characters_db)
+
+# Every game, with the character names (for autocomplete), room occupants and relationship
+# stats of each, rebuilt at startup and kept up to date on every write (including moves).
+# Relationship stats have one row and column per portrait emoji pair of the game
+games = GameRegistry(character_store, games_db, relationships_db, count_portraits())
+character_store.add_listener(games.update)
+
+# Every character write is recorded in the event log, written in batches in the background.
+# Each process logs its own writes, so the change stream (which repeats them) is not logged
+event_log = EventLog(character_store, events_db, event_snapshots_db)
+character_store.add_listener(event_log.character_written, changes=False)
+
+# Hands out portrait emoji pairs without scanning the characters collection
+portrait_allocator = PortraitAllocator(character_store, counters_db)
+
+# Portraits are uploaded once to the asset channel and referenced by URL afterwards
+asset_channel_id = int(os.getenv("asset_channel")) if os.getenv("asset_channel") else None
+portrait_assets = PortraitAssets(character_store, assets_db, asset_channel_id)
+
+# Relayed messages are sent through per-channel queues, in order and under the rate limit.
+# Each room posts through a pool of webhooks, so characters appear under their own name and
+# portrait, under the rate limits of the pool's webhooks and of the channel
+webhook_pool = WebhookPool(client)
+outbound_relay = OutboundRelay(webhook_pool.send, rate=POOL_RATE, per=POOL_PER)
+
+# Relayed messages are also sent by DM to the other characters in the same room
+dm_fanout = DirectMessageFanout(client)
+
+# Attachments relayed to a room and its occupants are downloaded once, and streamed to disk if large
+attachment_cache = AttachmentCache()
+
+
+def collect_metrics():
+    """Yield gauge samples for the caches, indexes and queues defined above."""
+    for name, value in character_store.cache.stats().items():
+        yield f"character_cache_{name}", "Character cache counter", {}, value
+    for game in games:
+        yield "characters", "Characters in the name index", {"game": game.game_id}, len(game.name_index)
+        for room, count in game.room_index.counts().items():
+            yield "room_occupants", "Characters in each room", {"game": game.game_id, "room": room}, count
+    for relay_name, relay in (("room", outbound_relay), ("dm", dm_fanout.relay)):
+        queues = relay.stats().values()
+        yield "relay_queues", "Send queues", {"relay": relay_name}, len(queues)
+        yield "relay_queue_depth", "Messages waiting to be sent", {"relay": relay_name}, \
+            sum(queue["depth"] for queue in queues)
+        yield "relay_failed_posts", "Posts that failed to send", {"relay": relay_name}, \
+            sum(queue["failed_posts"] for queue in queues)
+        yield "relay_latency_max_seconds", "Highest recent delay between enqueuing and sending", \
+            {"relay": relay_name}, max((queue["latency_max"] for queue in queues), default=0.0)
+    for name, value in broadcast_pipeline.stats().items():
+        yield f"broadcast_{name}", "Broadcast delivery counter", {}, value
+    yield "event_log_buffered", "Events waiting to be written", {}, len(event_log)
+    yield "event_log_written", "Events written since startup", {}, event_log.written
+    for name, value in attachment_cache.stats().items():
+        yield f"attachment_{name}", "Attachment cache counter", {}, value
+
+
+metrics.add_collector(collect_metrics)
+
+
+def metrics_embed(count: int = 10) -> Embed:
+    """Return an embed summarizing the slowest handlers, commands and database operations."""
+    embed = Embed(title="Slowest operations (p99)", color=0x00FF00)
+    lines = []
+    for name, labels, histogram in metrics.slowest(count):
+        label = ", ".join(str(value) for value in labels.values())
+        lines.append(f"`{name}` {label}: p50 {histogram.quantile(0.5) * 1000:.0f} ms, "
+                     f"p99 {histogram.quantile(0.99) * 1000:.0f} ms ({histogram.count} calls)")
+    embed.description = "\n".join(lines) if lines else "Nothing has been recorded yet."
+    embed.set_footer(text="The full metrics are attached")
+    return embed
+
 
 COLLABORATORS = [
     214607100582559745,
@@ -44,6 +185,7 @@ COLLABORATORS = [
     225648602578550785
 ]
 
+# Channels of the default game. Other games have their channels in the games collection
 CHANNEL_IDS = {
     "bb-announcements": 1102570924223512619,
     "view-stats": 1102571016531759195,
@@ -64,6 +206,13 @@ no_permission_embed = Embed(
     color=0xFF0000,
 )
 
+# Embed to show when a player sends an attachment too large to relay
+attachment_too_large_embed = Embed(
+    description=f"Attachments larger than {MAX_ATTACHMENT_SIZE // (1024 * 1024)} MB cannot be relayed, "
+                "and were not sent.",
+    color=0xFF0000,
+)
+
 
 def encrypt_id(unencrypted_id: Union[int, str]) -> str:
     """Encrypts the discord user id using the encryption key.
@@ -89,15 +238,37 @@ def decrypt_id(encrypted_id: Union[int, str]) -> str:
     return str(int(encrypted_id) - int(encryption_key))
 
 
-def get_thumbnail_file(portrait_number: int) -> discord.File:
-    """Return the thumbnail file used for each character.
+def default_game() -> Game:
+    """Return the default game, played in the channels of CHANNEL_IDS."""
+    guild_id = default_guild_id
+    if guild_id is None:
+        channel = client.get_channel(CHANNEL_IDS["bb-announcements"])
+        guild_id = channel.guild.id if channel is not None else None
+    return Game(DEFAULT_GAME_ID, guild_id, dict(CHANNEL_IDS))
 
-    Args:
-        portrait_number: (int) portrait number for the character.
 
-    Returns:
-        discord.File: A discord file "image.jpg" with the thumbnail.
+def game_for(interaction: Interaction) -> Optional[Game]:
+    """Return the game an interaction belongs to.
+
+    That is the game of the guild it was used in, or for DMs, the game of the user's character.
+    Without either, it is the default game.
     """
-    thumbnail_path = Path(__file__).parent / f"assets/{portrait_number}.jpg"
-    thumbnail_file = discord.File(thumbnail_path, 'image.jpg')
-    return thumbnail_file
+    return games.for_guild(interaction.guild_id) or games.of(encrypt_id(interaction.user.id)) or \
+        games.get(DEFAULT_GAME_ID)
+
+
+# Announcements are sent by DM to every player of a game, sharing the global DM rate limit with
+# relayed messages, and broadcasts interrupted by a restart are resumed at startup
+broadcast_pipeline = BroadcastPipeline(character_store, broadcasts_db, dm_fanout, decrypt_id)
+
+
+def broadcast_embed(broadcast: Broadcast) -> Embed:
+    """Return an embed reporting the delivery of a broadcast."""
+    if broadcast.finished:
+        embed = Embed(title="Broadcast sent", color=0x00FF00 if not broadcast.failed else 0xFFA500)
+    else:
+        embed = Embed(title="Broadcasting", color=0x00FF00)
+    embed.description = f"Sent to {broadcast.sent} of {broadcast.recipients} players."
+    if broadcast.failed:
+        embed.description += f" {broadcast.failed} could not be reached (e.g. their DMs are closed)."
+    return embed
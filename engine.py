@@ -0,0 +1,129 @@
+"""Periodic game tick evolving every character's stats.
+
+On each tick, all characters in the house are loaded into columnar NumPy arrays, stats decay at
+a rate weighted by each character's traits and recover depending on the room they are in, all
+in one vectorized step. Only characters whose stats changed are written back, in a single
+bulk write.
+"""
+
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+from store import CharacterStore
+
+log = logging.getLogger(__name__)
+
+STATS = ["Hunger", "Energy", "Activity", "Socialization"]
+MAX_STAT = 100
+
+# Points lost per tick for each stat, before trait weighting
+BASE_DECAY = np.array([2.0, 1.5, 1.0, 1.0])
+
+# Change in the decay rate of each stat (columns, in STATS order) per trait (rows) at 20 points.
+# e.g. a character with 20 Strength gets hungry 50% faster, and one with 20 Charisma needs
+# socializing 50% less often.
+TRAIT_WEIGHTS = {
+    "Strength": [0.5, -0.2, -0.3, 0.0],
+    "Dexterity": [0.0, 0.0, -0.4, 0.0],
+    "Constitution": [-0.3, -0.4, 0.0, 0.0],
+    "Intelligence": [0.0, 0.3, 0.0, -0.2],
+    "Charisma": [0.0, 0.0, 0.0, -0.5],
+}
+MAX_TRAIT_POINTS = 20
+
+# Points recovered per tick for each stat while in a room
+ROOM_RECOVERY = {
+    "HoH Bedroom": [0.0, 4.0, 0.0, 0.0],
+    "Bedroom 1": [0.0, 3.0, 0.0, 0.0],
+    "Bedroom 2": [0.0, 3.0, 0.0, 0.0],
+    "Lounge": [0.0, 0.0, 0.0, 3.0],
+    "Kitchen": [5.0, 0.0, 0.0, 1.0],
+    "Backyard": [0.0, 0.0, 3.0, 1.0],
+}
+
+
+def decay_step(stats: np.ndarray, traits: np.ndarray, rooms: np.ndarray,
+               trait_weights: np.ndarray, room_recovery: np.ndarray) -> np.ndarray:
+    """Return the stats after one tick.
+
+    Args:
+        stats (np.ndarray): (characters, stats) array of current stats.
+        traits (np.ndarray): (characters, traits) array of trait points.
+        rooms (np.ndarray): (characters,) array of room indexes into room_recovery.
+        trait_weights (np.ndarray): (traits, stats) array of decay rate changes at max points.
+        room_recovery (np.ndarray): (rooms, stats) array of points recovered per tick.
+    """
+    rate = np.maximum(1.0 + (traits / MAX_TRAIT_POINTS) @ trait_weights, 0.0)
+    updated = stats - BASE_DECAY * rate + room_recovery[rooms]
+    return np.clip(np.floor(updated + 0.5), 0, MAX_STAT)
+
+
+class StatDecayEngine:
+    """Applies decay_step to every character in the house on a fixed interval."""
+
+    def __init__(self, store: CharacterStore, traits: list[str]) -> None:
+        """Initialize the engine.
+
+        Args:
+            store (CharacterStore): The store characters are read from and written to.
+            traits (list[str]): The trait names, in the order their points are given.
+        """
+        self.store = store
+        self.traits = traits
+        self.trait_weights = np.array([TRAIT_WEIGHTS.get(trait, [0.0] * len(STATS)) for trait in traits])
+        self.rooms = list(ROOM_RECOVERY)
+        # Characters in rooms without recovery use the last row, which is all zeros
+        self.room_recovery = np.array([*ROOM_RECOVERY.values(), [0.0] * len(STATS)])
+        self.ticks = 0
+        self.last_tick_seconds = 0.0
+        self.last_tick_updates = 0
+
+    def columns(self, characters: list[dict]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the stats, traits and room index columns for the given characters."""
+        stats = np.array([[character["stats"].get(stat, MAX_STAT) for stat in STATS]
+                          for character in characters], dtype=float).reshape(-1, len(STATS))
+        traits = np.array([[character["traits"].get(trait, 0) for trait in self.traits]
+                           for character in characters], dtype=float).reshape(-1, len(self.traits))
+        room_indexes = {room: index for index, room in enumerate(self.rooms)}
+        rooms = np.array([room_indexes.get(character["current_room"], len(self.rooms))
+                          for character in characters], dtype=int)
+        return stats, traits, rooms
+
+    async def tick(self) -> int:
+        """Apply one tick to every character in the house.
+
+        Returns:
+            int: The number of characters whose stats changed.
+        """
+        started = time.perf_counter()
+        version = self.store.version
+        characters = await self.store.list({"status": "in house"})
+        if not characters:
+            return 0
+        stats, traits, rooms = self.columns(characters)
+        updated = decay_step(stats, traits, rooms, self.trait_weights, self.room_recovery)
+        changed = np.flatnonzero((updated != stats).any(axis=1))
+        changed_characters = []
+        for row in changed:
+            character = dict(characters[row])
+            character["stats"] = {**character["stats"],
+                                  **{stat: int(value) for stat, value in zip(STATS, updated[row])}}
+            changed_characters.append(character)
+        if changed_characters:
+            await self.store.bulk_update(changed_characters, ["stats"], version)
+        self.ticks += 1
+        self.last_tick_seconds = time.perf_counter() - started
+        self.last_tick_updates = len(changed_characters)
+        return len(changed_characters)
+
+    async def run(self, interval: float) -> None:
+        """Tick every `interval` seconds, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.tick()
+            except Exception:
+                log.exception("Stat decay tick failed")
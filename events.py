@@ -0,0 +1,286 @@
+"""Append-only log of game events, for auditing and rebuilding a game.
+
+Events are appended to an in-memory buffer, and written in batches with insert_many once the
+buffer is full or every FLUSH_INTERVAL seconds, so logging adds no database round trip to the
+code paths that record events. Each event has a sequence number, increasing across restarts.
+
+The events collection is capped, so it only keeps the most recent events. To rebuild a game,
+snapshots of every character are saved periodically (keeping the latest SNAPSHOT_RETENTION),
+and replay starts from the latest snapshot and applies the events recorded after it.
+
+Run with:
+    python events.py replay [--until SEQUENCE] [--output characters.json]
+    python events.py snapshot
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Iterable, Optional
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, CollectionInvalid, PyMongoError
+
+from store import CharacterStore
+
+log = logging.getLogger(__name__)
+
+# Event types
+CHARACTER_SAVED = "character_saved"
+CHARACTER_DELETED = "character_deleted"
+MESSAGE_RELAYED = "message_relayed"
+BROADCAST_SENT = "broadcast_sent"
+
+# Number of buffered events that triggers a flush
+BATCH_SIZE = 500
+
+# Seconds between flushes of the buffer
+FLUSH_INTERVAL = 2.0
+
+# Seconds between snapshots of every character
+SNAPSHOT_INTERVAL = 3600
+
+# Number of snapshots kept; older ones are deleted when a snapshot is saved
+SNAPSHOT_RETENTION = 24
+
+# Size of the capped events collection; a snapshot must be taken before events are dropped
+CAPPED_SIZE = 512 * 1024 * 1024
+CAPPED_MAX_EVENTS = 1_000_000
+
+
+class EventLogTruncated(Exception):
+    """Raised when events needed to rebuild from a snapshot were dropped from the capped collection."""
+
+
+def replay(characters: Iterable[dict], events: Iterable[dict]) -> dict[str, dict]:
+    """Apply events, in sequence order, to the characters of a snapshot.
+
+    Replay is idempotent: character events carry the full document, so applying an event that
+    the snapshot already reflects changes nothing.
+
+    Args:
+        characters (Iterable[dict]): The character documents of the snapshot.
+        events (Iterable[dict]): The events recorded after the snapshot, in sequence order.
+
+    Returns:
+        dict[str, dict]: The character documents after the events, keyed by character id.
+    """
+    state = {character["_id"]: character for character in characters}
+    for event in events:
+        kind = event["type"]
+        if kind == CHARACTER_SAVED:
+            state[event["character_id"]] = event["data"]
+        elif kind == CHARACTER_DELETED:
+            state.pop(event["character_id"], None)
+    return state
+
+
+class EventLog:
+    """Buffers game events and writes them to the events collection in batches."""
+
+    def __init__(self, store: CharacterStore, collection: Any, snapshots: Any,
+                 batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL) -> None:
+        """Initialize the log.
+
+        Args:
+            store (CharacterStore): The store whose thread pool runs the driver calls, and whose
+                characters are snapshotted.
+            collection (Any): The (capped) collection the events are written to.
+            snapshots (Any): The collection the character snapshots are written to.
+            batch_size (int): Number of buffered events that triggers a flush.
+            flush_interval (float): Seconds between flushes.
+        """
+        self.store = store
+        self.collection = collection
+        self.snapshots = snapshots
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sequence = 0
+        self.written = 0
+        self._buffer: list[dict] = []
+        # Events are only written once the sequence has been resumed by load()
+        self._loaded = False
+        self._flushing: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        """Number of events waiting to be written."""
+        return len(self._buffer)
+
+    async def load(self) -> None:
+        """Create the capped events collection and its indexes, and resume the sequence numbers.
+
+        Events appended before the first load are renumbered to follow the last written event.
+        """
+        def _prepare() -> Optional[dict]:
+            collection = getattr(self.collection, "resolve", lambda: self.collection)()
+            try:
+                collection.database.create_collection(collection.name, capped=True, size=CAPPED_SIZE,
+                                                      max=CAPPED_MAX_EVENTS)
+            except CollectionInvalid:
+                pass
+            self.collection.create_index([("seq", ASCENDING)], unique=True)
+            self.collection.create_index([("character_id", ASCENDING), ("seq", ASCENDING)])
+            self.snapshots.create_index([("seq", DESCENDING)])
+            return self.collection.find_one({}, {"seq": 1}, sort=[("seq", DESCENDING)])
+
+        last = await self.store.run(_prepare)
+        if self._loaded:
+            self.sequence = max(self.sequence, last["seq"] if last is not None else 0)
+            return
+        self.sequence = last["seq"] if last is not None else 0
+        for event in self._buffer:
+            self.sequence += 1
+            event["seq"] = self.sequence
+        self._loaded = True
+
+    def append(self, kind: str, character_id: Optional[str] = None, **data) -> None:
+        """Record an event, without waiting for it to be written.
+
+        Args:
+            kind (str): The event type.
+            character_id (Optional[str]): The character the event is about, if any.
+            **data: The event payload.
+        """
+        self.sequence += 1
+        event = {"seq": self.sequence, "type": kind, "at": datetime.now(timezone.utc)}
+        if character_id is not None:
+            event["character_id"] = character_id
+        if data:
+            event.update(data)
+        self._buffer.append(event)
+        if len(self._buffer) >= self.batch_size and (self._flushing is None or self._flushing.done()):
+            try:
+                self._flushing = asyncio.get_running_loop().create_task(self.flush())
+            except RuntimeError:
+                # No event loop (e.g. a script); the next flush() call writes the events
+                pass
+
+    def character_written(self, character_id: str, character: Optional[dict]) -> None:
+        """Record a character write. Used as a CharacterStore listener."""
+        if character is None:
+            self.append(CHARACTER_DELETED, character_id)
+        else:
+            # Copied, since the cached document may be changed in place before the event is written
+            self.append(CHARACTER_SAVED, character_id, data=copy.deepcopy(character))
+
+    async def flush(self) -> int:
+        """Write the buffered events in one insert_many, returning how many were written.
+
+        Events that fail to be written are kept and written by the next flush, except those
+        rejected as duplicates, which were already written (e.g. by a retried request). Nothing
+        is written before load().
+        """
+        if not self._loaded:
+            return 0
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        try:
+            await self.store.run(self.collection.insert_many, batch, ordered=False)
+        except PyMongoError as error:
+            written, failed = 0, batch
+            if isinstance(error, BulkWriteError):
+                written = error.details.get("nInserted", 0)
+                failed_indexes = {write_error["index"] for write_error in error.details.get("writeErrors", [])
+                                  if write_error.get("code") != 11000}
+                failed = [event for index, event in enumerate(batch) if index in failed_indexes]
+            if failed:
+                log.exception("Failed to write %d events, retrying on the next flush", len(failed))
+            self._buffer = failed + self._buffer
+            self.written += written
+            return written
+        self.written += len(batch)
+        return len(batch)
+
+    async def snapshot(self) -> int:
+        """Save every character as a snapshot that replay can start from, returning its sequence."""
+        sequence = self.sequence
+        characters = await self.store.list()
+        await self.flush()
+        await self.store.run(self.snapshots.replace_one, {"_id": sequence},
+                             {"_id": sequence, "seq": sequence, "at": datetime.now(timezone.utc),
+                              "characters": characters}, upsert=True)
+
+        def _prune() -> None:
+            kept = list(self.snapshots.find({}, {"_id": 1}, sort=[("seq", DESCENDING)]))
+            expired = [snapshot["_id"] for snapshot in kept[SNAPSHOT_RETENTION:]]
+            if expired:
+                self.snapshots.delete_many({"_id": {"$in": expired}})
+
+        await self.store.run(_prune)
+        return sequence
+
+    async def rebuild(self, until: Optional[int] = None) -> dict[str, dict]:
+        """Return the character documents as of an event, from the latest snapshot before it.
+
+        Args:
+            until (Optional[int]): The sequence number of the last event to apply, or None for
+                every event recorded so far.
+
+        Raises:
+            EventLogTruncated: If the capped collection no longer holds the first event after
+                the snapshot.
+        """
+        await self.flush()
+
+        def _read() -> dict[str, dict]:
+            query = {"seq": {"$lte": until}} if until is not None else {}
+            snapshot = self.snapshots.find_one(query, sort=[("seq", DESCENDING)])
+            start = snapshot["seq"] if snapshot is not None else 0
+            if until is None or until > start:
+                first = self.collection.find_one({"seq": {"$gt": start}}, {"seq": 1}, sort=[("seq", ASCENDING)])
+                if first is not None and first["seq"] != start + 1:
+                    raise EventLogTruncated(f"events {start + 1} to {first['seq'] - 1} were dropped from the "
+                                            f"capped collection")
+            events_query = {"seq": {"$gt": start, **({"$lte": until} if until is not None else {})},
+                            "type": {"$in": [CHARACTER_SAVED, CHARACTER_DELETED]}}
+            events = self.collection.find(events_query, sort=[("seq", ASCENDING)], batch_size=10_000)
+            return replay(snapshot["characters"] if snapshot is not None else [], events)
+
+        return await self.store.run(_read)
+
+    async def run(self, snapshot_interval: float = SNAPSHOT_INTERVAL) -> None:
+        """Flush the buffer every flush_interval seconds, and snapshot periodically, until cancelled."""
+        last_snapshot = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_snapshot >= snapshot_interval:
+                    await self.snapshot()
+                    last_snapshot = time.monotonic()
+            except Exception:
+                log.exception("Event log flush failed")
+
+
+async def _main(arguments: list[str]) -> None:
+    parser = argparse.ArgumentParser(description="Rebuild character state from the event log.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="rebuild every character from a snapshot and events")
+    replay_parser.add_argument("--until", type=int, help="sequence number of the last event to apply")
+    replay_parser.add_argument("--output", help="file the rebuilt characters are written to, as JSON")
+    commands.add_parser("snapshot", help="save a snapshot of every character now")
+    options = parser.parse_args(arguments)
+
+    from config import character_store, event_log
+
+    await character_store.connect()
+    await event_log.load()
+    if options.command == "snapshot":
+        print(f"Saved snapshot at event {await event_log.snapshot()}")
+        return
+    started = time.perf_counter()
+    characters = await event_log.rebuild(options.until)
+    print(f"Rebuilt {len(characters)} characters in {time.perf_counter() - started:.2f}s")
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump(list(characters.values()), output, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
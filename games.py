@@ -0,0 +1,196 @@
+"""Game instances, so that one bot process can run several houses at once.
+
+Each game is played in one guild, with its own room channels, and every character belongs to
+exactly one game (its game_id). The games are stored in the games collection as
+    {"_id": game_id, "guild_id": int, "channel_ids": {channel name: channel id}}
+and loaded at startup. Each Game keeps its own name index, room index and relationship matrix,
+so lookups in one game never scan the characters of another, and a busy game does not slow
+down the others.
+
+Characters created before games existed belong to the default game, which is created from the
+hard-coded CHANNEL_IDS the first time the bot starts.
+"""
+
+import asyncio
+import logging
+from typing import Any, Iterator, Optional
+
+from indexes import NameIndex, RoomIndex
+from relationships import MATRIX_ID, SAVE_INTERVAL, RelationshipMatrix, RelationshipStore
+from store import CharacterStore
+
+log = logging.getLogger(__name__)
+
+# game_id of the game that existed before games were introduced
+DEFAULT_GAME_ID = "default"
+
+
+class Game:
+    """One house: its channels, and indexes over its characters."""
+
+    def __init__(self, game_id: str, guild_id: Optional[int], channel_ids: dict[str, int],
+                 capacity: int = 0) -> None:
+        """Initialize the game.
+
+        Args:
+            game_id (str): The id of the game.
+            guild_id (Optional[int]): The guild the game is played in, if known.
+            channel_ids (dict[str, int]): The channel id of each room and game channel.
+            capacity (int): Initial number of portrait slots in the relationship matrix.
+        """
+        self.game_id = game_id
+        self.guild_id = guild_id
+        self.channel_ids = channel_ids
+        self.name_index = NameIndex()
+        self.room_index = RoomIndex()
+        self.relationships = RelationshipMatrix(capacity)
+
+    def __repr__(self) -> str:
+        return f"Game({self.game_id!r}, guild_id={self.guild_id})"
+
+    def to_document(self) -> dict:
+        """Return the game as a document for the games collection."""
+        return {"_id": self.game_id, "guild_id": self.guild_id, "channel_ids": self.channel_ids}
+
+    @classmethod
+    def from_document(cls, document: dict, capacity: int = 0) -> "Game":
+        """Return the game stored in a games document."""
+        return cls(document["_id"], document.get("guild_id"), document.get("channel_ids", {}), capacity)
+
+    def update(self, character_id: str, character: Optional[dict]) -> None:
+        """Apply a write of one of the game's characters to its indexes."""
+        self.name_index.update(character_id, character)
+        self.room_index.update(character_id, character)
+        self.relationships.update_character(character_id, character)
+
+
+class GameRegistry:
+    """Every game, looked up by game id, guild id or character id in constant time."""
+
+    def __init__(self, store: CharacterStore, collection: Any, relationships: Any, capacity: int = 0) -> None:
+        """Initialize the registry.
+
+        Args:
+            store (CharacterStore): The character store.
+            collection (Any): The games collection.
+            relationships (Any): The collection the relationship matrices are saved to.
+            capacity (int): Initial number of portrait slots in each relationship matrix.
+        """
+        self.store = store
+        self.collection = collection
+        self.relationships = relationships
+        self.capacity = capacity
+        self._games: dict[str, Game] = {}
+        self._by_guild: dict[int, Game] = {}
+        # Character id -> game id, for routing deletes (which carry no document)
+        self._game_of: dict[str, str] = {}
+
+    def __iter__(self) -> Iterator[Game]:
+        return iter(list(self._games.values()))
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    def add(self, game: Game) -> Game:
+        """Register a game, replacing any game with the same id."""
+        previous = self._games.get(game.game_id)
+        if previous is not None and previous.guild_id is not None:
+            self._by_guild.pop(previous.guild_id, None)
+        self._games[game.game_id] = game
+        if game.guild_id is not None:
+            self._by_guild[game.guild_id] = game
+        return game
+
+    def get(self, game_id: str) -> Optional[Game]:
+        """Return the game with the given id, or None."""
+        return self._games.get(game_id)
+
+    def for_guild(self, guild_id: Optional[int]) -> Optional[Game]:
+        """Return the game played in a guild, or None."""
+        return self._by_guild.get(guild_id) if guild_id is not None else None
+
+    def of(self, character_id: str) -> Optional[Game]:
+        """Return the game a character belongs to, or None if the character does not exist."""
+        game_id = self._game_of.get(character_id)
+        return self._games.get(game_id) if game_id is not None else None
+
+    def relationship_store(self, game: Game) -> RelationshipStore:
+        """Return the store persisting a game's relationship matrix.
+
+        The default game keeps the matrix document it had before games were introduced.
+        """
+        matrix_id = MATRIX_ID if game.game_id == DEFAULT_GAME_ID else f"{MATRIX_ID}:{game.game_id}"
+        return RelationshipStore(self.store, self.relationships, game.relationships, matrix_id)
+
+    async def load(self, default: Game) -> None:
+        """Load the games, creating the default game and moving unassigned characters to it.
+
+        Args:
+            default (Game): The default game, saved if it does not exist yet. If it exists
+                without a guild id (e.g. the guild was unknown when it was created), the
+                guild id of `default` is recorded.
+        """
+        def _load() -> list[dict]:
+            self.collection.create_index("guild_id", unique=True,
+                                         partialFilterExpression={"guild_id": {"$type": "number"}})
+            self.collection.update_one({"_id": default.game_id}, {"$setOnInsert": default.to_document()},
+                                       upsert=True)
+            if default.guild_id is not None:
+                self.collection.update_one({"_id": default.game_id, "guild_id": None},
+                                           {"$set": {"guild_id": default.guild_id}})
+            # Characters created before games were introduced belong to the default game
+            self.store.collection.update_many({"game_id": {"$exists": False}},
+                                              {"$set": {"game_id": default.game_id}})
+            return list(self.collection.find({}))
+
+        for document in await self.store.run(_load):
+            self.add(Game.from_document(document, self.capacity))
+        for game in self:
+            await self.relationship_store(game).load()
+
+    def rebuild(self, characters: list[dict]) -> None:
+        """Rebuild the indexes of every game from the given character documents.
+
+        Args:
+            characters (list[dict]): Documents with at least _id, game_id, character_name,
+                portrait_emoji_pair and current_room.
+        """
+        members: dict[str, list[dict]] = {game.game_id: [] for game in self}
+        for character in characters:
+            members.setdefault(character.get("game_id", DEFAULT_GAME_ID), []).append(character)
+        self._game_of = {character["_id"]: game_id for game_id, documents in members.items()
+                         for character in documents}
+        for game_id, documents in members.items():
+            game = self._game(game_id)
+            game.name_index.rebuild(documents)
+            game.room_index.rebuild(documents)
+            game.relationships.sync_members(documents)
+
+    def _game(self, game_id: str) -> Game:
+        game = self._games.get(game_id)
+        if game is None:
+            # Created by another process since startup; its channels are loaded on the next start
+            log.warning("Character of unknown game %s, channels are not available until a restart", game_id)
+            game = self.add(Game(game_id, None, {}, self.capacity))
+        return game
+
+    def update(self, character_id: str, character: Optional[dict]) -> None:
+        """Apply a write to the indexes of the character's game. Used as a CharacterStore listener."""
+        game_id = character.get("game_id", DEFAULT_GAME_ID) if character is not None else None
+        previous = self._game_of.get(character_id)
+        if previous is not None and previous != game_id:
+            self._game(previous).update(character_id, None)
+            del self._game_of[character_id]
+        if game_id is not None:
+            self._game_of[character_id] = game_id
+            self._game(game_id).update(character_id, character)
+
+    async def keep_saved(self, interval: float = SAVE_INTERVAL) -> None:
+        """Save the relationship matrix of every game that changed, every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            for game in self:
+                try:
+                    await self.relationship_store(game).save()
+                except Exception:
+                    log.exception("Failed to save the relationships of %s", game)
@@ -0,0 +1,163 @@
+"""In-memory indexes over the characters collection, kept up to date by store listeners."""
+
+from bisect import bisect_left, insort
+from typing import Optional
+
+
+class NameIndex:
+    """A sorted prefix index of character names.
+
+    Characters are identified by their portrait emoji pair, which is unique and, unlike the
+    encrypted user id, safe to show to players (e.g. as autocomplete or select option values).
+    """
+
+    def __init__(self) -> None:
+        # Sorted (casefolded name, portrait emoji pair) pairs, for prefix search
+        self._keys: list[tuple[str, int]] = []
+        self._names: dict[int, str] = {}
+        self._character_ids: dict[int, str] = {}
+        self._slots: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def rebuild(self, characters: list[dict]) -> None:
+        """Replace the index contents with the given character documents.
+
+        Args:
+            characters (list[dict]): Documents with at least _id, character_name and
+                portrait_emoji_pair.
+        """
+        self._keys = sorted((character["character_name"].casefold(), character["portrait_emoji_pair"])
+                            for character in characters)
+        self._names = {character["portrait_emoji_pair"]: character["character_name"]
+                       for character in characters}
+        self._character_ids = {character["portrait_emoji_pair"]: character["_id"]
+                               for character in characters}
+        self._slots = {character["_id"]: character["portrait_emoji_pair"] for character in characters}
+
+    def update(self, character_id: str, character: Optional[dict]) -> None:
+        """Apply a write to the index. Used as a CharacterStore listener."""
+        if character is not None and self._slots.get(character_id) == character["portrait_emoji_pair"] and \
+                self._names[character["portrait_emoji_pair"]] == character["character_name"]:
+            return
+        self.remove(character_id)
+        if character is not None:
+            slot = character["portrait_emoji_pair"]
+            insort(self._keys, (character["character_name"].casefold(), slot))
+            self._names[slot] = character["character_name"]
+            self._character_ids[slot] = character_id
+            self._slots[character_id] = slot
+
+    def remove(self, character_id: str) -> None:
+        """Remove a character from the index, if present."""
+        slot = self._slots.pop(character_id, None)
+        if slot is None:
+            return
+        name = self._names.pop(slot)
+        del self._character_ids[slot]
+        key = (name.casefold(), slot)
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def search(self, prefix: str, limit: int = 25) -> list[tuple[str, int]]:
+        """Return up to `limit` (name, portrait emoji pair) pairs whose name starts with the prefix.
+
+        The search is case-insensitive and results are in alphabetical order.
+        """
+        prefix = prefix.casefold()
+        results = []
+        for name, slot in self._keys[bisect_left(self._keys, (prefix,)):]:
+            if not name.startswith(prefix) or len(results) == limit:
+                break
+            results.append((self._names[slot], slot))
+        return results
+
+    def name(self, character_id: str) -> Optional[str]:
+        """Return the name of a character, or None if the character does not exist."""
+        slot = self.slot(character_id)
+        return self._names[slot] if slot is not None else None
+
+    def slot(self, character_id: str) -> Optional[int]:
+        """Return the portrait emoji pair of a character, or None if the character does not exist."""
+        return self._slots.get(character_id)
+
+    @staticmethod
+    def value(slot: int) -> str:
+        """Return the autocomplete value of a portrait emoji pair.
+
+        Values are prefixed with "#", so that a character named with digits only is not
+        mistaken for a portrait emoji pair.
+        """
+        return f"#{slot}"
+
+    def resolve(self, value: str) -> Optional[str]:
+        """Return the character id for an autocomplete value or an exact (case-insensitive) name."""
+        if value.startswith("#") and value[1:].isdigit() and int(value[1:]) in self._character_ids:
+            return self._character_ids[int(value[1:])]
+        matches = self.search(value, limit=1)
+        if matches and matches[0][0].casefold() == value.casefold():
+            return self._character_ids[matches[0][1]]
+        return None
+
+
+class RoomIndex:
+    """Which characters are in which room.
+
+    Answers "who is in the Kitchen" without querying the database. Rooms are the keys of the
+    channel map of a game, and characters are identified by their (encrypted) character id.
+    """
+
+    def __init__(self) -> None:
+        self._occupants: dict[str, set[str]] = {}
+        self._rooms: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._rooms)
+
+    def rebuild(self, characters: list[dict]) -> None:
+        """Replace the index contents with the given character documents.
+
+        Args:
+            characters (list[dict]): Documents with at least _id and current_room.
+        """
+        self._occupants = {}
+        self._rooms = {}
+        for character in characters:
+            self._add(character["_id"], character["current_room"])
+
+    def update(self, character_id: str, character: Optional[dict]) -> None:
+        """Apply a write to the index. Used as a CharacterStore listener."""
+        room = character["current_room"] if character is not None else None
+        if self._rooms.get(character_id) == room:
+            return
+        self.remove(character_id)
+        if room is not None:
+            self._add(character_id, room)
+
+    def _add(self, character_id: str, room: str) -> None:
+        self._rooms[character_id] = room
+        self._occupants.setdefault(room, set()).add(character_id)
+
+    def remove(self, character_id: str) -> None:
+        """Remove a character from the index, if present."""
+        room = self._rooms.pop(character_id, None)
+        if room is None:
+            return
+        occupants = self._occupants[room]
+        occupants.discard(character_id)
+        if not occupants:
+            del self._occupants[room]
+
+    def room_of(self, character_id: str) -> Optional[str]:
+        """Return the room a character is in, or None if the character does not exist."""
+        return self._rooms.get(character_id)
+
+    def occupants(self, room: str) -> frozenset[str]:
+        """Return the ids of the characters in a room."""
+        return frozenset(self._occupants.get(room, ()))
+
+    def counts(self) -> dict[str, int]:
+        """Return the number of characters in each occupied room."""
+        return {room: len(occupants) for room, occupants in self._occupants.items()}
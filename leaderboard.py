@@ -0,0 +1,113 @@
+"""Elements for /leaderboard command.
+
+Rankings and the house summary are computed by MongoDB in a single aggregation: the documents
+of the game (found through the (game_id, ...) indexes) are narrowed to the ranked fields, then
+one $facet computes the top characters of every stat and trait and the counts per room and
+status. Only those few rows are sent back, however many characters there are.
+"""
+
+from config import *
+from engine import STATS
+from setup import TRAITS_OPTIONS
+
+# Number of characters ranked per stat and trait
+LEADERBOARD_SIZE = 5
+
+# Seconds a leaderboard is reused; it is also recomputed after any of its characters is written
+LEADERBOARD_TTL = 30.0
+
+# Last leaderboard of each game, discarded on every write of one of its characters
+leaderboard_caches: dict[str, ExpiringValue] = {}
+
+# Computes at most one leaderboard per game at a time; concurrent commands wait for it and reuse it
+_leaderboard_locks: dict[str, asyncio.Lock] = {}
+
+
+def invalidate_leaderboard(character_id: str, character: Optional[dict]) -> None:
+    """Discard the leaderboard of the character's game. Used as a CharacterStore listener."""
+    if character is None:
+        # Deleted, and the game is no longer known, so every leaderboard is discarded
+        for cache in leaderboard_caches.values():
+            cache.invalidate()
+    elif character.get("game_id") in leaderboard_caches:
+        leaderboard_caches[character["game_id"]].invalidate()
+
+
+character_store.add_listener(invalidate_leaderboard)
+metrics.add_collector(lambda: ((f"leaderboard_cache_{name}", "Leaderboard cache counter", {"game": game_id}, value)
+                               for game_id, cache in leaderboard_caches.items()
+                               for name, value in cache.stats().items()))
+
+# Embed to show when nobody has a character yet
+empty_leaderboard_embed = Embed(
+    description="There are no characters yet.",
+    color=0xFF0000,
+)
+
+
+def leaderboard_pipeline(game_id: str, size: int = LEADERBOARD_SIZE) -> list[dict]:
+    """Return the aggregation pipeline computing the rankings and the house summary of a game.
+
+    Args:
+        game_id (str): The game whose characters are ranked.
+        size (int): Number of characters ranked per stat and trait.
+
+    Returns:
+        list[dict]: A pipeline returning one document, with one list per stat and trait of
+        {"character_name", "value"} rows, and "rooms" and "status" lists of {"_id", "count"}.
+    """
+    rankings = {}
+    for group, names in (("stats", STATS), ("traits", TRAITS_OPTIONS)):
+        for name in names:
+            rankings[name] = [
+                {"$sort": {f"{group}.{name}": -1, "character_name": 1}},
+                {"$limit": size},
+                {"$project": {"_id": 0, "character_name": 1, "value": f"${group}.{name}"}},
+            ]
+    return [
+        {"$match": {"game_id": game_id}},
+        {"$project": {"_id": 0, "character_name": 1, "status": 1, "current_room": 1, "stats": 1, "traits": 1}},
+        {"$facet": {
+            **rankings,
+            "rooms": [{"$group": {"_id": "$current_room", "count": {"$sum": 1}}}, {"$sort": {"_id": 1}}],
+            "status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}, {"$sort": {"_id": 1}}],
+        }},
+    ]
+
+
+def _ranking_field(rows: list[dict]) -> str:
+    lines = [f"{index}. {row['character_name']} ({row['value']:g})" for index, row in enumerate(rows, 1)
+             if isinstance(row.get("value"), (int, float))]
+    return "\n".join(lines) or "-"
+
+
+def leaderboard_embed(result: dict) -> Embed:
+    """Return the leaderboard embed for the result of leaderboard_pipeline()."""
+    if not result.get("status"):
+        return empty_leaderboard_embed
+    embed = Embed(title="Leaderboard", color=0x00FF00)
+    for name in STATS + TRAITS_OPTIONS:
+        embed.add_field(name=name, value=_ranking_field(result.get(name, [])), inline=True)
+    rooms = "\n".join(f"{row['_id'] or 'Nowhere'}: {row['count']}" for row in result["rooms"])
+    embed.add_field(name="Rooms", value=rooms, inline=True)
+    status = "\n".join(f"{row['_id'] or 'Unknown'}: {row['count']}" for row in result["status"])
+    embed.add_field(name="Status", value=status, inline=True)
+    embed.set_footer(text=f"{sum(row['count'] for row in result['status'])} characters")
+    return embed
+
+
+async def leaderboard(game: Game) -> Embed:
+    """Return the leaderboard embed of a game, from the cache or from one aggregation."""
+    cache = leaderboard_caches.setdefault(game.game_id, ExpiringValue(ttl=LEADERBOARD_TTL))
+    embed = cache.get()
+    if embed is not None:
+        return embed
+    async with _leaderboard_locks.setdefault(game.game_id, asyncio.Lock()):
+        embed = cache.get()
+        if embed is not None:
+            return embed
+        generation = cache.generation
+        results = await character_store.aggregate(leaderboard_pipeline(game.game_id))
+        embed = leaderboard_embed(results[0] if results else {})
+        cache.put(embed, generation)
+        return embed
@@ -1,10 +1,74 @@
 """Main program for the bot.
 
 This file inherits from all command files and runs the bot.
+Importing this file performs no network or database I/O; connections and reference data
+are loaded in on_ready.
 """
 
+import time
+
+# Recorded before importing the command files, so that the startup report includes them
+startup_started = time.perf_counter()
+
 from setup import *
 from viewstats import *
+from rooms import *
+from leaderboard import *
+
+# Seconds spent in each startup phase, reported once the bot is ready
+startup_phases = {"imports": time.perf_counter() - startup_started}
+
+# Background tasks started once, on the first on_ready
+background_tasks = set()
+
+# Evolves every character's stats once per tick_interval
+stat_engine = StatDecayEngine(character_store, TRAITS_OPTIONS)
+metrics.add_collector(lambda: [
+    ("stat_ticks", "Stat decay ticks run", {}, stat_engine.ticks),
+    ("stat_tick_seconds", "Duration of the last stat decay tick", {}, stat_engine.last_tick_seconds),
+    ("setup_sessions", "Setups in progress", {}, len(setup_sessions.sessions)),
+])
+
+
+async def timed_phase(name: str, coroutine) -> None:
+    """Await the coroutine, recording how long it took as a startup phase."""
+    started = time.perf_counter()
+    await coroutine
+    startup_phases[name] = time.perf_counter() - started
+
+
+async def load_database() -> None:
+    """Connect to the database and prepare the indexes and counters the commands rely on."""
+    await character_store.connect()
+    await character_store.ensure_indexes()
+    # Also moves characters created before games were introduced to the default game
+    await games.load(default_game())
+    for game in games:
+        await portrait_allocator.sync(game.game_id)
+    await portrait_assets.load()
+    characters = await character_store.list(projection={"game_id": 1, "character_name": 1,
+                                                        "portrait_emoji_pair": 1, "current_room": 1})
+    games.rebuild(characters)
+    await event_log.load()
+    # Broadcasts interrupted by a restart are delivered to the players they had not reached yet
+    await broadcast_pipeline.resume()
+    # Setups interrupted by a restart are resumed by DMing each player their current step
+    for session in await setup_sessions.load():
+        background_tasks.add(asyncio.create_task(resume_setup(session)))
+
+
+async def sync_commands() -> None:
+    """Sync the slash commands, if they changed since the last sync."""
+    if await sync_command_tree(tree, guild=sync_guild, force=force_sync):
+        print("Synced slash commands")
+    else:
+        print("Slash commands unchanged, skipped sync")
+
+
+def startup_report() -> str:
+    """Return a one-line summary of the time spent in each startup phase."""
+    phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup_phases.items())
+    return f"Started in {time.perf_counter() - startup_started:.2f}s ({phases})"
 
 
 @client.event
@@ -13,10 +77,30 @@ async def on_ready():
     await client.change_presence(
         status=Status.online, activity=Activity(type=ActivityType.watching, name="you")
     )
-    await tree.sync()
+    if background_tasks:
+        # Reconnected: the database, reference data and commands are already loaded
+        return
+    startup_phases["login"] = time.perf_counter() - startup_started - sum(startup_phases.values())
+    await asyncio.gather(timed_phase("database", load_database()),
+                         timed_phase("command sync", sync_commands()))
+    # Keep the character cache in sync with writes made outside this process
+    background_tasks.add(asyncio.create_task(character_store.watch()))
+    # Abandon setups that have been idle for too long
+    background_tasks.add(asyncio.create_task(setup_sessions.expire_idle()))
+    if tick_interval > 0:
+        background_tasks.add(asyncio.create_task(stat_engine.run(tick_interval)))
+    # Upload portraits to the asset channel, and keep their URLs from expiring
+    background_tasks.add(asyncio.create_task(portrait_assets.keep_uploaded(client)))
+    background_tasks.add(asyncio.create_task(games.keep_saved()))
+    background_tasks.add(asyncio.create_task(event_log.run()))
+    if metrics_port:
+        await start_metrics_server(metrics_port)
+        print(f"Serving metrics on http://127.0.0.1:{metrics_port}/metrics")
+    print(startup_report())
 
 
 @client.event
+@timed("event_seconds", label="event")
 async def on_message(message: Message):
     if (message.author.id in COLLABORATORS or not BLOCK_COMMANDS) and \
             isinstance(message.channel, DMChannel):
@@ -24,14 +108,39 @@ async def on_message(message: Message):
         # TODO: change logic for jury, also do not listen until the game has started
         print(message.content)
         encrypted_user_id = encrypt_id(message.author.id)
-        character = characters_db.find_one({"_id": encrypted_user_id})
-        character_name, current_room = character["character_name"], character["current_room"]
-        channel_id = CHANNEL_IDS[current_room]
-        channel = client.get_channel(channel_id)
-        await channel.send(f"**{character_name}**: {message.content}")
+        session = setup_sessions.get(encrypted_user_id)
+        if session is not None and session.stage == SetupSession.NAME:
+            await handle_character_name(message, session)
+            return
+        game = games.of(encrypted_user_id)
+        if game is None:
+            return
+        current_room = game.room_index.room_of(encrypted_user_id)
+        character_name = game.name_index.name(encrypted_user_id)
+        channel = client.get_channel(game.channel_ids.get(current_room))
+        if channel is None:
+            return
+        if any(attachment_cache.too_large(attachment) for attachment in message.attachments):
+            await message.channel.send(embed=attachment_too_large_embed)
+        recipients = [int(decrypt_id(character_id)) for character_id in game.room_index.occupants(current_room)
+                      if character_id != encrypted_user_id]
+        # Attachments download in the background, and are sent with the message once ready, to the
+        # room and to every recipient
+        attachments = [attachment_cache.fetch(attachment, sends=1 + len(recipients))
+                       for attachment in message.attachments if not attachment_cache.too_large(attachment)]
+        if not message.content and not attachments:
+            return
+        # Posted in the room under the character's own name and portrait
+        avatar_url = portrait_assets.url(game.name_index.slot(encrypted_user_id))
+        outbound_relay.send(channel, message.content, author=(character_name, avatar_url), attachments=attachments)
+        event_log.append(MESSAGE_RELAYED, encrypted_user_id, game_id=game.game_id, room=current_room,
+                         content=message.content,
+                         attachments=[attachment.filename for attachment in message.attachments])
+        dm_fanout.send(recipients, f"**{character_name}**: {message.content}", attachments=attachments)
 
 
 @tree.command(name="ping", description="Pings the bot")
+@timed("command_seconds", label="command")
 async def ping(interaction: Interaction):
     if interaction.user.id in COLLABORATORS or not BLOCK_COMMANDS:
         await interaction.response.send_message("Pong!")
@@ -40,15 +149,19 @@ async def ping(interaction: Interaction):
 
 
 @tree.command(name="setup", description="Initialize a character")
+@timed("command_seconds", label="command")
 async def setup(interaction: Interaction):
     if interaction.user.id in COLLABORATORS or not BLOCK_COMMANDS:
         await interaction.response.send_message(embed=confirm_command_embed, ephemeral=True)
         user_id = interaction.user.id
         encrypted_user_id = encrypt_id(user_id)
-        character = characters_db.find_one({"_id": encrypted_user_id})
+        character = await character_store.get(encrypted_user_id)
+        game = game_for(interaction)
         if character is None:
-            view = KeynoteConfirmView(interaction)
-            await interaction.user.send(embed=keynote_embed, view=view)
+            await start_setup(interaction.user, game.game_id)
+        elif character.get("game_id", DEFAULT_GAME_ID) != game.game_id:
+            # Starting over would delete the character the player has in the other game
+            await interaction.user.send(embed=character_in_other_game_embed)
         else:
             view = InitialDuplicateStartOverView(interaction)
             await interaction.user.send(embed=already_has_character_embed, view=view)
@@ -57,11 +170,107 @@ async def setup(interaction: Interaction):
 
 
 @tree.command(name="viewstats", description="View all characters' stats")
-async def viewstats(interaction: Interaction):
+@app_commands.describe(character="The character to show first")
+@timed("command_seconds", label="command")
+async def viewstats(interaction: Interaction, character: Optional[str] = None):
+    game = game_for(interaction)
     if (interaction.user.id in COLLABORATORS or not BLOCK_COMMANDS) and \
-            interaction.channel_id == 1102571016531759195:
-        view = ViewStatsView(interaction=interaction)
-        await interaction.response.send_message(embed=view.embed, file=view.thumbnail_file, view=view)
+            interaction.channel_id == game.channel_ids.get("view-stats"):
+        snapshot = await character_store.snapshot({"game_id": game.game_id})
+        if not snapshot.characters:
+            await interaction.response.send_message(embed=no_characters_embed, ephemeral=True)
+            return
+        page = 0
+        if character is not None:
+            character_id = game.name_index.resolve(character)
+            page = next((page for page, document in enumerate(snapshot.characters)
+                         if document["_id"] == character_id), None)
+            if page is None:
+                await interaction.response.send_message(embed=character_not_found_embed, ephemeral=True)
+                return
+        view = ViewStatsView(snapshot, current_page=page, interaction=interaction)
+        await interaction.response.send_message(embed=view.embed, view=view,
+                                                files=[view.thumbnail_file] if view.thumbnail_file else [])
+    else:
+        await interaction.response.send_message(embed=no_permission_embed, ephemeral=True)
+
+
+@viewstats.autocomplete("character")
+async def viewstats_character_autocomplete(interaction: Interaction,
+                                           current: str) -> list[app_commands.Choice[str]]:
+    name_index = game_for(interaction).name_index
+    return [app_commands.Choice(name=name, value=name_index.value(portrait_emoji_pair))
+            for name, portrait_emoji_pair in name_index.search(current)]
+
+
+@tree.command(name="move", description="Move your character to another room")
+@app_commands.describe(room="The room to move to")
+@app_commands.choices(room=room_choices)
+@timed("command_seconds", label="command")
+async def move(interaction: Interaction, room: app_commands.Choice[str]):
+    if interaction.user.id in COLLABORATORS or not BLOCK_COMMANDS:
+        result = await move_character(encrypt_id(interaction.user.id), room.value)
+        embed = result if isinstance(result, Embed) else moved_embed(room.value)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=no_permission_embed, ephemeral=True)
+
+
+@tree.command(name="room", description="List the characters in a room")
+@app_commands.describe(room="The room to list, defaults to the room your character is in")
+@app_commands.choices(room=room_choices)
+@timed("command_seconds", label="command")
+async def room(interaction: Interaction, room: Optional[app_commands.Choice[str]] = None):
+    if interaction.user.id in COLLABORATORS or not BLOCK_COMMANDS:
+        game = game_for(interaction)
+        room_name = room.value if room is not None else game.room_index.room_of(encrypt_id(interaction.user.id))
+        if room_name is None:
+            await interaction.response.send_message(embed=no_character_embed, ephemeral=True)
+            return
+        await interaction.response.send_message(embed=room_embed(game, room_name), ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=no_permission_embed, ephemeral=True)
+
+
+@tree.command(name="leaderboard", description="Rank the characters by stat and trait, and summarize the house")
+@timed("command_seconds", label="command")
+async def leaderboard_command(interaction: Interaction):
+    if interaction.user.id in COLLABORATORS or not BLOCK_COMMANDS:
+        await interaction.response.send_message(embed=await leaderboard(game_for(interaction)), ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=no_permission_embed, ephemeral=True)
+
+
+async def report_broadcast(interaction: Interaction, broadcast: Broadcast) -> None:
+    """Tell the collaborator who sent a broadcast how many players it reached, once delivered."""
+    await asyncio.shield(broadcast.task)
+    await interaction.followup.send(embed=broadcast_embed(broadcast), ephemeral=True)
+
+
+@tree.command(name="broadcast", description="Send an announcement by DM to every player in the house")
+@app_commands.describe(message="The announcement to send")
+@timed("command_seconds", label="command")
+async def broadcast(interaction: Interaction, message: str):
+    if interaction.user.id in COLLABORATORS:
+        await interaction.response.defer(ephemeral=True)
+        game = game_for(interaction)
+        sending = await broadcast_pipeline.start(game.game_id, message)
+        event_log.append(BROADCAST_SENT, game_id=game.game_id, broadcast_id=sending.broadcast_id, content=message,
+                         recipients=sending.recipients)
+        await interaction.followup.send(embed=broadcast_embed(sending), ephemeral=True)
+        report = asyncio.create_task(report_broadcast(interaction, sending))
+        background_tasks.add(report)
+        report.add_done_callback(background_tasks.discard)
+    else:
+        await interaction.response.send_message(embed=no_permission_embed, ephemeral=True)
+
+
+@tree.command(name="metrics", description="Show the bot's slowest operations")
+@timed("command_seconds", label="command")
+async def metrics_command(interaction: Interaction):
+    if interaction.user.id in COLLABORATORS:
+        report = File(BytesIO(metrics.render().encode()), filename="metrics.txt")
+        await interaction.response.send_message(embed=metrics_embed(), file=report, ephemeral=True)
     else:
         await interaction.response.send_message(embed=no_permission_embed, ephemeral=True)
 
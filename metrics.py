@@ -0,0 +1,259 @@
+"""Latency and throughput metrics, exposed in the Prometheus text format.
+
+Handlers are timed with the timed() decorator, MongoDB commands with MongoCommandMetrics, and
+Discord rate limit hits with RateLimitCounter. Counters kept elsewhere (cache hit ratios, queue
+depths, ...) are added at render time by collectors. Everything is recorded in the module-level
+registry, served on localhost by start_metrics_server() and summarized by /metrics.
+"""
+
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
+
+from aiohttp import web
+from pymongo import monitoring
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Port of the metrics endpoint on localhost
+DEFAULT_METRICS_PORT = 9108
+
+# Type of a collector: returns (name, help, labels, value) gauge samples
+Collector = Callable[[], Iterable[tuple[str, str, dict, float]]]
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, as in Prometheus."""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record one observation."""
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class Counter:
+    """A monotonically increasing count."""
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """Holds every histogram and counter, keyed by name and labels."""
+
+    def __init__(self) -> None:
+        # name -> (type, help, {sorted label items: metric})
+        self.families: dict[str, tuple[str, str, dict]] = {}
+        self.collectors: list[Collector] = []
+        self._lock = threading.Lock()
+
+    def _metric(self, kind: str, factory: Callable, name: str, help_text: str, labels: dict):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self.families.setdefault(name, (kind, help_text, {}))
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = factory()
+            return metric
+
+    def histogram(self, name: str, help_text: str = "", **labels) -> Histogram:
+        """Return the histogram with the given name and labels, creating it if needed."""
+        return self._metric("histogram", Histogram, name, help_text, labels)
+
+    def counter(self, name: str, help_text: str = "", **labels) -> Counter:
+        """Return the counter with the given name and labels, creating it if needed."""
+        return self._metric("counter", Counter, name, help_text, labels)
+
+    def add_collector(self, collector: Collector) -> None:
+        """Add a function whose gauge samples are included every time metrics are rendered."""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            families = [(name, kind, help_text, list(metrics.items()))
+                        for name, (kind, help_text, metrics) in sorted(self.families.items())]
+        for name, kind, help_text, metrics in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in metrics:
+                labels = dict(key)
+                if kind == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip((*metric.buckets, "+Inf"), metric.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {metric.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+        gauges: dict[str, tuple[str, list]] = {}
+        for collector in self.collectors:
+            try:
+                for name, help_text, labels, value in collector():
+                    gauges.setdefault(name, (help_text, []))[1].append((labels, value))
+            except Exception:
+                log.exception("Metrics collector %r failed", collector)
+        for name, (help_text, samples) in sorted(gauges.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{_format_labels(labels)} {float(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def slowest(self, count: int = 10) -> list[tuple[str, dict, Histogram]]:
+        """Return the (name, labels, histogram) series with the highest p99 latency."""
+        with self._lock:
+            series = [(name, dict(key), metric) for name, (kind, _, metrics) in self.families.items()
+                      if kind == "histogram" for key, metric in metrics.items() if metric.count]
+        return sorted(series, key=lambda item: item[2].quantile(0.99), reverse=True)[:count]
+
+
+# The registry every metric in the bot is recorded in
+registry = MetricsRegistry()
+
+
+def timed(name: str, label: str = "handler", help_text: str = "Latency in seconds") -> Callable:
+    """Decorator recording the latency of every call of a coroutine function in a histogram.
+
+    The histogram is labelled with the function's qualified name (e.g. KeynoteConfirmView.confirm).
+    Calls that raise are also counted in `<name>_errors_total`.
+
+    Args:
+        name (str): The histogram name.
+        label (str): The name of the label holding the function's qualified name.
+        help_text (str): The histogram description.
+    """
+    def decorator(function: Callable) -> Callable:
+        histogram = registry.histogram(name, help_text, **{label: function.__qualname__})
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                registry.counter(f"{name}_errors_total", "Calls that raised", **{label: function.__qualname__}).inc()
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def _documents(reply: dict) -> Optional[int]:
+    """Return the number of documents a MongoDB command reply returned or affected."""
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "n" in reply:
+        return reply["n"]
+    if isinstance(reply.get("value"), dict):
+        return 1
+    return None
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records the latency and document count of every MongoDB command.
+
+    Pass an instance in the event_listeners of the MongoClient. Callbacks run on driver threads.
+    """
+
+    def __init__(self, metrics: MetricsRegistry = registry) -> None:
+        self.metrics = metrics
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self.metrics.histogram("mongo_command_seconds", "MongoDB command latency in seconds",
+                               command=event.command_name).observe(event.duration_micros / 1_000_000)
+        documents = _documents(event.reply)
+        if documents is not None:
+            self.metrics.counter("mongo_documents_total", "Documents returned or affected by MongoDB commands",
+                                 command=event.command_name).inc(documents)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self.metrics.histogram("mongo_command_seconds", "MongoDB command latency in seconds",
+                               command=event.command_name).observe(event.duration_micros / 1_000_000)
+        self.metrics.counter("mongo_command_failures_total", "Failed MongoDB commands",
+                             command=event.command_name).inc()
+
+
+class RateLimitCounter(logging.Handler):
+    """Counts the rate limit hits discord.py logs, per logger.
+
+    Attach to the "discord" logger; discord.py logs a warning each time a request is rate limited.
+    """
+
+    def __init__(self, metrics: MetricsRegistry = registry) -> None:
+        super().__init__(level=logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if "rate limit" in record.getMessage().lower():
+            self.metrics.counter("discord_rate_limits_total", "Discord rate limit hits",
+                                 logger=record.name).inc()
+
+
+async def start_metrics_server(port: int = DEFAULT_METRICS_PORT,
+                               metrics: MetricsRegistry = registry) -> web.AppRunner:
+    """Serve the metrics at http://127.0.0.1:<port>/metrics.
+
+    Returns:
+        web.AppRunner: The runner of the server; call cleanup() on it to stop it.
+    """
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response(body=metrics.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
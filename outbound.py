@@ -0,0 +1,324 @@
+"""Ordered, rate-limit-aware outbound message queues.
+
+Relayed messages are not sent directly from event handlers. Instead they are enqueued on a
+per-destination ChannelSendQueue, whose worker sends them in order while staying under the
+destination's rate limit. When a backlog builds up, consecutive short messages are coalesced
+into a single post (up to Discord's 2000 character limit), so a busy room falls behind by
+fewer messages instead of more.
+
+DirectMessageFanout builds on the same queues to deliver a message to many players by DM, with
+one queue per recipient so that a slow recipient never holds up the others.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional, Sequence
+
+import discord
+
+from metrics import timed
+
+log = logging.getLogger(__name__)
+
+# Maximum number of characters in a single Discord message
+MESSAGE_CHARACTER_LIMIT = 2000
+
+# Discord allows roughly 5 messages per 5 seconds per channel
+CHANNEL_RATE = 5
+CHANNEL_PER = 5.0
+
+# Maximum number of DMs being sent at once, across all recipients
+DM_CONCURRENCY = 8
+
+# Discord's global rate limit is 50 requests per second; DMs stay under most of it
+DM_GLOBAL_RATE = 40
+DM_GLOBAL_PER = 1.0
+
+# Seconds a queue worker stays alive with nothing to send before it is stopped
+IDLE_TIMEOUT = 60.0
+
+# Type of the coroutine function used to deliver a message: (destination, content, author, files)
+Sender = Callable[[Any, str, Optional[Hashable], Sequence[discord.File]], Awaitable[None]]
+
+
+async def send_as_bot(destination: discord.abc.Messageable, content: str,
+                      author: Optional[Hashable], files: Sequence[discord.File] = ()) -> None:
+    """Send the content as the bot itself, without recording it in the send histogram."""
+    await destination.send(content or None, files=list(files))
+
+
+@timed("discord_send_seconds", label="sender")
+async def default_sender(destination: discord.abc.Messageable, content: str,
+                         author: Optional[Hashable], files: Sequence[discord.File] = ()) -> None:
+    """Send the content as the bot itself."""
+    await send_as_bot(destination, content, author, files)
+
+
+def split_content(content: str, limit: int = MESSAGE_CHARACTER_LIMIT) -> list[str]:
+    """Split content into chunks no longer than the limit, preferring line breaks.
+
+    Args:
+        content (str): The content to split.
+        limit (int): The maximum length of each chunk.
+    """
+    chunks = []
+    while len(content) > limit:
+        cut = content.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(content[:cut])
+        content = content[cut:].lstrip("\n")
+    if content:
+        chunks.append(content)
+    return chunks
+
+
+class RateLimiter:
+    """A token bucket allowing `rate` acquisitions every `per` seconds."""
+
+    def __init__(self, rate: float, per: float) -> None:
+        self.rate = rate
+        self.per = per
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a token is available, then consume it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.per)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.per / self.rate)
+
+
+class _Outgoing:
+    """A message waiting in a ChannelSendQueue."""
+
+    __slots__ = ("content", "author", "attachments", "enqueued_at")
+
+    def __init__(self, content: str, author: Optional[Hashable], attachments: Sequence[Awaitable] = ()) -> None:
+        self.content = content
+        self.author = author
+        self.attachments = attachments
+        self.enqueued_at = time.monotonic()
+
+
+class ChannelSendQueue:
+    """An ordered send queue with a single worker for one destination."""
+
+    def __init__(self, destination: Any, sender: Sender = default_sender,
+                 coalesce_backlog: int = 2, rate: float = CHANNEL_RATE, per: float = CHANNEL_PER) -> None:
+        """Initialize the queue.
+
+        Args:
+            destination (Any): The channel (or other messageable) to send to.
+            sender (Sender): Coroutine function that delivers one message.
+            coalesce_backlog (int): Number of waiting messages at which coalescing starts.
+            rate (float): Number of sends allowed every `per` seconds.
+            per (float): Length of the rate limit window in seconds.
+        """
+        self.destination = destination
+        self.sender = sender
+        self.coalesce_backlog = coalesce_backlog
+        self.limiter = RateLimiter(rate, per)
+        self.sent_posts = 0
+        self.sent_messages = 0
+        self.failed_posts = 0
+        self.max_depth = 0
+        self.latencies = deque(maxlen=512)
+        self._pending: deque[_Outgoing] = deque()
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """Number of messages waiting to be sent."""
+        return len(self._pending)
+
+    def put(self, content: str, author: Optional[Hashable] = None, attachments: Sequence[Awaitable] = ()) -> None:
+        """Enqueue content for sending, starting the worker if needed.
+
+        Args:
+            content (str): The content to send. Content over the limit is split.
+            author (Optional[Hashable]): Messages are only coalesced with others of the same author.
+            attachments (Sequence[Awaitable]): Awaitables resolving to objects with a file() method
+                returning a discord.File, sent with the (last chunk of the) content. They are only
+                awaited when the message is about to be sent, so that enqueuing never waits.
+        """
+        chunks = split_content(content) or [""]
+        for index, chunk in enumerate(chunks):
+            self._pending.append(_Outgoing(chunk, author, attachments if index == len(chunks) - 1 else ()))
+        self.max_depth = max(self.max_depth, len(self._pending))
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    def _next_post(self) -> tuple[str, Optional[Hashable], list[_Outgoing]]:
+        """Pop the next post off the queue, coalescing a backlog of same-author messages."""
+        first = self._pending.popleft()
+        batch = [first]
+        content = first.content
+        if len(self._pending) + 1 >= self.coalesce_backlog and not first.attachments:
+            # Messages with attachments are always posted on their own
+            while self._pending and self._pending[0].author == first.author and \
+                    not self._pending[0].attachments and \
+                    len(content) + 1 + len(self._pending[0].content) <= MESSAGE_CHARACTER_LIMIT:
+                following = self._pending.popleft()
+                content += "\n" + following.content
+                batch.append(following)
+        return content, first.author, batch
+
+    async def _run(self) -> None:
+        """Send queued messages in order until the queue has been idle for IDLE_TIMEOUT."""
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if not self._pending:
+                        return
+                continue
+            await self.limiter.acquire()
+            content, author, batch = self._next_post()
+            files = await self._files(batch[0].attachments)
+            if not content and not files:
+                continue
+            try:
+                await self.sender(self.destination, content, author, files)
+            except Exception as error:
+                # Any failure (an HTTP error, a dropped connection, a timeout...) only loses this
+                # post; the worker keeps sending the rest of the queue
+                self.failed_posts += 1
+                log.warning("Failed to send queued message to %s: %r", self.destination, error)
+                continue
+            now = time.monotonic()
+            self.sent_posts += 1
+            self.sent_messages += len(batch)
+            self.latencies.extend(now - outgoing.enqueued_at for outgoing in batch)
+
+    async def _files(self, attachments: Sequence[Awaitable]) -> list[discord.File]:
+        """Await the attachments of a message, skipping any that failed to download."""
+        files = []
+        for result in await asyncio.gather(*attachments, return_exceptions=True):
+            try:
+                if isinstance(result, BaseException):
+                    raise result
+                files.append(result.file())
+            except (Exception, asyncio.CancelledError) as error:
+                log.warning("Dropped an attachment for %s: %r", self.destination, error)
+        return files
+
+    def stats(self) -> dict:
+        """Return queue depth, throughput and send latency counters as a dictionary."""
+        latencies = sorted(self.latencies)
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent_posts": self.sent_posts,
+            "sent_messages": self.sent_messages,
+            "failed_posts": self.failed_posts,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+
+class OutboundRelay:
+    """Owns one ChannelSendQueue per destination."""
+
+    def __init__(self, sender: Sender = default_sender, **queue_options) -> None:
+        """Initialize the relay.
+
+        Args:
+            sender (Sender): Coroutine function used by every queue to deliver a message.
+            **queue_options: Extra keyword arguments passed to each ChannelSendQueue.
+        """
+        self.sender = sender
+        self.queue_options = queue_options
+        self.queues: dict[int, ChannelSendQueue] = {}
+
+    def queue_for(self, destination: Any) -> ChannelSendQueue:
+        """Return the queue for the destination, creating it if needed."""
+        queue = self.queues.get(destination.id)
+        if queue is None:
+            queue = ChannelSendQueue(destination, self.sender, **self.queue_options)
+            self.queues[destination.id] = queue
+        return queue
+
+    def send(self, destination: Any, content: str, author: Optional[Hashable] = None,
+             attachments: Sequence[Awaitable] = ()) -> None:
+        """Enqueue content (and attachments) for the destination without waiting for it to be sent."""
+        self.queue_for(destination).put(content, author, attachments)
+
+    def stats(self) -> dict:
+        """Return the stats of every queue, keyed by destination id."""
+        return {destination_id: queue.stats() for destination_id, queue in self.queues.items()}
+
+
+class DirectMessageFanout:
+    """Delivers messages to many players by DM.
+
+    Each recipient gets its own ChannelSendQueue, so messages reach every recipient in order,
+    and a recipient that falls behind has its backlog batched into fewer, longer DMs. Sends
+    across all recipients share a concurrency limit and a global rate limit, and enqueuing never
+    waits, so fan-out to a full house does not block the event handler that triggered it.
+    """
+
+    def __init__(self, client: discord.Client, concurrency: int = DM_CONCURRENCY,
+                 rate: float = DM_GLOBAL_RATE, per: float = DM_GLOBAL_PER) -> None:
+        """Initialize the fan-out.
+
+        Args:
+            client (discord.Client): The client used to open DM channels.
+            concurrency (int): Maximum number of DMs being sent at once.
+            rate (float): Number of DMs allowed every `per` seconds, across all recipients.
+            per (float): Length of the global rate limit window in seconds.
+        """
+        self.client = client
+        self.limiter = RateLimiter(rate, per)
+        self.dm_channels: dict[int, discord.DMChannel] = {}
+        self.relay = OutboundRelay(self._send)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def dm_channel(self, user_id: int) -> discord.DMChannel:
+        """Return the DM channel with a user, opening it only the first time.
+
+        discord.py only keeps the 128 most recent DM channels, so they are cached here as well
+        to avoid reopening them with an API call once the house has more players than that.
+        """
+        channel = self.dm_channels.get(user_id)
+        if channel is None:
+            channel = await self.client.create_dm(discord.Object(id=user_id))
+            self.dm_channels[user_id] = channel
+        return channel
+
+    async def _send(self, recipient: discord.Object, content: str, author: Optional[Hashable],
+                    files: Sequence[discord.File] = ()) -> None:
+        async with self._semaphore:
+            channel = await self.dm_channel(recipient.id)
+            await self.limiter.acquire()
+            await default_sender(channel, content, author, files)
+
+    def send(self, user_ids: list[int], content: str, attachments: Sequence[Awaitable] = ()) -> None:
+        """Enqueue content for every user, without waiting for it to be sent.
+
+        Args:
+            user_ids (list[int]): The discord user ids of the recipients.
+            content (str): The content to send.
+            attachments (Sequence[Awaitable]): Attachments to send with the content, as for
+                ChannelSendQueue.put.
+        """
+        for user_id in user_ids:
+            # Messages in a recipient's DMs are all from the bot, so any backlog can be batched
+            self.relay.send(discord.Object(id=user_id), content, attachments=attachments)
+
+    def stats(self) -> dict:
+        """Return the queue stats, including delivery latency, of every recipient, keyed by user id."""
+        return self.relay.stats()
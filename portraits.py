@@ -0,0 +1,250 @@
+"""Portrait emoji pair management.
+
+Each character owns one portrait emoji pair, an integer slot that is also the name of its
+portrait in assets/ (e.g. slot 3 uses assets/3.jpg).
+"""
+
+import asyncio
+import logging
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlparse
+
+import discord
+from pymongo import ReturnDocument
+
+from games import DEFAULT_GAME_ID
+from store import CharacterStore
+
+log = logging.getLogger(__name__)
+
+ASSETS_PATH = Path(__file__).parent / "assets"
+
+# _id of the counter document holding the allocator state of the default game; other games
+# have one counter each, with the game id appended
+COUNTER_ID = "portrait_emoji_pair"
+
+# Attempts at rewriting a counter document being updated concurrently
+RECONCILE_ATTEMPTS = 5
+
+# Discord allows at most 10 attachments per message
+FILES_PER_UPLOAD = 10
+
+# Uploaded URLs are treated as expired this many seconds before Discord expires them
+URL_EXPIRY_MARGIN = 3600
+
+
+class PortraitsExhausted(Exception):
+    """Raised when every portrait emoji pair is already taken."""
+
+
+def count_portraits() -> int:
+    """Return the number of portraits available in assets/."""
+    return len(list(ASSETS_PATH.glob("*.jpg")))
+
+
+def counter_id(game_id: str) -> str:
+    """Return the _id of the counter document of a game."""
+    return COUNTER_ID if game_id == DEFAULT_GAME_ID else f"{COUNTER_ID}:{game_id}"
+
+
+class PortraitAllocator:
+    """Hands out the lowest free portrait emoji pair of a game in a single atomic operation.
+
+    The state of each game is persisted in one counter document:
+        {"_id": "portrait_emoji_pair", "next": int, "free": [int, ...]}
+    where every slot below `next` is taken unless it is in `free`, a list of released slots
+    kept in ascending order so that its first element is always the lowest free slot.
+    """
+
+    def __init__(self, store: CharacterStore, counters: Any, capacity: Optional[int] = None) -> None:
+        """Initialize the allocator.
+
+        Args:
+            store (CharacterStore): The store whose thread pool runs the driver calls.
+            counters (Any): The collection holding the counter document.
+            capacity (Optional[int]): Number of slots available. Defaults to the number of
+                portraits in assets/.
+        """
+        self.store = store
+        self.counters = counters
+        self._capacity = capacity
+        self._synced: set[str] = set()
+
+    @property
+    def capacity(self) -> int:
+        """Number of slots available."""
+        if self._capacity is None:
+            self._capacity = count_portraits()
+        return self._capacity
+
+    async def sync(self, game_id: str = DEFAULT_GAME_ID) -> None:
+        """Create the counter document of a game from its characters, if it does not exist.
+
+        This is the only operation that reads every character of a game, and it is run once
+        per game at startup.
+        """
+        if game_id in self._synced:
+            return
+        if await self.store.run(self.counters.find_one, {"_id": counter_id(game_id)}) is not None:
+            self._synced.add(game_id)
+            return
+        taken = await self._taken(game_id)
+        next_slot = max(taken) + 1 if taken else 0
+        free = sorted(set(range(next_slot)) - taken)
+        await self.store.run(self.counters.update_one, {"_id": counter_id(game_id)},
+                             {"$setOnInsert": {"next": next_slot, "free": free}}, upsert=True)
+        self._synced.add(game_id)
+
+    async def reconcile(self, game_id: str = DEFAULT_GAME_ID) -> None:
+        """Rebuild the counter document of a game from its characters.
+
+        Used when the counter keeps handing out slots that are already taken: the taken slots are
+        removed from `free` and `next` is moved past them. Slots claimed but not yet used by a
+        character are left free, as they would only clash (and be claimed again) if handed out.
+        """
+        await self.sync(game_id)
+        taken = await self._taken(game_id)
+        for _ in range(RECONCILE_ATTEMPTS):
+            counter = await self.store.run(self.counters.find_one, {"_id": counter_id(game_id)})
+            next_slot = max(counter["next"], max(taken) + 1 if taken else 0)
+            free = sorted(set(range(next_slot)) - taken)
+            # Only written if no slot was claimed or released since the counter was read
+            result = await self.store.run(self.counters.update_one,
+                                          {"_id": counter_id(game_id), "next": counter["next"],
+                                           "free": counter["free"]},
+                                          {"$set": {"next": next_slot, "free": free}})
+            if result.matched_count:
+                return
+        log.warning("Failed to reconcile the portrait counter of game %s", game_id)
+
+    async def _taken(self, game_id: str) -> set[int]:
+        """Return the slots used by the characters of a game."""
+        projection = {"_id": 0, "portrait_emoji_pair": 1}
+        return {document["portrait_emoji_pair"]
+                for document in await self.store.list({"game_id": game_id}, projection=projection)}
+
+    async def allocate(self, game_id: str = DEFAULT_GAME_ID) -> int:
+        """Claim and return the lowest free slot of a game.
+
+        Raises:
+            PortraitsExhausted: If every slot is taken.
+        """
+        await self.sync(game_id)
+        counter = await self.store.run(self.counters.find_one_and_update,
+                                       {"_id": counter_id(game_id), "free.0": {"$exists": True}},
+                                       {"$pop": {"free": -1}},
+                                       return_document=ReturnDocument.BEFORE)
+        if counter is not None:
+            return counter["free"][0]
+        counter = await self.store.run(self.counters.find_one_and_update,
+                                       {"_id": counter_id(game_id), "next": {"$lt": self.capacity}},
+                                       {"$inc": {"next": 1}},
+                                       return_document=ReturnDocument.BEFORE)
+        if counter is not None:
+            return counter["next"]
+        raise PortraitsExhausted()
+
+    async def release(self, slot: int, game_id: str = DEFAULT_GAME_ID) -> None:
+        """Return a slot of a game to the free list, so that it is handed out again."""
+        await self.store.run(self.counters.update_one,
+                             {"_id": counter_id(game_id), "next": {"$gt": slot}, "free": {"$ne": slot}},
+                             {"$push": {"free": {"$each": [slot], "$sort": 1}}})
+
+
+def url_expiry(url: str) -> Optional[float]:
+    """Return the unix time at which a Discord CDN attachment URL expires, if it has one."""
+    expires = parse_qs(urlparse(url).query).get("ex")
+    if not expires:
+        return None
+    return float(int(expires[0], 16))
+
+
+class PortraitAssets:
+    """Serves portraits to embeds by URL, uploading each portrait only once.
+
+    Each portrait is uploaded to the asset channel, and the resulting attachment URL is persisted
+    in the assets collection as {"_id": portrait_number, "url": str}. Embeds then reference the
+    URL instead of re-attaching the file on every send or edit. Until a portrait's URL is known
+    (or after it expires), it is attached from an in-memory copy of the file instead.
+    """
+
+    def __init__(self, store: CharacterStore, assets: Any, channel_id: Optional[int] = None) -> None:
+        """Initialize the service.
+
+        Args:
+            store (CharacterStore): The store whose thread pool runs the driver calls.
+            assets (Any): The collection holding the uploaded URLs.
+            channel_id (Optional[int]): The channel portraits are uploaded to. If None, portraits
+                are always attached as files.
+        """
+        self.store = store
+        self.assets = assets
+        self.channel_id = channel_id
+        self.urls: dict[int, str] = {}
+        self._bytes: dict[int, bytes] = {}
+        self._upload_lock = asyncio.Lock()
+
+    async def load(self) -> None:
+        """Load the persisted URLs. Run once at startup."""
+        documents = await self.store.run(lambda: list(self.assets.find({})))
+        self.urls = {document["_id"]: document["url"] for document in documents}
+
+    def url(self, portrait_number: int) -> Optional[str]:
+        """Return the uploaded URL of the portrait, or None if it is unknown or expired."""
+        url = self.urls.get(portrait_number)
+        if url is None:
+            return None
+        expires = url_expiry(url)
+        if expires is not None and expires - URL_EXPIRY_MARGIN < time.time():
+            return None
+        return url
+
+    def file(self, portrait_number: int, filename: str = "image.jpg") -> discord.File:
+        """Return the portrait as a discord.File, reading it from disk only the first time."""
+        content = self._bytes.get(portrait_number)
+        if content is None:
+            content = self._bytes[portrait_number] = (ASSETS_PATH / f"{portrait_number}.jpg").read_bytes()
+        return discord.File(BytesIO(content), filename)
+
+    def thumbnail(self, portrait_number: int) -> tuple[str, Optional[discord.File]]:
+        """Return the URL to use as an embed thumbnail, and the file to attach, if any.
+
+        Args:
+            portrait_number (int): Portrait number for the character.
+
+        Returns:
+            tuple[str, Optional[discord.File]]: The uploaded URL and None, or
+            "attachment://image.jpg" and the file to attach when the URL is not known yet.
+        """
+        url = self.url(portrait_number)
+        if url is not None:
+            return url, None
+        return "attachment://image.jpg", self.file(portrait_number)
+
+    async def upload_missing(self, client: discord.Client) -> None:
+        """Upload every portrait without a valid URL to the asset channel, and persist the URLs."""
+        if self.channel_id is None:
+            return
+        async with self._upload_lock:
+            channel = client.get_channel(self.channel_id) or await client.fetch_channel(self.channel_id)
+            missing = [number for number in range(count_portraits()) if self.url(number) is None]
+            for start in range(0, len(missing), FILES_PER_UPLOAD):
+                batch = missing[start:start + FILES_PER_UPLOAD]
+                try:
+                    message = await channel.send(files=[self.file(number, f"{number}.jpg") for number in batch])
+                except discord.HTTPException as error:
+                    log.warning("Failed to upload portraits %s: %s", batch, error)
+                    return
+                for number, attachment in zip(batch, message.attachments):
+                    self.urls[number] = attachment.url
+                    await self.store.run(self.assets.update_one, {"_id": number},
+                                         {"$set": {"url": attachment.url}}, upsert=True)
+
+    async def keep_uploaded(self, client: discord.Client) -> None:
+        """Upload missing portraits, and re-upload them before their URLs expire, until cancelled."""
+        while True:
+            await self.upload_missing(client)
+            await asyncio.sleep(URL_EXPIRY_MARGIN / 2)
@@ -0,0 +1,237 @@
+"""Relationship stats between characters.
+
+Relationships are stored as one dense matrix indexed by portrait emoji pair, rather than as
+nested dicts inside each character document: scores[a, b] is how character a feels about
+character b, from -100 (hates) to 100 (loves). Memory is fixed by the number of portraits, and
+every get, update and row/column query is a constant-time array operation.
+"""
+
+from pathlib import Path
+from typing import Any, Optional, Union
+
+import numpy as np
+from bson.binary import Binary
+
+from store import CharacterStore
+
+MIN_SCORE = -100
+MAX_SCORE = 100
+
+# Initial scores of a new character towards others (and theirs towards it) are drawn from
+# a normal distribution with this mean and standard deviation
+INITIAL_MEAN = 0.0
+INITIAL_STD = 10.0
+
+# _id of the document holding the persisted matrix
+MATRIX_ID = "relationships"
+
+# Seconds between saves of a changed matrix
+SAVE_INTERVAL = 60
+
+
+class RelationshipMatrix:
+    """A dense matrix of relationship scores, indexed by portrait emoji pair."""
+
+    def __init__(self, capacity: int, seed: Optional[int] = None) -> None:
+        """Initialize an empty matrix.
+
+        Args:
+            capacity (int): The number of portrait emoji pairs.
+            seed (Optional[int]): Seed for the initial score distribution.
+        """
+        self.scores = np.zeros((capacity, capacity), dtype=np.float32)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.slots: dict[str, int] = {}
+        # Incremented on every change; saved_generation is the generation last saved or loaded
+        self.generation = 0
+        self.saved_generation = 0
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def capacity(self) -> int:
+        return self.scores.shape[0]
+
+    @property
+    def dirty(self) -> bool:
+        """Whether the matrix changed since it was last saved or loaded."""
+        return self.generation != self.saved_generation
+
+    def get(self, source: int, target: int) -> float:
+        """Return how the source character feels about the target character."""
+        return float(self.scores[source, target])
+
+    def update(self, source: int, target: int, delta: float) -> float:
+        """Change how the source character feels about the target, and return the new score."""
+        value = np.clip(self.scores[source, target] + delta, MIN_SCORE, MAX_SCORE)
+        self.scores[source, target] = value
+        self.generation += 1
+        return float(value)
+
+    def apply_interactions(self, sources: Any, targets: Any, deltas: Any) -> None:
+        """Apply a batch of score changes at once.
+
+        Repeated (source, target) pairs accumulate, as if applied one after the other
+        (clipping is applied once, at the end).
+
+        Args:
+            sources (Any): Sequence of source portrait emoji pairs.
+            targets (Any): Sequence of target portrait emoji pairs.
+            deltas (Any): Sequence of score changes, or a single change for every pair.
+        """
+        sources = np.asarray(sources, dtype=np.intp)
+        targets = np.asarray(targets, dtype=np.intp)
+        deltas = np.broadcast_to(np.asarray(deltas, dtype=np.float32), sources.shape)
+        np.add.at(self.scores, (sources, targets), deltas)
+        np.clip(self.scores, MIN_SCORE, MAX_SCORE, out=self.scores)
+        self.generation += 1
+
+    def row(self, source: int) -> np.ndarray:
+        """Return how the source character feels about every slot (a view, do not modify)."""
+        return self.scores[source]
+
+    def column(self, target: int) -> np.ndarray:
+        """Return how every slot feels about the target character (a view, do not modify)."""
+        return self.scores[:, target]
+
+    def _ranked(self, values: np.ndarray, exclude: int, count: int, descending: bool) -> list[tuple[int, float]]:
+        candidates = np.flatnonzero(self.active)
+        candidates = candidates[candidates != exclude]
+        if candidates.size == 0:
+            return []
+        order = np.argsort(values[candidates], kind="stable")
+        if descending:
+            order = order[::-1]
+        return [(int(slot), float(values[slot])) for slot in candidates[order[:count]]]
+
+    def liked_most_by(self, target: int, count: int = 1) -> list[tuple[int, float]]:
+        """Return the (slot, score) pairs of the characters who like the target the most."""
+        return self._ranked(self.column(target), target, count, descending=True)
+
+    def likes_most(self, source: int, count: int = 1) -> list[tuple[int, float]]:
+        """Return the (slot, score) pairs of the characters the source likes the most."""
+        return self._ranked(self.row(source), source, count, descending=True)
+
+    def disliked_most_by(self, target: int, count: int = 1) -> list[tuple[int, float]]:
+        """Return the (slot, score) pairs of the characters who dislike the target the most."""
+        return self._ranked(self.column(target), target, count, descending=False)
+
+    def grow(self, capacity: int) -> None:
+        """Make room for at least `capacity` slots, e.g. after portraits were added to assets/."""
+        if capacity <= self.capacity:
+            return
+        scores = np.zeros((capacity, capacity), dtype=np.float32)
+        scores[:self.capacity, :self.capacity] = self.scores
+        active = np.zeros(capacity, dtype=bool)
+        active[:self.capacity] = self.active
+        self.scores, self.active = scores, active
+
+    def add_character(self, slot: int) -> None:
+        """Give a new character initial scores towards every other character, and back."""
+        self.grow(slot + 1)
+        initial = self._rng.normal(INITIAL_MEAN, INITIAL_STD, size=(2, self.capacity))
+        initial = np.clip(np.rint(initial), MIN_SCORE, MAX_SCORE)
+        self.scores[slot, :] = initial[0]
+        self.scores[:, slot] = initial[1]
+        self.scores[slot, slot] = 0
+        self.active[slot] = True
+        self.generation += 1
+
+    def remove_character(self, slot: int) -> None:
+        """Clear every score to and from a slot, so that it can be reused."""
+        self.scores[slot, :] = 0
+        self.scores[:, slot] = 0
+        self.active[slot] = False
+        self.generation += 1
+
+    def sync_members(self, characters: list[dict]) -> None:
+        """Mark the given characters as the active ones, e.g. after loading at startup.
+
+        Args:
+            characters (list[dict]): Documents with at least _id and portrait_emoji_pair.
+        """
+        self.slots = {character["_id"]: character["portrait_emoji_pair"] for character in characters}
+        self.grow(max(self.slots.values(), default=-1) + 1)
+        active = np.zeros(self.capacity, dtype=bool)
+        active[list(self.slots.values())] = True
+        for slot in np.flatnonzero(active & ~self.active):
+            self.add_character(int(slot))
+        for slot in np.flatnonzero(self.active & ~active):
+            self.remove_character(int(slot))
+
+    def update_character(self, character_id: str, character: Optional[dict]) -> None:
+        """Add or remove characters as they are created or deleted. Used as a CharacterStore listener."""
+        slot = self.slots.get(character_id)
+        new_slot = character["portrait_emoji_pair"] if character is not None else None
+        if slot == new_slot:
+            return
+        if slot is not None:
+            del self.slots[character_id]
+            self.remove_character(slot)
+        if new_slot is not None:
+            self.slots[character_id] = new_slot
+            self.add_character(new_slot)
+
+    def to_bytes(self) -> bytes:
+        """Return the scores and active slots in a compact binary form."""
+        return self.scores.astype("<f4").tobytes() + np.packbits(self.active).tobytes()
+
+    def load_bytes(self, data: bytes, capacity: int) -> None:
+        """Load scores and active slots produced by to_bytes for a matrix of the given capacity.
+
+        The matrix grows to the saved capacity if it is smaller, so no saved slot is dropped;
+        slots beyond the saved capacity start at 0.
+        """
+        size = capacity * capacity * 4
+        scores = np.frombuffer(data[:size], dtype="<f4").reshape(capacity, capacity)
+        active = np.unpackbits(np.frombuffer(data[size:], dtype=np.uint8))[:capacity].astype(bool)
+        self.grow(capacity)
+        self.scores[:capacity, :capacity] = scores
+        self.active[:capacity] = active
+        self.saved_generation = self.generation
+
+    def save_file(self, path: Union[str, Path]) -> None:
+        """Save the matrix to a local binary file."""
+        Path(path).write_bytes(self.capacity.to_bytes(4, "little") + self.to_bytes())
+
+    def load_file(self, path: Union[str, Path]) -> None:
+        """Load the matrix from a local binary file written by save_file."""
+        data = Path(path).read_bytes()
+        self.load_bytes(data[4:], int.from_bytes(data[:4], "little"))
+
+
+class RelationshipStore:
+    """Persists a RelationshipMatrix as a single document."""
+
+    def __init__(self, store: CharacterStore, collection: Any, matrix: RelationshipMatrix,
+                 matrix_id: str = MATRIX_ID) -> None:
+        """Initialize the store.
+
+        Args:
+            store (CharacterStore): The store whose thread pool runs the driver calls.
+            collection (Any): The collection holding the matrix document.
+            matrix (RelationshipMatrix): The matrix to persist.
+            matrix_id (str): The _id of the matrix document.
+        """
+        self.store = store
+        self.collection = collection
+        self.matrix = matrix
+        self.matrix_id = matrix_id
+
+    async def load(self) -> None:
+        """Load the persisted matrix, if there is one."""
+        document = await self.store.run(self.collection.find_one, {"_id": self.matrix_id})
+        if document is not None:
+            self.matrix.load_bytes(bytes(document["data"]), document["capacity"])
+
+    async def save(self) -> None:
+        """Persist the matrix, if it changed since it was last saved or loaded.
+
+        The matrix only counts as saved once the write succeeded, so a failed save is retried
+        by the next one. Changes made while the write is in flight are saved by the next one too.
+        """
+        if not self.matrix.dirty:
+            return
+        generation = self.matrix.generation
+        document = {"capacity": self.matrix.capacity, "data": Binary(self.matrix.to_bytes())}
+        await self.store.run(self.collection.update_one, {"_id": self.matrix_id}, {"$set": document}, upsert=True)
+        self.matrix.saved_generation = generation
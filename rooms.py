@@ -0,0 +1,88 @@
+"""Elements for /move and /room commands."""
+
+from config import *
+
+# Rooms characters in the house can be in, i.e. every channel of a game that is a room
+HOUSE_ROOMS = ["HoH Bedroom", "Bedroom 1", "Bedroom 2", "Lounge", "Kitchen", "Backyard"]
+
+# Choices for the room argument of /move and /room
+room_choices = [app_commands.Choice(name=room, value=room) for room in HOUSE_ROOMS]
+
+# Embed to show when a command needs a character but the user does not have one
+no_character_embed = Embed(
+    description="You do not have a character yet. Use /setup to create one.",
+    color=0xFF0000,
+)
+
+# Embed to show when a character that is not in the house tries to move
+not_in_house_embed = Embed(
+    description="Only characters in the house can move between rooms.",
+    color=0xFF0000,
+)
+
+# Embed to show when a room of the move has no channel in the character's game
+room_unavailable_embed = Embed(
+    description="That room is not available in this game.",
+    color=0xFF0000,
+)
+
+# Embed to show when a character tries to move to the room they are already in
+already_in_room_embed = Embed(
+    description="You are already in that room.",
+    color=0xFF0000,
+)
+
+# Embed to show when a character was moved by something else while /move was running
+move_conflict_embed = Embed(
+    description="You were moved somewhere else in the meantime. Please try again.",
+    color=0xFF0000,
+)
+
+
+def moved_embed(room: str) -> Embed:
+    """Return the embed to show after a character moved to a room."""
+    return Embed(description=f"You moved to the **{room}**.", color=0x00FF00)
+
+
+def room_embed(game: Game, room: str) -> Embed:
+    """Return an embed listing the characters in a room of a game, read from its room index."""
+    names = sorted(game.name_index.name(character_id) or "Unknown"
+                   for character_id in game.room_index.occupants(room))
+    embed = Embed(title=room, color=0x00FF00)
+    embed.description = "\n".join(f"- {name}" for name in names) if names else "Nobody is here."
+    embed.set_footer(text=f"{len(names)} character{'s' if len(names) != 1 else ''}")
+    return embed
+
+
+async def move_character(character_id: str, to_room: str) -> Union[dict, Embed]:
+    """Move a character to a room, and announce it in both rooms.
+
+    Args:
+        character_id (str): The encrypted discord user id of the character.
+        to_room (str): The room to move to.
+
+    Returns:
+        Union[dict, Embed]: The character document after the move, or an embed explaining why
+        the character could not be moved.
+    """
+    game = games.of(character_id)
+    character = await character_store.get(character_id) if game is not None else None
+    if character is None:
+        return no_character_embed
+    if character.get("status") != "in house":
+        return not_in_house_embed
+    from_room = game.room_index.room_of(character_id)
+    if from_room == to_room:
+        return already_in_room_embed
+    # Checked before moving, so that a character is never moved without both rooms being told
+    from_channel = client.get_channel(game.channel_ids.get(from_room))
+    to_channel = client.get_channel(game.channel_ids.get(to_room))
+    if from_channel is None or to_channel is None:
+        return room_unavailable_embed
+    character = await character_store.move(character_id, from_room, to_room)
+    if character is None:
+        return move_conflict_embed
+    name = character["character_name"]
+    outbound_relay.send(from_channel, f"*{name} left for the {to_room}.*")
+    outbound_relay.send(to_channel, f"*{name} entered the room.*")
+    return character
@@ -0,0 +1,149 @@
+"""In-progress /setup sessions.
+
+Each player's progress through /setup is held in a compact SetupSession, keyed by encrypted
+user id, so that DMs are routed to the right session with a single dictionary lookup instead of
+being checked against a waiter per player. Sessions are persisted on every step, so they survive
+a restart, and are expired after SESSION_TIMEOUT seconds without activity.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from games import DEFAULT_GAME_ID
+from store import CharacterStore
+
+# Seconds without activity after which a setup session is abandoned
+SESSION_TIMEOUT = 30 * 60
+
+# Seconds between sweeps for idle sessions
+SWEEP_INTERVAL = 60
+
+
+class SetupSession:
+    """The state of one player's /setup."""
+
+    # Stages of the setup, in order
+    KEYNOTE = "keynote"
+    NAME = "name"
+    ROOM = "room"
+    TRAITS = "traits"
+    CONFIRM = "confirm"
+
+    __slots__ = ("session_id", "game_id", "stage", "character_name", "starting_room", "starting_traits",
+                 "current_trait", "points_so_far", "prompt_message_id", "updated_at")
+
+    def __init__(self, session_id: str, traits: list[str], game_id: str = DEFAULT_GAME_ID) -> None:
+        """Initialize a session at the keynote stage.
+
+        Args:
+            session_id (str): The encrypted discord user id of the player.
+            traits (list[str]): The traits points are distributed among.
+            game_id (str): The game the character is created in.
+        """
+        self.session_id = session_id
+        self.game_id = game_id
+        self.stage = SetupSession.KEYNOTE
+        self.character_name: Optional[str] = None
+        self.starting_room: Optional[str] = None
+        self.starting_traits = {trait: 0 for trait in traits}
+        self.current_trait = 0
+        self.points_so_far = 0
+        self.prompt_message_id: Optional[int] = None
+        self.updated_at = time.time()
+
+    def to_document(self) -> dict:
+        """Return the session as a document for the setup_sessions collection."""
+        document = {slot: getattr(self, slot) for slot in self.__slots__ if slot != "session_id"}
+        document["_id"] = self.session_id
+        document["updated_at"] = datetime.fromtimestamp(self.updated_at, timezone.utc)
+        return document
+
+    @classmethod
+    def from_document(cls, document: dict) -> "SetupSession":
+        """Return the session stored in a setup_sessions document."""
+        session = cls(document["_id"], [])
+        for slot in cls.__slots__:
+            if slot not in ("session_id", "updated_at") and slot in document:
+                setattr(session, slot, document[slot])
+        updated_at = document["updated_at"]
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        session.updated_at = updated_at.timestamp()
+        return session
+
+
+class SetupSessionManager:
+    """Holds every in-progress setup session, and persists them to a collection."""
+
+    def __init__(self, store: CharacterStore, collection: Any, traits: list[str],
+                 timeout: float = SESSION_TIMEOUT) -> None:
+        """Initialize the manager.
+
+        Args:
+            store (CharacterStore): The store whose thread pool runs the driver calls.
+            collection (Any): The collection sessions are persisted to.
+            traits (list[str]): The traits points are distributed among.
+            timeout (float): Seconds without activity after which a session expires.
+        """
+        self.store = store
+        self.collection = collection
+        self.traits = traits
+        self.timeout = timeout
+        self.sessions: dict[str, SetupSession] = {}
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self, session_id: str) -> Optional[SetupSession]:
+        """Return the player's session, or None if they are not setting up a character."""
+        return self.sessions.get(session_id)
+
+    def is_active(self, session: SetupSession) -> bool:
+        """Return whether the session is still the player's current, unexpired session."""
+        return self.sessions.get(session.session_id) is session and \
+            time.time() - session.updated_at < self.timeout
+
+    async def start(self, session_id: str, game_id: str = DEFAULT_GAME_ID) -> SetupSession:
+        """Start a new session for the player in a game, replacing any existing one."""
+        session = SetupSession(session_id, self.traits, game_id)
+        self.sessions[session_id] = session
+        await self.save(session)
+        return session
+
+    async def save(self, session: SetupSession) -> None:
+        """Mark the session as active now, and persist it."""
+        session.updated_at = time.time()
+        document = session.to_document()
+        await self.store.run(self.collection.replace_one, {"_id": session.session_id}, document, upsert=True)
+
+    async def end(self, session: SetupSession) -> None:
+        """Forget the session, e.g. once the character has been created."""
+        if self.sessions.get(session.session_id) is session:
+            del self.sessions[session.session_id]
+        await self.store.run(self.collection.delete_one, {"_id": session.session_id})
+
+    async def load(self) -> list[SetupSession]:
+        """Load the persisted sessions that have not expired. Run once at startup.
+
+        Returns:
+            list[SetupSession]: The loaded sessions, so that players can be prompted to resume.
+        """
+        # Persisted sessions are also removed by a TTL index, but it only runs once a minute
+        await self.store.run(self.collection.create_index, "updated_at", expireAfterSeconds=int(self.timeout))
+        documents = await self.store.run(lambda: list(self.collection.find({})))
+        sessions = [SetupSession.from_document(document) for document in documents]
+        now = time.time()
+        self.sessions = {session.session_id: session for session in sessions
+                         if now - session.updated_at < self.timeout}
+        return list(self.sessions.values())
+
+    async def expire_idle(self) -> None:
+        """Remove idle sessions every SWEEP_INTERVAL seconds, until cancelled."""
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            cutoff = time.time() - self.timeout
+            expired = [session for session in self.sessions.values() if session.updated_at < cutoff]
+            for session in expired:
+                await self.end(session)
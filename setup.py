@@ -21,6 +21,13 @@ already_has_character_embed = Embed(
     color=0xFF0000,
 )
 
+# Embed to show when user attempts to create a character while playing in another game
+character_in_other_game_embed = Embed(
+    title="You already play in another game!",
+    description="You can only have one character at a time, and yours is in another game.",
+    color=0xFF0000,
+)
+
 
 class InitialDuplicateStartOverView(discord.ui.View):
     """A View to show when user attempts to create another character."""
@@ -30,6 +37,7 @@ class InitialDuplicateStartOverView(discord.ui.View):
         self.interaction = interaction
 
     @discord.ui.button(label="Start Over", style=ButtonStyle.blurple)
+    @timed("view_callback_seconds", label="callback")
     async def start_over(self, interaction: discord.Interaction, button: discord.ui.Button):
         """A button to start the character creation process again.
 
@@ -40,12 +48,15 @@ class InitialDuplicateStartOverView(discord.ui.View):
         await interaction.message.delete()
         user_id = self.interaction.user.id
         encrypted_user_id = encrypt_id(user_id)
-        characters_db.delete_one({"_id": encrypted_user_id})
-        assert characters_db.find_one({"_id": encrypted_user_id}) is None
-        view = KeynoteConfirmView(self.interaction)
-        await self.interaction.user.send(embed=keynote_embed, view=view)
+        game = game_for(self.interaction)
+        if not await delete_character(encrypted_user_id, game.game_id) and \
+                await character_store.get(encrypted_user_id) is not None:
+            await interaction.response.send_message(embed=character_in_other_game_embed)
+            return
+        await start_setup(self.interaction.user, game.game_id)
 
     @discord.ui.button(label="Cancel", style=ButtonStyle.red)
+    @timed("view_callback_seconds", label="callback")
     async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
         """A button to cancel the character creation process."""
         await interaction.message.delete()
@@ -95,7 +106,10 @@ starting_room_select_options = [SelectOption(label="Bedroom 1"),
 # List of stats that the user will be able to choose from
 TRAITS_OPTIONS = ["Strength", "Dexterity", "Constitution", "Intelligence", "Charisma"]
 
-# Fifth embed of /setup inside DM channel (edited over recursive calls)
+# In-progress /setup sessions, keyed by encrypted user id
+setup_sessions = SetupSessionManager(character_store, setup_sessions_db, TRAITS_OPTIONS)
+
+# Fifth embed of /setup inside DM channel (edited for every trait)
 # TODO: Could also give a short description of each stat
 # If change in TRAITS_OPTIONS, this needs to be modified manually
 starting_traits_select_embed = Embed(
@@ -121,6 +135,34 @@ final_setup_confirmation_embed = Embed(
     color=0x00FF00,
 )
 
+# Number of times confirming tries to claim a free portrait emoji pair before giving up
+MAX_CREATE_ATTEMPTS = 5
+
+# Embed to show when every portrait emoji pair has been taken
+no_portraits_left_embed = Embed(
+    title="The house is full!",
+    description="Every portrait has already been taken, so no more characters can be created.",
+    color=0xFF0000,
+)
+
+# Embed to show when the character could not be saved
+character_not_saved_embed = Embed(
+    description="Your character could not be saved. Please press Confirm again.",
+    color=0xFF0000,
+)
+
+# Embed to show when a setup View is used after its session expired or was replaced
+setup_expired_embed = Embed(
+    description="This setup has expired. Use /setup to start again.",
+    color=0xFF0000,
+)
+
+# Embed to show above the current step when a setup is resumed after a restart
+setup_resumed_embed = Embed(
+    description="Sorry, I was restarted! Let's continue where you left off.",
+    color=0x00FF00,
+)
+
 # Embed to show when the character name is already taken
 character_name_taken_embed = Embed(
     title="Character name already taken!",
@@ -130,49 +172,47 @@ character_name_taken_embed = Embed(
 )
 
 
-class KeynoteConfirmView(discord.ui.View):
-    """A View to confirm that the user has read the keynote."""
+class SetupSessionView(discord.ui.View):
+    """A parent class for Views that advance a setup session.
 
-    def __init__(self, interaction: Interaction):
-        super().__init__()
-        self.interaction = interaction
-        self.character_name = None
+    The View stops responding once its session has expired or been replaced by a new /setup.
+    """
 
-    @discord.ui.button(label="I understand", style=ButtonStyle.green)
-    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
-        """A button to confirm that the user has read the keynote."""
-        self.remove_item(button)
-        await interaction.response.edit_message(embed=character_name_request_embed, view=None)
+    def __init__(self, session: SetupSession):
+        super().__init__(timeout=SESSION_TIMEOUT)
+        self.session = session
 
-        def check(m) -> bool:
-            """Check that the message is sent by the user in DMs."""
-            return m.author == interaction.user and isinstance(m.channel, DMChannel)
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        """Only let the interaction through if the session is still active."""
+        if setup_sessions.is_active(self.session):
+            return True
+        await interaction.response.send_message(embed=setup_expired_embed)
+        return False
 
-        msg = await client.wait_for("message", check=check)
-        self.character_name = msg.content
-        await interaction.message.delete()
 
-        starting_room_select_embed.title = f"Welcome, {self.character_name}!"
-        view = StartingRoomSelectView(interaction)
-        view.character_name = self.character_name
-        for child in view.children:
-            if child.custom_id != "starting_room_select":
-                view.remove_item(child)
-        await interaction.followup.send(embed=starting_room_select_embed, view=view)
+class KeynoteConfirmView(SetupSessionView):
+    """A View to confirm that the user has read the keynote."""
+
+    @discord.ui.button(label="I understand", style=ButtonStyle.green)
+    @timed("view_callback_seconds", label="callback")
+    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """A button to confirm that the user has read the keynote.
 
+        The character name is then received by on_message, which passes it to handle_character_name.
+        """
+        self.session.stage = SetupSession.NAME
+        self.session.prompt_message_id = interaction.message.id
+        await setup_sessions.save(self.session)
+        await interaction.response.edit_message(embed=character_name_request_embed, view=None)
 
-class StartingRoomSelectView(KeynoteConfirmView):
-    """A View to select a starting room."""
 
-    def __init__(self, interaction: Interaction):
-        super().__init__(interaction)
-        self.starting_room = None
-        self.options = starting_room_select_options
-        self.children.clear()
+class StartingRoomSelectView(SetupSessionView):
+    """A View to select a starting room."""
 
     @discord.ui.select(placeholder="Select a starting room...",
                        options=starting_room_select_options,
                        custom_id="starting_room_select")
+    @timed("view_callback_seconds", label="callback")
     async def select(self, interaction: Interaction, select: discord.ui.Select):
         """A select menu to select a starting room.
 
@@ -180,100 +220,84 @@ class StartingRoomSelectView(KeynoteConfirmView):
             interaction (Interaction): The interaction that triggered this View.
             select (discord.ui.Select): The select menu that triggered this function.
         """
-        self.starting_room = select.values[0]
-        view = StartingTraitsSelectView(interaction)
-        view.character_name = self.character_name
-        view.starting_room = self.starting_room
-        await interaction.response.edit_message(embed=starting_traits_select_embed,
-                                                view=view)
+        self.session.starting_room = select.values[0]
+        self.session.stage = SetupSession.TRAITS
+        await setup_sessions.save(self.session)
+        embed, view = setup_step(self.session)
+        await interaction.response.edit_message(embed=embed, view=view)
 
 
-class StartingTraitsSelectView(StartingRoomSelectView):
-    """A View to distribute points for starting traits."""
+class StartingTraitsSelectView(SetupSessionView):
+    """A View to distribute points for starting traits.
 
-    def __init__(self, interaction: Interaction):
-        super().__init__(interaction)
-        self.current_trait = 0
-        self.max_points = 20
-        self.min_points = 0
-        self.points_so_far = 0
-        self.options = starting_traits_select_options.copy()
+    The same View is edited for every trait, with the select options narrowed to the points
+    that can still be given.
+    """
+
+    def __init__(self, session: SetupSession):
+        super().__init__(session)
         self.embed = starting_traits_select_embed.copy()
-        self.starting_traits = {trait: 0 for trait in TRAITS_OPTIONS}
-        for child in self.children:
-            if child.custom_id != "starting_traits_select":
-                self.remove_item(child)
+        self.update_select()
+
+    def update_select(self) -> None:
+        """Update the embed and select menu for the session's current trait."""
+        session = self.session
+        min_points = new_min_points(current_trait=session.current_trait, points_so_far=session.points_so_far)
+        max_points = new_max_points(current_trait=session.current_trait, points_so_far=session.points_so_far)
+        self.select.options = [SelectOption(label=f"{i}") for i in range(min_points, max_points + 1)]
+        self.select.placeholder = f"Points for {TRAITS_OPTIONS[session.current_trait]}..."
+        if session.current_trait > 0:
+            self.embed.description = f"You have **{60 - session.points_so_far} points left** to distribute, with\n" \
+                                     "**20 points maximum** for each trait:\n\n" + \
+                                     "\n".join(f"**{trait}**: {points}"
+                                               for trait, points in session.starting_traits.items()) + \
+                                     f"\n\nSelect number of points for your **{TRAITS_OPTIONS[session.current_trait]}**:"
 
     @discord.ui.select(placeholder="Points for Strength...",
                        options=starting_traits_select_options,
                        custom_id="starting_traits_select")
+    @timed("view_callback_seconds", label="callback")
     async def select(self, interaction: Interaction, select: discord.ui.Select):
+        session = self.session
         points_given = int(select.values[0])
-        self.points_so_far += points_given
-        self.starting_traits[TRAITS_OPTIONS[self.current_trait]] = points_given
-        self.current_trait += 1
-        self.min_points = new_min_points(current_trait=self.current_trait,
-                                         points_so_far=self.points_so_far)
-        self.max_points = new_max_points(current_trait=self.current_trait,
-                                         points_so_far=self.points_so_far)
-        if self.current_trait == 4 or self.min_points == 20 or self.max_points == 0:
-            if self.current_trait == 4:
-                assert 0 <= 60 - self.points_so_far <= 20
-                self.starting_traits[TRAITS_OPTIONS[self.current_trait]] = 60 - self.points_so_far
-            elif self.min_points == 20:
-                for i in range(self.current_trait, 5):
-                    self.starting_traits[TRAITS_OPTIONS[i]] = 20
-            elif self.max_points == 0:
-                for i in range(self.current_trait, 5):
-                    self.starting_traits[TRAITS_OPTIONS[i]] = 0
-            embed = final_setup_confirmation_embed.copy()
-            embed.add_field(name="Character Name", value=self.character_name, inline=True)
-            embed.add_field(name="Starting Room", value=self.starting_room, inline=True)
-            embed.add_field(name="Starting Traits", value="\n".join([f"{trait}: {points}" for trait, points
-                                                                     in self.starting_traits.items()]), inline=False)
-            view = FinalSetupConfirmationView(interaction, self.character_name, self.starting_room,
-                                              self.starting_traits, embed)
+        session.points_so_far += points_given
+        session.starting_traits[TRAITS_OPTIONS[session.current_trait]] = points_given
+        session.current_trait += 1
+        min_points = new_min_points(current_trait=session.current_trait,
+                                    points_so_far=session.points_so_far)
+        max_points = new_max_points(current_trait=session.current_trait,
+                                    points_so_far=session.points_so_far)
+        if session.current_trait == 4 or min_points == 20 or max_points == 0:
+            if session.current_trait == 4:
+                assert 0 <= 60 - session.points_so_far <= 20
+                session.starting_traits[TRAITS_OPTIONS[session.current_trait]] = 60 - session.points_so_far
+            elif min_points == 20:
+                for i in range(session.current_trait, 5):
+                    session.starting_traits[TRAITS_OPTIONS[i]] = 20
+            elif max_points == 0:
+                for i in range(session.current_trait, 5):
+                    session.starting_traits[TRAITS_OPTIONS[i]] = 0
+            session.stage = SetupSession.CONFIRM
+            await setup_sessions.save(session)
+            embed, view = setup_step(session)
             await interaction.response.edit_message(embed=embed, view=view)
         else:
-            self.options = [SelectOption(label=f"{i}") for i in range(self.min_points, self.max_points + 1)]
-            self.embed.description = f"You have **{60 - self.points_so_far} points left** to distribute, with\n" \
-                                     "**20 points maximum** for each trait:\n" \
-                                     f"\n**Strength**: {self.starting_traits['Strength']}" \
-                                     f"\n**Dexterity**: {self.starting_traits['Dexterity']}" \
-                                     f"\n**Constitution**: {self.starting_traits['Constitution']}" \
-                                     f"\n**Intelligence**: {self.starting_traits['Intelligence']}" \
-                                     f"\n**Charisma**: {self.starting_traits['Charisma']}" \
-                                     f"\n\nSelect number of points for your **{TRAITS_OPTIONS[self.current_trait]}**:"
-            new_view = StartingTraitsSelectView(interaction)
-            new_view.character_name = self.character_name
-            new_view.starting_room = self.starting_room
-            new_view.starting_traits = self.starting_traits
-            new_view.current_trait = self.current_trait
-            new_view.max_points = self.max_points
-            new_view.min_points = self.min_points
-            new_view.points_so_far = self.points_so_far
-            new_view.options = self.options
-            new_view.embed = self.embed
-            new_view.children[0].placeholder = f"Points for {TRAITS_OPTIONS[self.current_trait]}..."
-            new_view.children[0].options = self.options
-            await interaction.response.edit_message(embed=self.embed, view=new_view)
-
-
-class FinalSetupConfirmationView(discord.ui.View):
+            await setup_sessions.save(session)
+            self.update_select()
+            await interaction.response.edit_message(embed=self.embed, view=self)
+
+
+class FinalSetupConfirmationView(SetupSessionView):
     """A View to confirm final step of the setup."""
 
-    def __init__(self, interaction: Interaction, character_name: str,
-                 starting_room: str, starting_traits: dict, embed: Embed):
-        super().__init__()
-        self.interaction = interaction
-        self.character_name = character_name
-        self.starting_room = starting_room
-        self.starting_traits = starting_traits
+    def __init__(self, session: SetupSession, embed: Embed):
+        super().__init__(session)
         # portrait_emoji_pair is an integer, starting 0
         self.portrait_emoji_pair = None
         self.embed = embed
 
     @discord.ui.button(label="Confirm", style=discord.ButtonStyle.green)
+    @timed("view_callback_seconds", label="callback")
     async def confirm(self, interaction: Interaction, button: discord.ui.Button):
         """A button to confirm final step of the setup.
 
@@ -282,39 +306,68 @@ class FinalSetupConfirmationView(discord.ui.View):
             button (discord.ui.Button): The button that triggered this function.
         """
         await interaction.response.defer()
-        chosen_character_names = updated_db_elements()[0]
-        self.portrait_emoji_pair = assign_portrait_emoji_pair()
-        if self.character_name in chosen_character_names:
-            await interaction.message.delete()
-            await interaction.followup.send(embed=self.embed)
-            view = ConfirmDuplicateStartOverView(interaction)
-            await interaction.followup.send(embed=character_name_taken_embed, view=view)
-        else:
-            user_id = str(interaction.user.id)
-            encrypted_user_id = encrypt_id(user_id)
+        user_id = str(interaction.user.id)
+        encrypted_user_id = encrypt_id(user_id)
+        # The unique indexes on character_name and portrait_emoji_pair make creation atomic.
+        # If another player confirmed with the same portrait emoji pair at the same time,
+        # try again with the next free one.
+        for _ in range(MAX_CREATE_ATTEMPTS):
+            try:
+                self.portrait_emoji_pair = await portrait_allocator.allocate(self.session.game_id)
+            except PortraitsExhausted:
+                await interaction.followup.send(embed=no_portraits_left_embed)
+                return
             data = {
-                "character_name": self.character_name,
+                "game_id": self.session.game_id,
+                "character_name": self.session.character_name,
                 "portrait_emoji_pair": self.portrait_emoji_pair,
-                "current_room": self.starting_room,
+                "current_room": self.session.starting_room,
                 "status": "in house",
-                "traits": self.starting_traits,
+                "traits": self.session.starting_traits,
                 "stats": {  # TODO: max 100? 200?
                     "Hunger": 100,
                     "Energy": 100,
                     "Activity": 100,
                     "Socialization": 100
                 },
-                # TODO: implement relationship stats (standard distribution, how exactly?)
+                # Relationship stats are kept in the relationships matrix, keyed by portrait_emoji_pair
             }
-            characters_db.update_one({"_id": encrypted_user_id}, {"$set": data}, upsert=True)
-            # Get the thumbnail file, set it as thumbnail for the embed, and upload the
-            # file itself as well when sending followup
-            thumbnail_file = get_thumbnail_file(self.portrait_emoji_pair)
-            self.embed.set_thumbnail(url='attachment://image.jpg')
-            await interaction.followup.send("Character Saved!", embed=self.embed, files=[thumbnail_file])
-            await interaction.message.delete()
+            try:
+                await character_store.create(encrypted_user_id, data)
+                break
+            except DuplicateKeyError as error:
+                field = duplicate_key_field(error)
+                if field == "_id":
+                    # Confirmed twice: the other click created the character and answers the player
+                    await portrait_allocator.release(self.portrait_emoji_pair, self.session.game_id)
+                    return
+                # A clash on portrait_emoji_pair means the slot is in use, so it is not released
+                if field != "portrait_emoji_pair":
+                    await portrait_allocator.release(self.portrait_emoji_pair, self.session.game_id)
+                    await setup_sessions.end(self.session)
+                    await interaction.message.delete()
+                    await interaction.followup.send(embed=self.embed)
+                    view = ConfirmDuplicateStartOverView(interaction, self.session.game_id)
+                    await interaction.followup.send(embed=character_name_taken_embed, view=view)
+                    return
+        else:
+            # Every slot handed out was in use, so the counter is out of step with the characters
+            # and is rebuilt from them. The interaction is already deferred, so the player is told
+            # through a followup. The session stays active, so the player can confirm again
+            await portrait_allocator.reconcile(self.session.game_id)
+            await interaction.followup.send(embed=character_not_saved_embed)
+            return
+        await setup_sessions.end(self.session)
+        # Reference the uploaded portrait by URL, or upload the file itself as well when
+        # sending followup if the portrait has not been uploaded yet
+        thumbnail_url, thumbnail_file = portrait_assets.thumbnail(self.portrait_emoji_pair)
+        self.embed.set_thumbnail(url=thumbnail_url)
+        await interaction.followup.send("Character Saved!", embed=self.embed,
+                                        files=[thumbnail_file] if thumbnail_file else [])
+        await interaction.message.delete()
 
     @discord.ui.button(label="Start Over", style=discord.ButtonStyle.red)
+    @timed("view_callback_seconds", label="callback")
     async def start_over(self, interaction: Interaction, button: discord.ui.Button):
         """A button to start over the setup.
 
@@ -326,20 +379,21 @@ class FinalSetupConfirmationView(discord.ui.View):
         await interaction.response.send_message(embed=self.embed)
         user_id = str(interaction.user.id)
         encrypted_user_id = encrypt_id(user_id)
-        characters_db.delete_one({"_id": encrypted_user_id})
-        view = KeynoteConfirmView(interaction)
-        await interaction.user.send(embed=keynote_embed, view=view)
+        await delete_character(encrypted_user_id, self.session.game_id)
+        await start_setup(interaction.user, self.session.game_id)
 
 
 class ConfirmDuplicateStartOverView(discord.ui.View):
     """A View to confirm starting over the setup after
     a duplicate character name or portrait emoji pair."""
 
-    def __init__(self, interaction: Interaction):
+    def __init__(self, interaction: Interaction, game_id: str = DEFAULT_GAME_ID):
         super().__init__()
         self.interaction = interaction
+        self.game_id = game_id
 
     @discord.ui.button(label="Start Over", style=discord.ButtonStyle.red)
+    @timed("view_callback_seconds", label="callback")
     async def start_over(self, interaction: Interaction, button: discord.ui.Button):
         """A button to start over the setup.
 
@@ -350,40 +404,84 @@ class ConfirmDuplicateStartOverView(discord.ui.View):
         await interaction.message.delete()
         user_id = str(interaction.user.id)
         encrypted_user_id = encrypt_id(user_id)
-        characters_db.delete_one({"_id": encrypted_user_id})
-        view = KeynoteConfirmView(interaction)
-        await interaction.user.send(embed=keynote_embed, view=view)
-
-
-def updated_db_elements() -> tuple[list, list]:
-    """Return updated chosen_character_names and
-    chosen_portrait_emoji_pairs from the database.
+        await delete_character(encrypted_user_id, self.game_id)
+        await start_setup(interaction.user, self.game_id)
+
+
+def final_setup_embed(session: SetupSession) -> Embed:
+    """Return the embed summarizing the character details of a finished setup session."""
+    embed = final_setup_confirmation_embed.copy()
+    embed.add_field(name="Character Name", value=session.character_name, inline=True)
+    embed.add_field(name="Starting Room", value=session.starting_room, inline=True)
+    embed.add_field(name="Starting Traits", value="\n".join([f"{trait}: {points}" for trait, points
+                                                             in session.starting_traits.items()]), inline=False)
+    return embed
+
+
+def setup_step(session: SetupSession) -> tuple[Embed, Optional[discord.ui.View]]:
+    """Return the embed and View for the session's current stage."""
+    if session.stage == SetupSession.KEYNOTE:
+        return keynote_embed, KeynoteConfirmView(session)
+    if session.stage == SetupSession.NAME:
+        return character_name_request_embed, None
+    if session.stage == SetupSession.ROOM:
+        embed = starting_room_select_embed.copy()
+        embed.title = f"Welcome, {session.character_name}!"
+        return embed, StartingRoomSelectView(session)
+    if session.stage == SetupSession.TRAITS:
+        view = StartingTraitsSelectView(session)
+        return view.embed, view
+    embed = final_setup_embed(session)
+    return embed, FinalSetupConfirmationView(session, embed)
+
+
+async def start_setup(user: discord.abc.User, game_id: str = DEFAULT_GAME_ID) -> None:
+    """Start a new setup session for the user in a game, replacing any existing one, and DM them the keynote."""
+    session = await setup_sessions.start(encrypt_id(user.id), game_id)
+    await user.send(embed=keynote_embed, view=KeynoteConfirmView(session))
+
+
+async def handle_character_name(message: Message, session: SetupSession) -> None:
+    """Record the character name sent by DM, and move the session on to the starting room.
+
+    Args:
+        message (Message): The DM containing the character name.
+        session (SetupSession): The sender's session, which is waiting for a name.
+    """
+    session.character_name = message.content
+    session.stage = SetupSession.ROOM
+    if session.prompt_message_id is not None:
+        try:
+            await message.channel.get_partial_message(session.prompt_message_id).delete()
+        except discord.NotFound:
+            pass
+        session.prompt_message_id = None
+    await setup_sessions.save(session)
+    embed, view = setup_step(session)
+    await message.channel.send(embed=embed, view=view)
+
+
+async def resume_setup(session: SetupSession) -> None:
+    """DM the player their current setup step again, after a restart."""
+    user = await client.fetch_user(int(decrypt_id(session.session_id)))
+    embed, view = setup_step(session)
+    message = await user.send(embeds=[setup_resumed_embed, embed], view=view)
+    if session.stage == SetupSession.NAME:
+        session.prompt_message_id = message.id
+        await setup_sessions.save(session)
+
+
+async def delete_character(encrypted_user_id: str, game_id: str) -> bool:
+    """Delete the user's character in a game, if any, and release its portrait emoji pair.
 
     Returns:
-        tuple[list, list]: Updated chosen_character_names and
-        chosen_portrait_emoji_pairs from the database.
+        bool: Whether a character was deleted. A character in another game is never deleted.
     """
-    chosen_character_names = []
-    chosen_portrait_emoji_pairs = []
-    for document in characters_db.find():
-        chosen_character_names.append(document["character_name"])
-        chosen_portrait_emoji_pairs.append(document["portrait_emoji_pair"])
-    return chosen_character_names, chosen_portrait_emoji_pairs
-
-
-def assign_portrait_emoji_pair() -> int:
-    """Return the appropriate portrait emoji pair given the chosen pairs in the db."""
-    chosen_portrait_emoji_pairs = set(updated_db_elements()[1])
-    if len(chosen_portrait_emoji_pairs) == 0:
-        return 0
-    else:
-        max_elem = max(chosen_portrait_emoji_pairs)
-        default = {i for i in range(max_elem + 1)}
-        if default == chosen_portrait_emoji_pairs:
-            return max_elem + 1
-        else:
-            diff = list(default - chosen_portrait_emoji_pairs)
-            return min(diff)
+    character = await character_store.delete(encrypted_user_id, game_id)
+    if character is None:
+        return False
+    await portrait_allocator.release(character["portrait_emoji_pair"], game_id)
+    return True
 
 
 def new_max_points(current_trait: int, points_so_far: int) -> int:
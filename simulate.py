@@ -0,0 +1,447 @@
+"""Offline load simulation of the bot's command paths.
+
+Replays scripted scenarios against the real handlers, with fake Discord objects and the in-memory
+database, and reports throughput, latency percentiles and database operations per action.
+
+Run with:
+    python simulate.py [--players N] [--chatters M] [--viewers K] [--output results.json]
+
+Scenarios:
+    setup     N players go through /setup concurrently, from the keynote to the final confirm.
+    chat      M players spread across the rooms send messages at once.
+    viewstats K viewers open /viewstats and page through every character.
+
+Results are written as JSON (see --output), so runs can be compared across commits.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Any, Awaitable, Optional
+
+# Run against the in-memory database, without the metrics endpoint
+os.environ.setdefault("memory_db", "1")
+os.environ.setdefault("encryption_key", "0")
+os.environ.setdefault("metrics_port", "0")
+os.environ.setdefault("default_guild", "1")
+
+import discord
+
+import main
+from main import *
+from webhooks import WEBHOOK_NAME
+
+# Starting trait points picked by every simulated player, in the order the traits are asked
+TRAIT_PICKS = ["20", "20", "10", "10"]
+
+_ids = itertools.count(10 ** 17)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Return the q-th quantile (0 to 1) of the values, by nearest rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class OperationCounter:
+    """Counts the database operations made through the collections it wraps."""
+
+    def __init__(self) -> None:
+        self.counts = Counter()
+
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+class CountingCollection:
+    """Wraps a collection, counting every method call as one database operation."""
+
+    def __init__(self, collection: Any, counter: OperationCounter) -> None:
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, attribute: str) -> Any:
+        value = getattr(self._collection, attribute)
+        if not callable(value):
+            return value
+
+        def counted(*args, **kwargs):
+            self._counter.counts[f"{self._collection.name}.{attribute}"] += 1
+            return value(*args, **kwargs)
+
+        return counted
+
+
+class FakeMessage:
+    """A sent message, or a DM received by the bot."""
+
+    def __init__(self, channel: "FakeChannel", content: Optional[str] = None, author: Any = None,
+                 embeds: Optional[list] = None, view: Optional[discord.ui.View] = None) -> None:
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content or ""
+        self.author = author
+        self.embeds = embeds or []
+        self.view = view
+        self.attachments = []
+
+    async def delete(self) -> None:
+        pass
+
+
+class FakeChannel:
+    """A text or DM channel recording what the bot sends, after a simulated API latency."""
+
+    def __init__(self, latency: float, channel_id: Optional[int] = None, guild_id: Optional[int] = None) -> None:
+        self.id = channel_id or next(_ids)
+        self.guild_id = guild_id
+        self.latency = latency
+        self.messages: list[FakeMessage] = []
+        self.sends = 0
+
+    async def send(self, content: Optional[str] = None, *, embed: Optional[Embed] = None,
+                   embeds: Optional[list] = None, view: Optional[discord.ui.View] = None, **kwargs) -> FakeMessage:
+        await asyncio.sleep(self.latency)
+        self.sends += 1
+        message = FakeMessage(self, content, embeds=embeds or ([embed] if embed else []), view=view)
+        self.messages.append(message)
+        return message
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self)
+
+
+class FakeDMChannel(FakeChannel, DMChannel):
+    """A DM channel, recognized as one by isinstance checks."""
+
+    def __init__(self, latency: float) -> None:
+        FakeChannel.__init__(self, latency)
+
+
+class FakeWebhook:
+    """A webhook posting into a FakeChannel."""
+
+    def __init__(self, channel: FakeChannel, user: Any) -> None:
+        self.channel = channel
+        self.user = user
+        self.name = WEBHOOK_NAME
+        self.token = "token"
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        await self.channel.send(content)
+
+
+class FakeRoomChannel(FakeChannel):
+    """A room channel that supports webhooks."""
+
+    def __init__(self, latency: float, channel_id: int, bot_user: Any) -> None:
+        super().__init__(latency, channel_id)
+        self.bot_user = bot_user
+        self.hooks: list[FakeWebhook] = []
+
+    async def webhooks(self) -> list[FakeWebhook]:
+        return list(self.hooks)
+
+    async def create_webhook(self, name: str) -> FakeWebhook:
+        webhook = FakeWebhook(self, self.bot_user)
+        self.hooks.append(webhook)
+        return webhook
+
+
+class FakeUser:
+    """A player, with their DM channel."""
+
+    def __init__(self, latency: float, user_id: Optional[int] = None) -> None:
+        self.id = user_id or next(_ids)
+        self.dm = FakeDMChannel(latency)
+        self.display_name = f"Player {self.id}"
+        self.display_avatar = type("Avatar", (), {"url": "https://cdn.invalid/avatar.png"})()
+
+    async def send(self, *args, **kwargs) -> FakeMessage:
+        return await self.dm.send(*args, **kwargs)
+
+
+class FakeResponse:
+    """The response of a FakeInteraction; only the first response is allowed."""
+
+    def __init__(self, interaction: "FakeInteraction") -> None:
+        self.interaction = interaction
+        self.done = False
+
+    def _respond(self) -> None:
+        if self.done:
+            raise discord.errors.InteractionResponded(self.interaction)
+        self.done = True
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def send_message(self, content: Optional[str] = None, *, embed: Optional[Embed] = None,
+                           view: Optional[discord.ui.View] = None, **kwargs) -> None:
+        self._respond()
+        message = await self.interaction.channel.send(content, embed=embed, view=view)
+        self.interaction.message = message
+
+    async def edit_message(self, *, embed: Optional[Embed] = None, view: Any = utils.MISSING, **kwargs) -> None:
+        self._respond()
+        await asyncio.sleep(self.interaction.channel.latency)
+        if embed is not None:
+            self.interaction.message.embeds = [embed]
+        if view is not utils.MISSING:
+            self.interaction.message.view = view
+
+    async def defer(self, **kwargs) -> None:
+        self._respond()
+
+
+class FakeFollowup:
+    """The followup webhook of a FakeInteraction."""
+
+    def __init__(self, interaction: "FakeInteraction") -> None:
+        self.interaction = interaction
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        return await self.interaction.channel.send(content, **kwargs)
+
+
+class FakeInteraction:
+    """A slash command or component interaction from a user."""
+
+    def __init__(self, user: FakeUser, channel: FakeChannel, message: Optional[FakeMessage] = None) -> None:
+        self.id = next(_ids)
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild_id = channel.guild_id
+        self.message = message
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+
+class FakeClient:
+    """The parts of discord.Client used by the relays."""
+
+    def __init__(self, latency: float) -> None:
+        self.user = FakeUser(latency)
+        self.users: dict[int, FakeUser] = {}
+
+    async def create_dm(self, user: Any) -> FakeDMChannel:
+        return self.users[user.id].dm
+
+    async def fetch_user(self, user_id: int) -> FakeUser:
+        return self.users[user_id]
+
+
+class Simulation:
+    """Runs scenarios against the bot's handlers and collects their measurements."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        """Install the fakes and counting collections.
+
+        Args:
+            latency (float): Simulated Discord API latency of every send and edit, in seconds.
+        """
+        self.latency = latency
+        self.operations = OperationCounter()
+        self.fake_client = FakeClient(latency)
+        self.rooms = {channel_id: FakeRoomChannel(latency, channel_id, self.fake_client.user)
+                      for channel_id in CHANNEL_IDS.values()}
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        for collection in (characters_db, counters_db, assets_db, setup_sessions_db, relationships_db, games_db):
+            collection._collection = CountingCollection(collection.resolve(), self.operations)
+        client.get_channel = self.rooms.get
+        client.fetch_user = self.fake_client.fetch_user
+        webhook_pool.client = self.fake_client
+        dm_fanout.client = self.fake_client
+        main.BLOCK_COMMANDS = False
+
+    def user(self) -> FakeUser:
+        """Return a new player."""
+        user = FakeUser(self.latency)
+        self.fake_client.users[user.id] = user
+        return user
+
+    async def measure(self, action: str, coroutine: Awaitable) -> Any:
+        """Await the coroutine, recording its latency under the action name."""
+        started = time.perf_counter()
+        try:
+            return await coroutine
+        finally:
+            self.latencies[action].append(time.perf_counter() - started)
+
+    async def click(self, action: str, user: FakeUser, item: str, values: Optional[list[str]] = None) -> None:
+        """Use a component of the view on the user's latest DM."""
+        message = user.dm.messages[-1]
+        view = message.view
+        interaction = FakeInteraction(user, user.dm, message)
+        component = getattr(view, item)
+        if values is not None:
+            component._values = values
+        if await view.interaction_check(interaction):
+            await self.measure(action, component.callback(interaction))
+
+    async def prepare(self) -> None:
+        """Load the database state the handlers rely on, as on_ready would."""
+        await load_database()
+        # Serve every portrait by URL, so that embeds never read assets/ from disk
+        portrait_assets.urls = {slot: f"https://cdn.invalid/{slot}.jpg" for slot in range(portrait_allocator.capacity)}
+
+    async def seed(self, count: int) -> list[FakeUser]:
+        """Create characters directly in the store, spread across the house rooms."""
+        users = []
+        for index in range(count):
+            user = self.user()
+            try:
+                slot = await portrait_allocator.allocate()
+            except PortraitsExhausted:
+                # More characters than portraits; any unique slot will do for the simulation
+                slot = 1000 + index
+                portrait_assets.urls[slot] = f"https://cdn.invalid/{slot}.jpg"
+            await character_store.create(encrypt_id(user.id), {
+                "game_id": DEFAULT_GAME_ID,
+                "character_name": f"Seeded {user.id}",
+                "portrait_emoji_pair": slot,
+                "current_room": HOUSE_ROOMS[index % len(HOUSE_ROOMS)],
+                "status": "in house",
+                "traits": {trait: 10 for trait in TRAITS_OPTIONS},
+                "stats": {"Hunger": 100, "Energy": 100, "Activity": 100, "Socialization": 100},
+            })
+            users.append(user)
+        return users
+
+    async def player_setup(self, user: FakeUser) -> None:
+        """Go through /setup as one player."""
+        interaction = FakeInteraction(user, user.dm)
+        await self.measure("/setup", main.setup.callback(interaction))
+        await self.click("keynote confirm", user, "confirm")
+        await self.measure("name message", on_message(FakeMessage(user.dm, f"Player {user.id}", author=user)))
+        await self.click("room select", user, "select", [HOUSE_ROOMS[user.id % 3]])
+        for points in TRAIT_PICKS:
+            await self.click("trait select", user, "select", [points])
+        await self.click("final confirm", user, "confirm")
+
+    async def player_chat(self, user: FakeUser, messages: int) -> None:
+        """Send messages by DM as one player."""
+        for index in range(messages):
+            message = FakeMessage(user.dm, f"Message {index} from {user.id}", author=user)
+            await self.measure("chat message", on_message(message))
+
+    async def viewer(self, user: FakeUser, pages: int) -> None:
+        """Open /viewstats and page through the characters as one viewer."""
+        channel = FakeChannel(self.latency, CHANNEL_IDS["view-stats"], default_guild_id)
+        interaction = FakeInteraction(user, channel)
+        await self.measure("/viewstats", main.viewstats.callback(interaction))
+        message = interaction.message
+        for _ in range(pages):
+            view = message.view
+            if view is None or view.next_page.disabled:
+                break
+            await self.measure("next page", view.next_page.callback(FakeInteraction(user, channel, message)))
+        if message.view is not None:
+            await self.measure("first page", message.view.first.callback(FakeInteraction(user, channel, message)))
+
+    async def scenario(self, name: str, coroutines: list[Awaitable]) -> dict:
+        """Run the coroutines concurrently and return the scenario's measurements."""
+        self.latencies.clear()
+        operations_before = Counter(self.operations.counts)
+        started = time.perf_counter()
+        # on_message prints every DM it receives
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.gather(*coroutines)
+        elapsed = time.perf_counter() - started
+        operations = self.operations.counts - operations_before
+        actions = sum(len(values) for values in self.latencies.values())
+        return {
+            "name": name,
+            "actions": actions,
+            "seconds": elapsed,
+            "throughput": actions / elapsed if elapsed else 0.0,
+            "latency": {
+                action: {
+                    "count": len(values),
+                    "p50": percentile(values, 0.5),
+                    "p99": percentile(values, 0.99),
+                    "max": max(values),
+                } for action, values in self.latencies.items()
+            },
+            "db_operations": dict(operations),
+            "db_operations_per_action": sum(operations.values()) / actions if actions else 0.0,
+        }
+
+
+def git_commit() -> Optional[str]:
+    """Return the current commit hash, if run from a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def simulate(players: int, chatters: int, messages: int, viewers: int, pages: int,
+                   latency: float) -> dict:
+    """Run every scenario and return the results."""
+    simulation = Simulation(latency)
+    await simulation.prepare()
+    scenarios = []
+    setup_users = [simulation.user() for _ in range(players)]
+    scenarios.append(await simulation.scenario(
+        "setup", [simulation.player_setup(user) for user in setup_users]))
+    chat_users = await simulation.seed(chatters)
+    scenarios.append(await simulation.scenario(
+        "chat", [simulation.player_chat(user, messages) for user in chat_users]))
+    viewer_users = [simulation.user() for _ in range(viewers)]
+    scenarios.append(await simulation.scenario(
+        "viewstats", [simulation.viewer(user, pages) for user in viewer_users]))
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "parameters": {"players": players, "chatters": chatters, "messages": messages, "viewers": viewers,
+                       "pages": pages, "latency": latency},
+        "scenarios": scenarios,
+    }
+
+
+def report(results: dict) -> str:
+    """Return a human-readable summary of the results."""
+    lines = []
+    for scenario in results["scenarios"]:
+        lines.append(f"{scenario['name']}: {scenario['actions']} actions in {scenario['seconds']:.2f}s "
+                     f"({scenario['throughput']:.0f}/s), "
+                     f"{scenario['db_operations_per_action']:.2f} db operations per action")
+        for action, latency in scenario["latency"].items():
+            lines.append(f"  {action:<16} p50 {latency['p50'] * 1000:7.2f} ms  p99 {latency['p99'] * 1000:7.2f} ms"
+                         f"  ({latency['count']})")
+    return "\n".join(lines)
+
+
+def parse_arguments(arguments: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--players", type=int, default=16, help="players going through /setup")
+    parser.add_argument("--chatters", type=int, default=60, help="players chatting in rooms")
+    parser.add_argument("--messages", type=int, default=20, help="messages sent by each chatting player")
+    parser.add_argument("--viewers", type=int, default=20, help="viewers paging through /viewstats")
+    parser.add_argument("--pages", type=int, default=25, help="pages turned by each viewer")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated Discord API latency in seconds")
+    parser.add_argument("--output", default="simulation_results.json", help="file the JSON results are written to")
+    return parser.parse_args(arguments)
+
+
+if __name__ == "__main__":
+    options = parse_arguments(sys.argv[1:])
+    results = asyncio.run(simulate(options.players, options.chatters, options.messages, options.viewers,
+                                   options.pages, options.latency))
+    with open(options.output, "w") as output:
+        json.dump(results, output, indent=2)
+    print(report(results))
+    print(f"Results written to {options.output}")
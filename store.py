@@ -0,0 +1,859 @@
+"""Async data layer for the characters collection.
+
+Every command and view goes through a CharacterStore instead of calling pymongo directly,
+so that a slow database round trip never blocks the discord.py event loop. Blocking driver
+calls are run on a bounded thread pool, which lets concurrent interactions overlap their I/O.
+
+MemoryCollection is an in-process stand-in for a pymongo Collection, implementing the subset
+of the API used by this bot, so the bot can be exercised without a real MongoDB.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import functools
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import pymongo
+from pymongo import ReturnDocument, UpdateOne
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure, PyMongoError
+
+from cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+# Number of worker threads used to run blocking driver calls. This should not exceed the
+# maxPoolSize of the MongoClient, or threads will queue up waiting for a connection.
+DEFAULT_MAX_WORKERS = 16
+
+# Maximum number of character documents kept in the in-process cache
+DEFAULT_CACHE_SIZE = 2048
+
+
+class CharacterStore:
+    """Async repository for character documents, keyed by encrypted user id.
+
+    Full documents read with get() are cached in process, and every write made through the
+    store updates the cache (write-through), so steady-state lookups need no round trip.
+    Writes made by other processes are picked up by watch() where change streams are available.
+    """
+
+    def __init__(self, collection: Any, max_workers: int = DEFAULT_MAX_WORKERS,
+                 cache_size: int = DEFAULT_CACHE_SIZE) -> None:
+        """Initialize the store.
+
+        Args:
+            collection (Any): A pymongo Collection, or a MemoryCollection for offline use.
+            max_workers (int): Maximum number of threads running driver calls concurrently.
+            cache_size (int): Maximum number of character documents kept in the cache.
+        """
+        self.collection = collection
+        self.cache = LRUCache(maxsize=cache_size)
+        # Incremented on every write seen by this process; membership_version only when a
+        # character is created or deleted. Snapshots compare them to detect staleness.
+        self.version = 0
+        self.membership_version = 0
+        # The version of the last write seen for each character, so that a read that started
+        # before a write never replaces what the write put in the cache
+        self._write_versions: dict[str, int] = {}
+        # (listener, whether it is also called for writes made by other processes)
+        self._listeners: list[tuple[Callable[[str, Optional[dict]], None], bool]] = []
+        self._indexes_ready = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="character-store")
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a blocking driver call on the store's thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def connect(self) -> None:
+        """Resolve the collection on the thread pool, so that connecting never blocks the loop."""
+        resolve = getattr(self.collection, "resolve", None)
+        if resolve is not None:
+            await self.run(resolve)
+
+    async def get(self, character_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        """Return the character document with the given id, or None if it does not exist.
+
+        Args:
+            character_id (str): The encrypted discord user id of the character.
+            projection (Optional[dict]): Fields to include in the returned document.
+                Projected reads bypass the cache.
+        """
+        if projection is not None:
+            return await self.run(self.collection.find_one, {"_id": character_id}, projection)
+        character = self.cache.get(character_id)
+        if character is None:
+            version = self.version
+            character = await self.run(self.collection.find_one, {"_id": character_id})
+            if character is not None and not self.written_since(character_id, version):
+                self.cache.put(character_id, character)
+        return character
+
+    def written_since(self, character_id: str, version: int) -> bool:
+        """Return whether a write of the character was seen after the store was at the given version."""
+        return self._write_versions.get(character_id, 0) > version
+
+    async def find_one(self, query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        """Return the first character document matching the query, or None."""
+        return await self.run(self.collection.find_one, query, projection)
+
+    async def list(self, query: Optional[dict] = None,
+                   projection: Optional[dict] = None) -> list[dict]:
+        """Return all character documents matching the query.
+
+        Args:
+            query (Optional[dict]): The filter to apply, or None for every character.
+            projection (Optional[dict]): Fields to include in each returned document.
+        """
+        def _list() -> list[dict]:
+            return list(self.collection.find(query or {}, projection))
+        return await self.run(_list)
+
+    async def aggregate(self, pipeline: list[dict]) -> list[dict]:
+        """Run an aggregation pipeline over the characters in one round trip, returning its results."""
+        def _aggregate() -> list[dict]:
+            return list(self.collection.aggregate(pipeline))
+        return await self.run(_aggregate)
+
+    async def snapshot(self, query: Optional[dict] = None) -> "Snapshot":
+        """Return every character document matching the query, tagged with the store's current versions."""
+        version, membership_version = self.version, self.membership_version
+        return Snapshot(await self.list(query), version, membership_version, query)
+
+    async def count(self, query: Optional[dict] = None) -> int:
+        """Return the number of character documents matching the query."""
+        return await self.run(self.collection.count_documents, query or {})
+
+    async def upsert(self, character_id: str, data: dict) -> dict:
+        """Set the given fields on a character, creating the document if needed.
+
+        Args:
+            character_id (str): The encrypted discord user id of the character.
+            data (dict): The fields to set.
+
+        Returns:
+            dict: The character document after the update.
+        """
+        character = await self.run(self.collection.find_one_and_update,
+                                    {"_id": character_id}, {"$set": data},
+                                    upsert=True, return_document=ReturnDocument.AFTER)
+        self._written(character_id, character, membership=True)
+        return character
+
+    async def move(self, character_id: str, from_room: str, to_room: str) -> Optional[dict]:
+        """Atomically move a character from one room to another.
+
+        The move only applies if the character is still in from_room, so concurrent moves of the
+        same character cannot interleave (e.g. two /move commands racing each other).
+
+        Args:
+            character_id (str): The encrypted discord user id of the character.
+            from_room (str): The room the character is expected to be in.
+            to_room (str): The room to move the character to.
+
+        Returns:
+            Optional[dict]: The character document after the move, or None if the character
+            does not exist or is no longer in from_room.
+        """
+        character = await self.run(self.collection.find_one_and_update,
+                                    {"_id": character_id, "current_room": from_room},
+                                    {"$set": {"current_room": to_room}},
+                                    return_document=ReturnDocument.AFTER)
+        if character is not None:
+            self._written(character_id, character)
+        return character
+
+    async def create(self, character_id: str, data: dict) -> dict:
+        """Atomically create a character in a single round trip.
+
+        The write is an insert, so it never replaces an existing character. Uniqueness of the
+        character name and portrait emoji pair is enforced by the unique indexes created in
+        ensure_indexes(), not by reading the collection first.
+
+        Args:
+            character_id (str): The encrypted discord user id of the character.
+            data (dict): The full character document, without the _id.
+
+        Returns:
+            dict: The created character document.
+
+        Raises:
+            DuplicateKeyError: If the user already has a character, or another character already
+                has the same name or portrait emoji pair. Use duplicate_key_field() to find out
+                which ("_id", "character_name" or "portrait_emoji_pair").
+        """
+        character = {"_id": character_id, **data}
+        await self.run(self.collection.insert_one, character)
+        self._written(character_id, character, membership=True)
+        return character
+
+    async def bulk_update(self, characters: list[dict], fields: list[str], version: int) -> None:
+        """Write the given fields of many characters in a single bulk write.
+
+        The given documents were read at `version`, and characters written since then (e.g.
+        moved or deleted) may no longer match them. Only the given fields are written, so those
+        writes are kept: the fields are applied to their cached documents, and characters deleted
+        or no longer cached are dropped from the cache rather than brought back.
+
+        Args:
+            characters (list[dict]): The character documents, with the fields after the change.
+            fields (list[str]): The top-level fields to write from each document.
+            version (int): The store's version when the documents were read.
+        """
+        requests = [UpdateOne({"_id": character["_id"]},
+                              {"$set": {field: character[field] for field in fields}})
+                    for character in characters]
+        await self.run(self.collection.bulk_write, requests, ordered=False)
+        for character in characters:
+            character_id = character["_id"]
+            if self.written_since(character_id, version):
+                cached = self.cache.peek(character_id)
+                if cached is None:
+                    continue
+                character = {**cached, **{field: character[field] for field in fields}}
+            self._written(character_id, character)
+
+    async def delete(self, character_id: str, game_id: Optional[str] = None) -> Optional[dict]:
+        """Delete the character with the given id, if it exists.
+
+        Args:
+            character_id (str): The encrypted discord user id of the character.
+            game_id (Optional[str]): Only delete the character if it belongs to this game.
+
+        Returns:
+            Optional[dict]: The deleted character document, or None if there was none.
+        """
+        self.cache.invalidate(character_id)
+        query = {"_id": character_id} if game_id is None else {"_id": character_id, "game_id": game_id}
+        character = await self.run(self.collection.find_one_and_delete, query)
+        if character is not None:
+            self._written(character_id, None, membership=True)
+        return character
+
+    def add_listener(self, listener: Callable[[str, Optional[dict]], None], changes: bool = True) -> None:
+        """Register a function called after every write seen by this process.
+
+        Listeners are called on the event loop with the character id and the document after the
+        write, or None if the character was deleted. They are used to keep derived in-process
+        state (render caches, indexes, ...) consistent with the collection.
+
+        Args:
+            listener (Callable[[str, Optional[dict]], None]): The function to call.
+            changes (bool): Also call the listener for change stream events. These include this
+                process's own writes a second time, so listeners that must see each write once
+                (e.g. to log it) only listen to the writes made through the store.
+        """
+        self._listeners.append((listener, changes))
+
+    def _written(self, character_id: str, character: Optional[dict], membership: bool = False,
+                 change: bool = False) -> None:
+        """Update the cache and notify listeners of a write, making older snapshots stale."""
+        if character is None:
+            self.cache.invalidate(character_id)
+        else:
+            self.cache.put(character_id, character)
+        self.version += 1
+        self._write_versions[character_id] = self.version
+        if membership:
+            self.membership_version += 1
+        for listener, changes in self._listeners:
+            if changes or not change:
+                listener(character_id, character)
+
+    async def ensure_indexes(self) -> None:
+        """Create the indexes the store relies on. Only the first call does any work."""
+        if self._indexes_ready:
+            return
+
+        def _create_indexes() -> None:
+            # Names and portraits are unique within a game. These replace the unique indexes of
+            # single-game versions, which would stop two games from using the same name
+            for name in ("character_name_1", "portrait_emoji_pair_1"):
+                if name in self.collection.index_information():
+                    self.collection.drop_index(name)
+            self.collection.create_index([("game_id", pymongo.ASCENDING), ("character_name", pymongo.ASCENDING)],
+                                         unique=True)
+            self.collection.create_index([("game_id", pymongo.ASCENDING), ("portrait_emoji_pair", pymongo.ASCENDING)],
+                                         unique=True)
+            # Serves the {"status": ...} filters of the stat engine and aggregations
+            self.collection.create_index([("status", pymongo.ASCENDING), ("current_room", pymongo.ASCENDING)])
+
+        await self.run(_create_indexes)
+        self._indexes_ready = True
+
+    async def watch(self) -> None:
+        """Keep the cache in sync with writes made outside this process.
+
+        Consumes a MongoDB change stream until cancelled. Change streams require a replica set;
+        if they are unavailable the cache is only kept in sync with this process's own writes.
+        """
+        if not hasattr(self.collection, "watch"):
+            return
+        loop = asyncio.get_running_loop()
+        stop = threading.Event()
+
+        def _watch() -> None:
+            with self.collection.watch(full_document="updateLookup") as stream:
+                while not stop.is_set():
+                    change = stream.try_next()
+                    if change is not None:
+                        loop.call_soon_threadsafe(self._apply_change, change)
+                    else:
+                        stop.wait(0.5)
+
+        try:
+            # Runs on its own thread so the store's pool is not permanently occupied
+            await asyncio.to_thread(_watch)
+        except PyMongoError as error:
+            log.warning("Character change stream unavailable, cache is write-through only: %s", error)
+        finally:
+            stop.set()
+
+    def _apply_change(self, change: dict) -> None:
+        """Apply a single change stream event to the cache and listeners."""
+        character_id = change.get("documentKey", {}).get("_id")
+        character = change.get("fullDocument") if change["operationType"] != "delete" else None
+        self._written(character_id, character,
+                      membership=change["operationType"] in ("insert", "replace", "delete"), change=True)
+
+    def close(self) -> None:
+        """Shut down the thread pool, waiting for running calls to finish."""
+        self._executor.shutdown(wait=True)
+
+
+class Snapshot:
+    """A list of character documents, and the store versions and query it was read with."""
+
+    __slots__ = ("characters", "version", "membership_version", "query")
+
+    def __init__(self, characters: list[dict], version: int, membership_version: int,
+                 query: Optional[dict] = None) -> None:
+        self.characters = characters
+        self.version = version
+        self.membership_version = membership_version
+        self.query = query
+
+    def __len__(self) -> int:
+        return len(self.characters)
+
+
+class LazyCollection:
+    """A collection that is only looked up, and connected to, on first use.
+
+    Attribute access is forwarded to the resolved collection, so a LazyCollection can be used
+    anywhere a pymongo Collection or MemoryCollection is expected.
+    """
+
+    def __init__(self, get_database: Callable[[], Any], name: str) -> None:
+        """Initialize the collection.
+
+        Args:
+            get_database (Callable[[], Any]): Returns the database, connecting if needed.
+            name (str): The name of the collection in the database.
+        """
+        self._get_database = get_database
+        self._name = name
+        self._collection = None
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        state = "connected" if self._collection is not None else "not connected"
+        return f"LazyCollection({self._name!r}, {state})"
+
+    def resolve(self) -> Any:
+        """Return the underlying collection, connecting to the database on first call."""
+        if self._collection is None:
+            with self._lock:
+                if self._collection is None:
+                    self._collection = self._get_database()[self._name]
+        return self._collection
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self.resolve(), attribute)
+
+
+def duplicate_key_field(error: DuplicateKeyError) -> Optional[str]:
+    """Return the name of the field that caused a duplicate key error, if known."""
+    details = error.details or {}
+    key_pattern = details.get("keyPattern") or details.get("keyValue")
+    if key_pattern:
+        # Unique indexes are per game, so the clashing field is the one after game_id
+        return next((field for field in key_pattern if field != "game_id"), None)
+    for field in ("character_name", "portrait_emoji_pair"):
+        if field in str(details.get("errmsg", error)):
+            return field
+    return None
+
+
+########################################
+# In-process stand-in for MongoDB
+########################################
+
+class _Result:
+    """Minimal stand-in for the pymongo result objects."""
+
+    def __init__(self, **kwargs) -> None:
+        self.__dict__.update(kwargs)
+
+
+class MemoryDatabase(dict):
+    """An in-process stand-in for a pymongo Database, creating collections on first access."""
+
+    def __missing__(self, name: str) -> "MemoryCollection":
+        collection = self[name] = MemoryCollection(name)
+        collection.database = self
+        return collection
+
+    def create_collection(self, name: str, capped: bool = False, max: Optional[int] = None,
+                          **options) -> "MemoryCollection":
+        """Create a collection; capped collections keep only their `max` newest documents."""
+        if name in self:
+            raise CollectionInvalid(f"collection {name} already exists")
+        collection = self[name]
+        collection.max_documents = max if capped else None
+        return collection
+
+
+class MemoryCollection:
+    """A thread-safe, in-process stand-in for a pymongo Collection.
+
+    Only the operations and query operators used by this bot are supported.
+    """
+
+    def __init__(self, name: str = "characters") -> None:
+        self.name = name
+        self._documents: dict[Any, dict] = {}
+        # Index name -> (fields, unique, partial filter or None)
+        self._indexes: dict[str, tuple[tuple[str, ...], bool, Optional[dict]]] = {}
+        self._lock = threading.RLock()
+        self.database: Optional[MemoryDatabase] = None
+        self.max_documents: Optional[int] = None
+
+    def __repr__(self) -> str:
+        return f"MemoryCollection({self.name!r}, documents={len(self._documents)})"
+
+    def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None,
+                 sort: Optional[list] = None) -> Optional[dict]:
+        documents = self.find(query, projection, sort=sort, limit=1)
+        return documents[0] if documents else None
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None,
+             sort: Optional[list] = None, limit: int = 0, **kwargs) -> list[dict]:
+        """Return the matching documents, optionally sorted by [(path, direction)] and limited."""
+        with self._lock:
+            documents = self._matching(query or {})
+            if sort:
+                documents = list(documents)
+                for path, direction in reversed(sort):
+                    documents.sort(key=lambda document: _get_path(document, path), reverse=direction < 0)
+            if limit:
+                documents = itertools.islice(documents, limit)
+            return [_project(document, projection) for document in documents]
+
+    def count_documents(self, query: dict) -> int:
+        with self._lock:
+            return sum(1 for _ in self._matching(query))
+
+    def insert_one(self, document: dict) -> _Result:
+        with self._lock:
+            document = copy.deepcopy(document)
+            if document["_id"] in self._documents:
+                raise DuplicateKeyError("duplicate key error", 11000, {"keyPattern": {"_id": 1}})
+            self._check_unique(document)
+            self._documents[document["_id"]] = document
+            return _Result(inserted_id=document["_id"])
+
+    def insert_many(self, documents: list[dict], ordered: bool = True) -> _Result:
+        with self._lock:
+            inserted_ids, errors = [], []
+            for index, document in enumerate(documents):
+                document.setdefault("_id", ObjectId())
+                try:
+                    self.insert_one(document)
+                except DuplicateKeyError as error:
+                    errors.append({"index": index, "code": error.code, "errmsg": str(error),
+                                   **{key: value for key, value in (error.details or {}).items()
+                                      if key in ("keyPattern", "keyValue")}})
+                    if ordered:
+                        break
+                    continue
+                inserted_ids.append(document["_id"])
+            if self.max_documents is not None:
+                # Capped collections drop their oldest documents
+                overflow = max(len(self._documents) - self.max_documents, 0)
+                for _id in list(itertools.islice(self._documents, overflow)):
+                    del self._documents[_id]
+            if errors:
+                raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted_ids)})
+            return _Result(inserted_ids=inserted_ids)
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False) -> _Result:
+        with self._lock:
+            for document in self._matching(query):
+                updated = _apply_update(document, update, inserting=False)
+                self._check_unique(updated)
+                self._documents[updated["_id"]] = updated
+                return _Result(matched_count=1, modified_count=int(updated != document), upserted_id=None)
+            if not upsert:
+                return _Result(matched_count=0, modified_count=0, upserted_id=None)
+            seed = {key: value for key, value in query.items()
+                    if not key.startswith("$") and not isinstance(value, dict)}
+            document = _apply_update(seed, update, inserting=True)
+            self._check_unique(document)
+            self._documents[document["_id"]] = document
+            return _Result(matched_count=0, modified_count=0, upserted_id=document["_id"])
+
+    def update_many(self, query: dict, update: dict) -> _Result:
+        with self._lock:
+            matched = modified = 0
+            for document in list(self._matching(query)):
+                updated = _apply_update(document, update, inserting=False)
+                self._check_unique(updated)
+                self._documents[updated["_id"]] = updated
+                matched += 1
+                modified += updated != document
+            return _Result(matched_count=matched, modified_count=modified)
+
+    def replace_one(self, query: dict, replacement: dict, upsert: bool = False) -> _Result:
+        with self._lock:
+            before = self.find_one(query)
+            if before is None and not upsert:
+                return _Result(matched_count=0, modified_count=0, upserted_id=None)
+            self.find_one_and_replace(query, replacement, upsert=upsert)
+            upserted_id = None if before is not None else replacement.get("_id", query.get("_id"))
+            return _Result(matched_count=int(before is not None), modified_count=int(before is not None),
+                           upserted_id=upserted_id)
+
+    def find_one_and_update(self, query: dict, update: dict, projection: Optional[dict] = None,
+                            upsert: bool = False,
+                            return_document: bool = ReturnDocument.BEFORE) -> Optional[dict]:
+        with self._lock:
+            before = self.find_one(query)
+            result = self.update_one(query, update, upsert=upsert)
+            if return_document == ReturnDocument.BEFORE:
+                return _project(before, projection) if before is not None else None
+            character_id = before["_id"] if before is not None else result.upserted_id
+            if character_id is None:
+                return None
+            return _project(self._documents[character_id], projection)
+
+    def find_one_and_replace(self, query: dict, replacement: dict, projection: Optional[dict] = None,
+                             upsert: bool = False,
+                             return_document: bool = ReturnDocument.BEFORE) -> Optional[dict]:
+        with self._lock:
+            before = self.find_one(query)
+            if before is None and not upsert:
+                return None
+            document = copy.deepcopy(replacement)
+            if before is not None:
+                document["_id"] = before["_id"]
+            elif "_id" not in document:
+                document["_id"] = query["_id"]
+            self._check_unique(document)
+            self._documents[document["_id"]] = document
+            if return_document == ReturnDocument.BEFORE:
+                return _project(before, projection) if before is not None else None
+            return _project(document, projection)
+
+    def find_one_and_delete(self, query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        with self._lock:
+            for document in self._matching(query):
+                del self._documents[document["_id"]]
+                return _project(document, projection)
+            return None
+
+    def bulk_write(self, requests: list, ordered: bool = True) -> _Result:
+        modified_count = 0
+        with self._lock:
+            for request in requests:
+                if not isinstance(request, UpdateOne):
+                    raise NotImplementedError(f"MemoryCollection does not support {type(request).__name__}")
+                result = self.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+                modified_count += result.modified_count
+        return _Result(modified_count=modified_count)
+
+    def delete_one(self, query: dict) -> _Result:
+        with self._lock:
+            for document in self._matching(query):
+                del self._documents[document["_id"]]
+                return _Result(deleted_count=1)
+            return _Result(deleted_count=0)
+
+    def aggregate(self, pipeline: list[dict], **kwargs) -> list[dict]:
+        """Run a pipeline of $match, $project, $sort, $limit, $group and $facet stages."""
+        with self._lock:
+            documents = [copy.deepcopy(document) for document in self._documents.values()]
+        return _run_pipeline(documents, pipeline)
+
+    def delete_many(self, query: dict) -> _Result:
+        with self._lock:
+            matching = [document["_id"] for document in self._matching(query)]
+            for _id in matching:
+                del self._documents[_id]
+            return _Result(deleted_count=len(matching))
+
+    def create_index(self, keys: Any, unique: bool = False, name: Optional[str] = None,
+                     partialFilterExpression: Optional[dict] = None, **kwargs) -> str:
+        keys = [(keys, pymongo.ASCENDING)] if isinstance(keys, str) else list(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        with self._lock:
+            self._indexes[name] = (tuple(field for field, _ in keys), unique, partialFilterExpression)
+        return name
+
+    def drop_index(self, name: str) -> None:
+        with self._lock:
+            if self._indexes.pop(name, None) is None:
+                raise OperationFailure(f"index not found with name [{name}]", 27)
+
+    def index_information(self) -> dict:
+        with self._lock:
+            return {name: {"key": [(field, 1) for field in fields], **({"unique": True} if unique else {})}
+                    for name, (fields, unique, _) in self._indexes.items()}
+
+    def _matching(self, query: dict):
+        character_id = query.get("_id")
+        if character_id is not None and not isinstance(character_id, dict):
+            # Lookups by _id use the primary key, like MongoDB does
+            candidates = [self._documents[character_id]] if character_id in self._documents else []
+        else:
+            candidates = list(self._documents.values())
+        for document in candidates:
+            if _matches(document, query):
+                yield document
+
+    def _check_unique(self, candidate: dict) -> None:
+        existing = self._documents.get(candidate["_id"])
+        for fields, unique, partial in self._indexes.values():
+            if not unique or (partial is not None and not _matches(candidate, partial)):
+                continue
+            value = tuple(_get_path(candidate, field) for field in fields)
+            if _MISSING in value or (existing is not None and
+                                     tuple(_get_path(existing, field) for field in fields) == value):
+                continue
+            for document in self._documents.values():
+                if document["_id"] != candidate["_id"] and \
+                        (partial is None or _matches(document, partial)) and \
+                        tuple(_get_path(document, field) for field in fields) == value:
+                    raise DuplicateKeyError("duplicate key error", 11000,
+                                            {"keyPattern": {field: 1 for field in fields},
+                                             "keyValue": dict(zip(fields, value))})
+
+
+_MISSING = object()
+
+
+def _get_path(document: dict, path: str) -> Any:
+    """Return the value at a dotted path in the document, or _MISSING."""
+    value: Any = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+    return value
+
+
+def _matches(document: dict, query: dict) -> bool:
+    """Return whether the document matches a query with a subset of MongoDB operators."""
+    for key, condition in query.items():
+        value = _get_path(document, key)
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+                if op == "$ne" and _equals(value, operand):
+                    return False
+                if op == "$exists" and (value is not _MISSING) != operand:
+                    return False
+                if op == "$type" and operand == "number" and \
+                        (isinstance(value, bool) or not isinstance(value, (int, float))):
+                    return False
+                if op in ("$lt", "$lte", "$gt", "$gte"):
+                    if value is _MISSING:
+                        return False
+                    if op == "$lt" and not value < operand:
+                        return False
+                    if op == "$lte" and not value <= operand:
+                        return False
+                    if op == "$gt" and not value > operand:
+                        return False
+                    if op == "$gte" and not value >= operand:
+                        return False
+        elif not _equals(value, condition):
+            return False
+    return True
+
+
+def _equals(value: Any, operand: Any) -> bool:
+    """Return whether a field value equals the operand, matching array elements like MongoDB."""
+    if isinstance(value, list) and not isinstance(operand, list):
+        return operand in value
+    return value == operand
+
+
+def _evaluate(document: dict, expression: Any) -> Any:
+    """Return the value of an aggregation expression: a "$field.path" reference or a literal."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get_path(document, expression[1:])
+        return None if value is _MISSING else value
+    return expression
+
+
+def _sort_key(value: Any) -> tuple:
+    # Missing fields and nulls sort before every other value, as in MongoDB
+    return (0, None) if value is _MISSING or value is None else (1, value)
+
+
+def _group(documents: list[dict], stage: dict) -> list[dict]:
+    """Apply a $group stage with $sum, $avg, $min and $max accumulators."""
+    groups: dict[Any, list[dict]] = {}
+    for document in documents:
+        key = _evaluate(document, stage["_id"])
+        groups.setdefault(key if not isinstance(key, dict) else tuple(key.items()), []).append(document)
+    results = []
+    for key, members in groups.items():
+        result = {"_id": dict(key) if isinstance(key, tuple) else key}
+        for field, accumulator in stage.items():
+            if field == "_id":
+                continue
+            (operator, expression), = accumulator.items()
+            values = [_evaluate(member, expression) for member in members]
+            numbers = [value for value in values if isinstance(value, (int, float))]
+            if operator == "$sum":
+                result[field] = sum(numbers)
+            elif operator == "$avg":
+                result[field] = sum(numbers) / len(numbers) if numbers else None
+            elif operator == "$min":
+                result[field] = min((value for value in values if value is not None), default=None)
+            elif operator == "$max":
+                result[field] = max((value for value in values if value is not None), default=None)
+            else:
+                raise NotImplementedError(f"MemoryCollection does not support {operator}")
+        results.append(result)
+    return results
+
+
+def _run_pipeline(documents: list[dict], pipeline: list[dict]) -> list[dict]:
+    """Run an aggregation pipeline over documents, with the subset of stages the bot uses."""
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            documents = [document for document in documents if _matches(document, spec)]
+        elif name == "$project":
+            if all(value in (0, False) for value in spec.values()):
+                documents = [_project(document, spec) for document in documents]
+                continue
+            included = {key: value for key, value in spec.items() if value in (0, 1, True, False)}
+            computed = {key: value for key, value in spec.items() if key not in included}
+            projected = []
+            for document in documents:
+                # A projection of only computed fields keeps just them (and _id)
+                result = _project(document, included) if any(included.values()) else \
+                    ({"_id": document["_id"]} if included.get("_id", 1) and "_id" in document else {})
+                result.update((key, _evaluate(document, value)) for key, value in computed.items())
+                projected.append(result)
+            documents = projected
+        elif name == "$sort":
+            documents = list(documents)
+            for path, direction in reversed(list(spec.items())):
+                documents.sort(key=lambda document: _sort_key(_get_path(document, path)), reverse=direction < 0)
+        elif name == "$limit":
+            documents = documents[:spec]
+        elif name == "$group":
+            documents = _group(documents, spec)
+        elif name == "$facet":
+            documents = [{output: _run_pipeline(documents, sub_pipeline) for output, sub_pipeline in spec.items()}]
+        else:
+            raise NotImplementedError(f"MemoryCollection does not support {name}")
+    return documents
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    """Return a deep copy of the document restricted to the projection."""
+    if not projection:
+        return copy.deepcopy(document)
+    included = {key for key, value in projection.items() if value and key != "_id"}
+    if included or all(projection.values()):
+        result = {}
+        for key in included:
+            value = _get_path(document, key)
+            if value is _MISSING:
+                continue
+            target = result
+            parts = key.split(".")
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = copy.deepcopy(value)
+    else:
+        result = {key: copy.deepcopy(value) for key, value in document.items()
+                  if projection.get(key, 1)}
+    if projection.get("_id", 1) and "_id" in document:
+        result["_id"] = document["_id"]
+    return result
+
+
+def _apply_update(document: dict, update: dict, inserting: bool) -> dict:
+    """Return a copy of the document with a subset of MongoDB update operators applied."""
+    document = copy.deepcopy(document)
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, operand in fields.items():
+            parts = path.split(".")
+            target = document
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            key = parts[-1]
+            if op in ("$set", "$setOnInsert"):
+                target[key] = copy.deepcopy(operand)
+            elif op == "$unset":
+                target.pop(key, None)
+            elif op == "$inc":
+                target[key] = target.get(key, 0) + operand
+            elif op == "$pop":
+                values = target.get(key, [])
+                target[key] = values[1:] if operand == -1 else values[:-1]
+            elif op == "$push":
+                values = list(target.get(key, []))
+                if isinstance(operand, dict) and "$each" in operand:
+                    values.extend(copy.deepcopy(operand["$each"]))
+                    if "$sort" in operand:
+                        values.sort(reverse=operand["$sort"] == -1)
+                else:
+                    values.append(copy.deepcopy(operand))
+                target[key] = values
+            else:
+                raise NotImplementedError(f"MemoryCollection does not support {op}")
+    if "_id" not in document:
+        raise ValueError("MemoryCollection requires documents to have an _id")
+    return document
+
+
+def create_mongo_client(connection_string: Optional[str], **kwargs) -> pymongo.MongoClient:
+    """Create a MongoClient with a connection pool sized for the store's thread pool.
+
+    Args:
+        connection_string (Optional[str]): The MongoDB connection string.
+        **kwargs: Extra keyword arguments passed to pymongo.MongoClient.
+    """
+    options = {
+        "maxPoolSize": DEFAULT_MAX_WORKERS,
+        "minPoolSize": 2,
+        "maxIdleTimeMS": 60_000,
+        "serverSelectionTimeoutMS": 10_000,
+        "retryWrites": True,
+    }
+    options.update(kwargs)
+    return pymongo.MongoClient(connection_string, **options)
@@ -0,0 +1,83 @@
+"""A local stand-in for Discord's CDN, serving attachments to AttachmentCache."""
+
+import asyncio
+import itertools
+import threading
+from typing import Optional
+
+from aiohttp import web
+
+from attachments import CHUNK_SIZE
+
+_ids = itertools.count(1)
+
+
+class StandInAttachment:
+    """The attributes of a discord.Attachment that AttachmentCache uses."""
+
+    def __init__(self, attachment_id: int, url: str, filename: str, size: int) -> None:
+        self.id = attachment_id
+        self.url = url
+        self.filename = filename
+        self.size = size
+
+    def is_spoiler(self) -> bool:
+        return False
+
+
+class StandInCDN:
+    """Serves files over HTTP on localhost in chunks, from its own thread and event loop.
+
+    Use as a context manager; the server runs until the block exits.
+    """
+
+    def __init__(self) -> None:
+        self.files: dict[str, bytes] = {}
+        self.requests = 0
+        self.base_url: Optional[str] = None
+        self._loop = asyncio.new_event_loop()
+        self._runner: Optional[web.AppRunner] = None
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def __enter__(self) -> "StandInCDN":
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def attachment(self, content: bytes, filename: str = "file.bin", size: Optional[int] = None) -> StandInAttachment:
+        """Serve the content under a new URL, returning the attachment pointing to it.
+
+        Args:
+            content (bytes): The file served.
+            filename (str): The attachment's filename.
+            size (Optional[int]): The size the attachment declares. Defaults to the content's size.
+        """
+        attachment_id = next(_ids)
+        name = f"{attachment_id}-{filename}"
+        self.files[name] = content
+        return StandInAttachment(attachment_id, f"{self.base_url}/{name}", filename,
+                                 len(content) if size is None else size)
+
+    async def _start(self) -> None:
+        async def handler(request: web.Request) -> web.StreamResponse:
+            self.requests += 1
+            content = self.files[request.match_info["name"]]
+            response = web.StreamResponse()
+            response.content_length = len(content)
+            await response.prepare(request)
+            for start in range(0, len(content), CHUNK_SIZE):
+                await response.write(content[start:start + CHUNK_SIZE])
+            return response
+
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        self.base_url = f"http://127.0.0.1:{self._runner.addresses[0][1]}"
@@ -0,0 +1,70 @@
+"""Shared fixtures.
+
+The bot's modules read their configuration from the environment when imported, so it is set
+here, before any test imports them: the bot runs against the in-process stand-in database.
+"""
+
+import asyncio
+import itertools
+import os
+
+import pytest
+
+os.environ.setdefault("memory_db", "1")
+os.environ.setdefault("encryption_key", "5")
+os.environ.setdefault("default_guild", "1")
+os.environ.setdefault("metrics_port", "0")
+
+from store import CharacterStore, MemoryDatabase  # noqa: E402
+
+_game_ids = itertools.count(1)
+
+
+@pytest.fixture
+def database():
+    return MemoryDatabase()
+
+
+@pytest.fixture
+def store(database):
+    store = CharacterStore(database["characters"])
+    yield store
+    store.close()
+
+
+def character(character_id: str, name: str, slot: int, room: str = "Lounge", game_id: str = "default",
+              **fields) -> dict:
+    """Return a character document, without its _id unless given in fields."""
+    return {"game_id": game_id, "character_name": name, "portrait_emoji_pair": slot, "current_room": room,
+            "status": "in house", "traits": {}, "stats": {"Hunger": 100, "Energy": 100, "Activity": 100,
+                                                          "Socialization": 100}, **fields}
+
+
+@pytest.fixture
+def cdn():
+    """A stand-in for Discord's CDN, serving attachments on localhost for the test's duration."""
+    from tests.cdn import StandInCDN
+
+    with StandInCDN() as cdn:
+        yield cdn
+
+
+@pytest.fixture
+def games():
+    """Two games registered with the bot's configuration, in guilds 2 and 3, with rooms Lounge and
+    Kitchen. Their characters are deleted after the test."""
+    import config
+    from games import Game
+
+    number = next(_game_ids)
+    registered = [config.games.add(Game(f"test-{number}-{guild_id}", guild_id,
+                                        {"Lounge": guild_id * 100 + 1, "Kitchen": guild_id * 100 + 2}))
+                  for guild_id in (2, 3)]
+    yield registered
+
+    async def delete_characters():
+        for game in registered:
+            for character in await config.character_store.list({"game_id": game.game_id}, {"_id": 1}):
+                await config.character_store.delete(character["_id"])
+
+    asyncio.run(delete_characters())
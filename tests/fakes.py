@@ -0,0 +1,118 @@
+"""Stand-ins for the Discord objects used by the relays, shared by the tests and benchmark.py."""
+
+import asyncio
+import itertools
+from typing import Any, Optional
+
+import discord
+
+from webhooks import WEBHOOK_NAME
+
+_ids = itertools.count(10 ** 17)
+
+
+def http_error(error_type: type, status: int, message: str = "") -> discord.HTTPException:
+    """Return a discord.HTTPException (or a subclass) as raised for a response with the status."""
+    response = type("Response", (), {"status": status, "reason": message})()
+    return error_type(response, message)
+
+
+class FakeUser:
+    """A user, such as the bot itself or a player, recording the DMs sent to them."""
+
+    def __init__(self, name: str = "Big Brother") -> None:
+        self.id = next(_ids)
+        self.display_name = name
+        self.display_avatar = type("Avatar", (), {"url": "https://cdn.invalid/avatar.png"})()
+        self.dms: list[dict] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        self.dms.append({"content": content, **kwargs})
+
+
+class FakeMessage:
+    """A message the bot sent, which components are used on."""
+
+    def __init__(self) -> None:
+        self.deleted = False
+
+    async def delete(self) -> None:
+        self.deleted = True
+
+
+class FakeResponse:
+    """The response of a FakeInteraction, recording the messages sent with it."""
+
+    def __init__(self) -> None:
+        self.messages: list[dict] = []
+
+    async def send_message(self, content: Optional[str] = None, **kwargs) -> None:
+        self.messages.append({"content": content, **kwargs})
+
+    async def defer(self, **kwargs) -> None:
+        pass
+
+
+class FakeInteraction:
+    """A slash command or component interaction from a user in a guild (or in DMs, with no guild)."""
+
+    def __init__(self, user: FakeUser, guild_id: Optional[int] = None) -> None:
+        self.id = next(_ids)
+        self.user = user
+        self.guild_id = guild_id
+        self.message = FakeMessage()
+        self.response = FakeResponse()
+
+
+class FakeClient:
+    """The parts of discord.Client used by WebhookPool."""
+
+    def __init__(self) -> None:
+        self.user = FakeUser()
+
+
+class FakeWebhook:
+    """A webhook posting into a FakeRoom, raising the queued errors on its next sends."""
+
+    def __init__(self, room: "FakeRoom", user: Any) -> None:
+        self.room = room
+        self.user = user
+        self.name = WEBHOOK_NAME
+        self.token = "token"
+        self.errors: list[Exception] = []
+        self.sends = 0
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        await asyncio.sleep(self.room.latency)
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sends += 1
+        self.room.posts.append((kwargs.get("username"), content))
+
+
+class FakeRoom:
+    """A room channel recording what is posted in it, by webhook or by the bot itself."""
+
+    def __init__(self, bot_user: Any, latency: float = 0.0, manage_webhooks: bool = True) -> None:
+        self.id = next(_ids)
+        self.bot_user = bot_user
+        self.latency = latency
+        self.manage_webhooks = manage_webhooks
+        self.hooks: list[FakeWebhook] = []
+        self.posts: list[tuple[Optional[str], Optional[str]]] = []
+        self.created = 0
+
+    async def webhooks(self) -> list[FakeWebhook]:
+        if not self.manage_webhooks:
+            raise http_error(discord.Forbidden, 403, "Missing Permissions")
+        return list(self.hooks)
+
+    async def create_webhook(self, name: str) -> FakeWebhook:
+        webhook = FakeWebhook(self, self.bot_user)
+        self.hooks.append(webhook)
+        self.created += 1
+        return webhook
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        await asyncio.sleep(self.latency)
+        self.posts.append((None, content))
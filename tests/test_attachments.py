@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from attachments import SPOOL_SIZE, AttachmentCache, AttachmentTooLarge
+
+
+def read(cached) -> bytes:
+    file = cached.file()
+    try:
+        return file.fp.read()
+    finally:
+        file.close()
+
+
+def run(cache: AttachmentCache, scenario):
+    async def main():
+        try:
+            return await scenario()
+        finally:
+            await cache.close()
+
+    return asyncio.run(main())
+
+
+def test_size_limit(cdn):
+    cache = AttachmentCache(max_size=1000)
+    declared = cdn.attachment(b"x" * 1001)
+    # An attachment declaring a wrong size is still stopped once the limit is read
+    understated = cdn.attachment(b"x" * 200_000, size=10)
+    assert cache.too_large(declared)
+    assert not cache.too_large(understated)
+
+    async def scenario():
+        with pytest.raises(AttachmentTooLarge):
+            await cache.fetch(understated)
+
+    run(cache, scenario)
+    assert cache.stats()["cached"] == 0
+
+
+def test_small_files_stay_in_memory_and_large_ones_are_spooled(cdn):
+    cache = AttachmentCache()
+    small, large = os.urandom(1000), os.urandom(SPOOL_SIZE + 1)
+
+    async def scenario():
+        cached_small = await cache.fetch(cdn.attachment(small))
+        cached_large = await cache.fetch(cdn.attachment(large))
+        assert cached_small.data == small and cached_small.path is None
+        assert cached_large.data is None and cached_large.path.exists()
+        assert read(cached_large) == large
+        assert cached_large.digest == hashlib.sha256(large).hexdigest()
+        return cached_large.path
+
+    path = run(cache, scenario)
+    assert not path.exists()
+
+
+def test_identical_content_is_cached_once(cdn):
+    cache = AttachmentCache()
+    content = os.urandom(SPOOL_SIZE * 2)
+
+    async def scenario():
+        first = cdn.attachment(content, "a.bin")
+        again = await asyncio.gather(cache.fetch(first), cache.fetch(first))
+        same = await cache.fetch(cdn.attachment(content, "a.bin"))
+        renamed = await cache.fetch(cdn.attachment(content, "b.bin"))
+        assert again[0] is again[1] is same
+        assert renamed.filename == "b.bin" and renamed.path == same.path
+        assert read(renamed) == content
+
+    run(cache, scenario)
+    assert cdn.requests == 3
+    assert cache.downloads == 3 and cache.reused == 2
+
+
+def test_pinned_attachments_are_not_evicted(cdn):
+    cache = AttachmentCache(cache_size=SPOOL_SIZE * 3)
+    contents = [os.urandom(SPOOL_SIZE * 2) for _ in range(3)]
+
+    async def scenario():
+        # The first file is fetched for two sends, and the others for none
+        first = await cache.fetch(cdn.attachment(contents[0]), sends=2)
+        second = await cache.fetch(cdn.attachment(contents[1]), sends=0)
+        assert read(first) == contents[0]
+        third = await cache.fetch(cdn.attachment(contents[2]), sends=0)
+        # The cache is full, and the first file still has a send pending
+        assert first.path.exists() and not second.path.exists()
+        # Opened by its last send, it is evicted to make room
+        assert read(first) == contents[0]
+        assert not first.path.exists() and third.path.exists()
+        assert cache.stats()["cached"] == 1 and cache.stats()["pinned"] == 0
+
+    run(cache, scenario)
+
+
+def test_pins_wait_for_downloads_in_progress(cdn):
+    cache = AttachmentCache(cache_size=SPOOL_SIZE)
+    content = os.urandom(SPOOL_SIZE * 2)
+
+    async def scenario():
+        attachment = cdn.attachment(content)
+        download = cache.fetch(attachment)
+        cache.fetch(attachment)
+        cached = await download
+        assert cached.path.exists()
+        assert read(cached) == content
+        assert cached.path.exists()
+        assert read(cached) == content
+        assert not cached.path.exists()
+
+    run(cache, scenario)
@@ -0,0 +1,99 @@
+import gzip
+from datetime import datetime
+
+import pytest
+from bson import Int64, ObjectId
+from pymongo.errors import BulkWriteError
+
+from backup import ExportError, export_collection, read_batches, restore_collection
+from store import MemoryDatabase
+
+
+def documents(count: int) -> list[dict]:
+    return [{"_id": str(index), "character_name": f"C{index}", "object_id": ObjectId(),
+             "created_at": datetime(2024, 1, 1, index % 24),
+             "big": Int64(2 ** 40 + index)} for index in range(count)]
+
+
+@pytest.fixture
+def export(tmp_path):
+    source = MemoryDatabase()["characters"]
+    source.insert_many(documents(25))
+    path = str(tmp_path / "characters.jsonl.gz")
+    assert export_collection(source, path, batch_size=10) == {"batches": 3, "documents": 25}
+    return source, path
+
+
+def rewrite(path: str, edit) -> None:
+    with gzip.open(path, "rb") as file:
+        lines = file.readlines()
+    with gzip.open(path, "wb") as file:
+        file.writelines(edit(lines))
+
+
+def test_round_trip(export):
+    source, path = export
+    target = MemoryDatabase()["characters"]
+    assert restore_collection(target, path) == {"batches": 3, "documents": 25, "skipped_batches": 0}
+    assert target.find({}, sort=[("_id", 1)]) == source.find({}, sort=[("_id", 1)])
+    assert isinstance(target.find_one({"_id": "0"})["big"], Int64)
+    assert [number for _, number, _ in read_batches(path)] == [0, 1, 2]
+
+
+def test_interrupted_restore_resumes(export):
+    source, path = export
+    target = MemoryDatabase()["characters"]
+
+    class Interrupted:
+        """Inserts two batches and part of the third, then fails as if the connection dropped."""
+
+        name = "characters"
+
+        def __init__(self) -> None:
+            self.batches = 0
+
+        def insert_many(self, batch, ordered=True):
+            self.batches += 1
+            if self.batches == 3:
+                target.insert_many(batch[:2], ordered=ordered)
+                raise ConnectionError("connection lost")
+            return target.insert_many(batch, ordered=ordered)
+
+        def delete_many(self, query):
+            return target.delete_many(query)
+
+    with pytest.raises(ConnectionError):
+        restore_collection(Interrupted(), path)
+    assert target.count_documents({}) == 22
+    # The documents of the third batch already inserted are skipped as duplicates
+    assert restore_collection(target, path, drop=True) == {"batches": 1, "documents": 3, "skipped_batches": 2}
+    assert target.count_documents({}) == 25
+    assert restore_collection(target, path, drop=True)["skipped_batches"] == 0
+    assert target.count_documents({}) == 25
+
+
+def test_checksum_failure(export):
+    _, path = export
+    rewrite(path, lambda lines: [line.replace(b'"C5"', b'"C99"') for line in lines])
+    target = MemoryDatabase()["characters"]
+    with pytest.raises(ExportError, match="batch 2"):
+        restore_collection(target, path)
+    # Batches before the bad one stay restored
+    assert target.count_documents({}) == 20
+
+
+def test_truncated_file(export):
+    _, path = export
+    rewrite(path, lambda lines: lines[:-3])
+    with pytest.raises(ExportError, match="truncated"):
+        restore_collection(MemoryDatabase()["characters"], path)
+
+
+def test_unique_index_clash(export):
+    _, path = export
+    target = MemoryDatabase()["characters"]
+    target.create_index("character_name", unique=True)
+    target.insert_one({"_id": "other", "character_name": "C3"})
+    with pytest.raises(BulkWriteError) as error:
+        restore_collection(target, path)
+    assert error.value.details["writeErrors"][0]["keyPattern"] == {"character_name": 1}
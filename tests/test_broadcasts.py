@@ -0,0 +1,156 @@
+import asyncio
+import time
+
+import discord
+import pytest
+
+from broadcasts import DONE, FAILED, PENDING, SENDING, SENT, BroadcastPipeline, is_transient
+from outbound import MESSAGE_CHARACTER_LIMIT, RateLimiter
+from tests.conftest import character
+from tests.fakes import http_error
+
+
+class FakeFanout:
+    """The DM channels and global rate limit of a DirectMessageFanout."""
+
+    def __init__(self) -> None:
+        self.limiter = RateLimiter(1000, 1.0)
+
+    async def dm_channel(self, user_id: int) -> int:
+        return user_id
+
+
+class FakeSender:
+    """Records the DMs sent to each user, raising the errors queued for them first."""
+
+    def __init__(self, errors=None) -> None:
+        self.errors = errors or {}
+        self.sent: dict[int, list[str]] = {}
+
+    async def __call__(self, channel, content, author, files=()) -> None:
+        errors = self.errors.get(channel)
+        if errors:
+            raise errors.pop(0)
+        self.sent.setdefault(channel, []).append(content)
+
+
+@pytest.fixture
+def collection(database):
+    return database["broadcasts"]
+
+
+def pipeline(store, collection, sender, **options) -> BroadcastPipeline:
+    return BroadcastPipeline(store, collection, FakeFanout(), str, sender, retry_delay=0.01,
+                             status_interval=0.01, **options)
+
+
+def test_is_transient():
+    assert is_transient(http_error(discord.HTTPException, 503))
+    assert is_transient(http_error(discord.HTTPException, 429))
+    assert is_transient(asyncio.TimeoutError())
+    assert not is_transient(http_error(discord.Forbidden, 403))
+    assert not is_transient(ValueError())
+
+
+def test_transient_failures_are_retried_with_backoff(store, collection):
+    sender = FakeSender({1: [http_error(discord.HTTPException, 503), ConnectionResetError()],
+                         2: [http_error(discord.Forbidden, 403)],
+                         3: [http_error(discord.HTTPException, 500)] * 4})
+
+    async def scenario():
+        for user_id in (1, 2, 3, 4):
+            await store.create(str(user_id), character(str(user_id), f"C{user_id}", user_id))
+        broadcasts = pipeline(store, collection, sender)
+        started = time.monotonic()
+        broadcast = await broadcasts.start("default", "announcement")
+        await broadcast.task
+        return broadcasts, broadcast, time.monotonic() - started
+
+    broadcasts, broadcast, elapsed = asyncio.run(scenario())
+    assert sender.sent == {1: ["announcement"], 4: ["announcement"]}
+    # Two retries for the first player, none for the unreachable one, and three for the last
+    assert broadcasts.retries == 5
+    # Retries wait 0.01, 0.02 then 0.04 seconds
+    assert elapsed >= 0.07
+    assert (broadcast.sent, broadcast.failed) == (2, 2)
+
+
+def test_final_status_is_saved(store, collection):
+    sender = FakeSender({2: [http_error(discord.Forbidden, 403)]})
+    content = "x" * (MESSAGE_CHARACTER_LIMIT + 1)
+
+    async def scenario():
+        for user_id in (1, 2, 3):
+            await store.create(str(user_id), character(str(user_id), f"C{user_id}", user_id))
+        await store.create("4", character("4", "C4", 4, status="evicted"))
+        await store.create("5", character("5", "C5", 5, game_id="other"))
+        broadcasts = pipeline(store, collection, sender)
+        broadcast = await broadcasts.start("default", content)
+        await broadcast.task
+        return broadcasts, broadcast
+
+    broadcasts, broadcast = asyncio.run(scenario())
+    document = collection.find_one({"_id": broadcast.broadcast_id})
+    assert document["status"] == DONE
+    assert document["recipients"] == {"1": SENT, "2": FAILED, "3": SENT}
+    assert set(document["errors"]) == {"2"}
+    # Content over the limit is sent in two DMs
+    assert sender.sent[1] == ["x" * MESSAGE_CHARACTER_LIMIT, "x"]
+    assert broadcasts.stats() == {"active": 0, "pending": 0, "retries": 0}
+
+
+def test_resume_only_sends_to_pending_recipients(store, collection):
+    collection.insert_one({"_id": "interrupted", "game_id": "default", "content": "hello", "status": SENDING,
+                           "recipients": {"1": SENT, "2": PENDING, "3": FAILED, "4": PENDING}, "errors": {}})
+    collection.insert_one({"_id": "finished", "game_id": "default", "content": "bye", "status": DONE,
+                           "recipients": {"1": PENDING}, "errors": {}})
+    sender = FakeSender()
+
+    async def scenario():
+        broadcasts = pipeline(store, collection, sender)
+        resumed = await broadcasts.resume()
+        assert [broadcast.broadcast_id for broadcast in resumed] == ["interrupted"]
+        await resumed[0].task
+        return resumed[0]
+
+    broadcast = asyncio.run(scenario())
+    assert sender.sent == {2: ["hello"], 4: ["hello"]}
+    assert (broadcast.recipients, broadcast.sent, broadcast.failed) == (4, 3, 1)
+    document = collection.find_one({"_id": "interrupted"})
+    assert document["status"] == DONE
+    assert document["recipients"] == {"1": SENT, "2": SENT, "3": FAILED, "4": SENT}
+
+
+def test_restart_does_not_resend_to_players_reached(store, collection):
+    class StoppingSender(FakeSender):
+        """Hangs on the third player, as if the bot stopped during the send."""
+
+        async def __call__(self, channel, content, author, files=()) -> None:
+            if channel == 3:
+                await asyncio.Event().wait()
+            await super().__call__(channel, content, author, files)
+
+    async def stop_during_broadcast():
+        for user_id in (1, 2, 3, 4):
+            await store.create(str(user_id), character(str(user_id), f"C{user_id}", user_id))
+        broadcast = await pipeline(store, collection, StoppingSender(), concurrency=1).start("default", "news")
+        while broadcast.sent < 2:
+            await asyncio.sleep(0.001)
+        broadcast.task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await broadcast.task
+        return broadcast.broadcast_id
+
+    broadcast_id = asyncio.run(stop_during_broadcast())
+    assert collection.find_one({"_id": broadcast_id})["recipients"] == {"1": SENT, "2": SENT, "3": PENDING,
+                                                                        "4": PENDING}
+
+    sender = FakeSender()
+
+    async def restart():
+        resumed = await pipeline(store, collection, sender).resume()
+        await resumed[0].task
+
+    asyncio.run(restart())
+    assert sender.sent == {3: ["news"], 4: ["news"]}
+    assert collection.find_one({"_id": broadcast_id})["status"] == DONE
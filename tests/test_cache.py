@@ -0,0 +1,46 @@
+from cache import ExpiringValue, LRUCache, RenderCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_cache_peek_neither_counts_nor_refreshes():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.peek("a") == 1
+    assert cache.peek("missing", 0) == 0
+    cache.put("c", 3)
+    assert "a" not in cache
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 0
+
+
+def test_render_cache_misses_on_another_fingerprint():
+    cache = RenderCache()
+    cache.put_payload("a", 1, "payload")
+    assert cache.get_payload("a", 1) == "payload"
+    assert cache.get_payload("a", 2) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_expiring_value_discards_values_computed_before_invalidation():
+    value = ExpiringValue(ttl=60)
+    generation = value.generation
+    value.invalidate("character", None)
+    value.put("stale", generation)
+    assert value.get() is None
+    value.put("fresh", value.generation)
+    assert value.get() == "fresh"
+
+
+def test_expiring_value_expires():
+    value = ExpiringValue(ttl=0)
+    value.put("value", value.generation)
+    assert value.get("expired") == "expired"
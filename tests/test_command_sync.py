@@ -0,0 +1,77 @@
+import asyncio
+
+import discord
+import pytest
+from discord import app_commands
+
+import command_sync
+from command_sync import command_tree_hash, sync_command_tree
+
+
+@pytest.fixture(autouse=True)
+def hash_path(tmp_path, monkeypatch):
+    path = tmp_path / ".command_tree_hash"
+    monkeypatch.setattr(command_sync, "COMMAND_HASH_PATH", path)
+    return path
+
+
+@pytest.fixture
+def tree():
+    client = discord.Client(intents=discord.Intents.none())
+    client._connection.application_id = 1234
+    tree = app_commands.CommandTree(client)
+
+    @tree.command(description="Say hello")
+    async def hello(interaction: discord.Interaction) -> None:
+        pass
+
+    tree.syncs = []
+
+    async def sync(guild=None):
+        tree.syncs.append(guild)
+        return []
+
+    tree.sync = sync
+    return tree
+
+
+def add_command(tree: app_commands.CommandTree, name: str) -> None:
+    async def callback(interaction: discord.Interaction) -> None:
+        pass
+
+    tree.add_command(app_commands.Command(name=name, description=name, callback=callback))
+
+
+def test_unchanged_tree_is_not_synced_again(tree):
+    assert asyncio.run(sync_command_tree(tree))
+    assert not asyncio.run(sync_command_tree(tree))
+    assert tree.syncs == [None]
+
+
+def test_force_syncs_an_unchanged_tree(tree):
+    asyncio.run(sync_command_tree(tree))
+    assert asyncio.run(sync_command_tree(tree, force=True))
+    assert tree.syncs == [None, None]
+
+
+def test_changed_tree_is_synced(tree):
+    asyncio.run(sync_command_tree(tree))
+    before = command_tree_hash(tree)
+    add_command(tree, "wave")
+    assert command_tree_hash(tree) != before
+    assert asyncio.run(sync_command_tree(tree))
+    assert tree.syncs == [None, None]
+
+
+def test_scopes_are_hashed_separately(tree):
+    guild = discord.Object(id=42)
+    asyncio.run(sync_command_tree(tree))
+    assert asyncio.run(sync_command_tree(tree, guild=guild))
+    assert not asyncio.run(sync_command_tree(tree, guild=guild))
+    assert tree.syncs == [None, guild]
+
+
+def test_unreadable_hash_file_syncs(tree, hash_path):
+    hash_path.write_text("not json")
+    assert asyncio.run(sync_command_tree(tree))
+    assert tree.syncs == [None]
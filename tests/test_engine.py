@@ -0,0 +1,58 @@
+import asyncio
+
+import numpy as np
+
+from engine import MAX_STAT, STATS, StatDecayEngine, decay_step
+from tests.conftest import character
+
+TRAITS = ["Strength", "Charisma"]
+
+
+def test_decay_step_is_weighted_by_traits_and_rooms():
+    engine = StatDecayEngine(None, TRAITS)
+    stats = np.full((3, len(STATS)), float(MAX_STAT))
+    traits = np.array([[0, 0], [20, 0], [0, 0]], dtype=float)
+    rooms = np.array([len(engine.rooms), len(engine.rooms), engine.rooms.index("HoH Bedroom")])
+    updated = decay_step(stats, traits, rooms, engine.trait_weights, engine.room_recovery)
+    hunger, energy = STATS.index("Hunger"), STATS.index("Energy")
+    assert updated[1, hunger] < updated[0, hunger] < MAX_STAT
+    assert updated[2, energy] == MAX_STAT
+    assert (updated >= 0).all()
+
+
+def test_tick_writes_changed_stats(store):
+    async def scenario():
+        await store.create("1", character("1", "Alice", 0))
+        await store.create("2", character("2", "Bob", 1, status="evicted"))
+        assert await StatDecayEngine(store, TRAITS).tick() == 1
+        assert (await store.get("1"))["stats"]["Hunger"] < MAX_STAT
+        assert (await store.get("2"))["stats"]["Hunger"] == MAX_STAT
+
+    asyncio.run(scenario())
+
+
+def test_writes_during_a_tick_are_not_undone(store, monkeypatch):
+    async def scenario():
+        for character_id, name in [("1", "Alice"), ("2", "Bob")]:
+            await store.create(character_id, character(character_id, name, int(character_id)))
+        list_characters = store.list
+
+        async def list_then_write(*args, **kwargs):
+            # The move and delete complete after the tick read the characters
+            characters = await list_characters(*args, **kwargs)
+            await store.move("1", "Lounge", "Kitchen")
+            await store.delete("2")
+            return characters
+
+        monkeypatch.setattr(store, "list", list_then_write)
+        assert await StatDecayEngine(store, TRAITS).tick() == 2
+        monkeypatch.undo()
+        moved = await store.get("1")
+        assert moved["current_room"] == "Kitchen"
+        assert moved["stats"]["Hunger"] < MAX_STAT
+        assert store.collection.find_one({"_id": "1"}) == moved
+        assert await store.get("2") is None
+        assert "2" not in store.cache
+        assert store.collection.find_one({"_id": "2"}) is None
+
+    asyncio.run(scenario())
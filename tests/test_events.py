@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+import events
+from events import CHARACTER_DELETED, CHARACTER_SAVED, MESSAGE_RELAYED, EventLog, EventLogTruncated, replay
+from tests.conftest import character
+
+
+@pytest.fixture
+def event_log(store, database):
+    event_log = EventLog(store, database["events"], database["event_snapshots"])
+    store.add_listener(event_log.character_written, changes=False)
+    return event_log
+
+
+def sequences(collection) -> list[int]:
+    return [event["seq"] for event in collection.find({}, sort=[("seq", 1)])]
+
+
+def test_replay_applies_saves_and_deletes():
+    snapshot = [{"_id": "1", "name": "Alice"}, {"_id": "2", "name": "Bob"}]
+    log = [{"type": CHARACTER_SAVED, "character_id": "1", "data": {"_id": "1", "name": "Alicia"}},
+           {"type": CHARACTER_DELETED, "character_id": "2"},
+           {"type": MESSAGE_RELAYED, "character_id": "1"},
+           {"type": CHARACTER_SAVED, "character_id": "3", "data": {"_id": "3", "name": "Carol"}}]
+    state = replay(snapshot, log)
+    assert state == {"1": {"_id": "1", "name": "Alicia"}, "3": {"_id": "3", "name": "Carol"}}
+    assert replay(state.values(), log) == state
+
+
+def test_events_appended_before_load_follow_the_persisted_sequence(store, database, event_log):
+    previous = EventLog(store, database["events"], database["event_snapshots"])
+
+    async def scenario():
+        await previous.load()
+        for _ in range(3):
+            previous.append(MESSAGE_RELAYED, "1")
+        await previous.flush()
+        # Events recorded while the bot starts, before the log is loaded, are not written yet
+        event_log.append(MESSAGE_RELAYED, "2")
+        event_log.append(MESSAGE_RELAYED, "2")
+        assert await event_log.flush() == 0
+        await event_log.load()
+        event_log.append(MESSAGE_RELAYED, "2")
+        assert await event_log.flush() == 3
+
+    asyncio.run(scenario())
+    assert sequences(database["events"]) == [1, 2, 3, 4, 5, 6]
+    assert len(event_log) == 0
+
+
+def test_duplicates_are_skipped_and_failures_retried(store, database, event_log):
+    class FailingCollection:
+        """Fails to write the second event of the next insert_many."""
+
+        def __init__(self, collection) -> None:
+            self.collection = collection
+            self.fail = True
+
+        def insert_many(self, documents, ordered=True):
+            if not self.fail:
+                return self.collection.insert_many(documents, ordered=ordered)
+            self.fail = False
+            self.collection.insert_many(documents[:1] + documents[2:], ordered=ordered)
+            raise BulkWriteError({"writeErrors": [{"index": 1, "code": 50, "errmsg": "timed out"}],
+                                  "nInserted": len(documents) - 1})
+
+        def __getattr__(self, attribute):
+            return getattr(self.collection, attribute)
+
+    async def scenario():
+        await event_log.load()
+        # Events 2 and 4 were written by an earlier request whose reply was lost
+        database["events"].insert_many([{"seq": 2, "type": MESSAGE_RELAYED}, {"seq": 4, "type": MESSAGE_RELAYED}])
+        for _ in range(5):
+            event_log.append(MESSAGE_RELAYED, "1")
+        assert await event_log.flush() == 3
+        assert len(event_log) == 0
+        event_log.collection = FailingCollection(database["events"])
+        for _ in range(3):
+            event_log.append(MESSAGE_RELAYED, "1")
+        assert await event_log.flush() == 2
+        assert [event["seq"] for event in event_log._buffer] == [7]
+        assert await event_log.flush() == 1
+
+    asyncio.run(scenario())
+    assert sequences(database["events"]) == [1, 2, 3, 4, 5, 6, 7, 8]
+
+
+def test_rebuild_from_the_latest_snapshot(store, event_log):
+    async def scenario():
+        await event_log.load()
+        await store.create("1", character("1", "Alice", 0))
+        await store.create("2", character("2", "Bob", 1))
+        first = await event_log.snapshot()
+        await store.move("1", "Lounge", "Kitchen")
+        await event_log.snapshot()
+        await store.delete("2")
+        await store.create("3", character("3", "Carol", 2))
+        rebuilt = await event_log.rebuild()
+        assert rebuilt == {character["_id"]: character for character in await store.list()}
+        # Rebuilt as of the first snapshot, and as of the move
+        assert set(await event_log.rebuild(first)) == {"1", "2"}
+        as_of_move = await event_log.rebuild(first + 1)
+        assert as_of_move["1"]["current_room"] == "Kitchen" and "2" in as_of_move
+
+    asyncio.run(scenario())
+
+
+def test_only_the_latest_snapshots_are_kept(store, database, event_log, monkeypatch):
+    monkeypatch.setattr(events, "SNAPSHOT_RETENTION", 2)
+
+    async def scenario():
+        await event_log.load()
+        taken = []
+        for index in range(4):
+            await store.create(str(index), character(str(index), f"C{index}", index))
+            taken.append(await event_log.snapshot())
+        return taken
+
+    taken = asyncio.run(scenario())
+    assert [snapshot["seq"] for snapshot in database["event_snapshots"].find({}, sort=[("seq", 1)])] == taken[-2:]
+
+
+def test_rebuild_fails_when_events_were_dropped(store, database, event_log):
+    database["events"].max_documents = 3
+
+    async def scenario():
+        await event_log.load()
+        await store.create("1", character("1", "Alice", 0))
+        await event_log.snapshot()
+        for room in ["Kitchen", "Lounge", "Kitchen", "Lounge"]:
+            await store.upsert("1", {"current_room": room})
+        with pytest.raises(EventLogTruncated):
+            await event_log.rebuild()
+
+    asyncio.run(scenario())
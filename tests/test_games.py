@@ -0,0 +1,53 @@
+import asyncio
+
+from games import DEFAULT_GAME_ID, Game, GameRegistry
+from tests.conftest import character
+
+
+def registry(store, database) -> GameRegistry:
+    return GameRegistry(store, database["games"], database["relationships"], capacity=4)
+
+
+def test_load_creates_the_default_game_and_adopts_characters(store, database):
+    legacy = character("a", "Alice", 0)
+    del legacy["game_id"]
+    database["characters"].insert_one({"_id": "a", **legacy})
+    database["games"].insert_one(Game("other", 5, {"Lounge": 501}).to_document())
+    games = registry(store, database)
+    asyncio.run(games.load(Game(DEFAULT_GAME_ID, 1, {"Lounge": 101})))
+    assert games.for_guild(1).game_id == DEFAULT_GAME_ID
+    assert games.for_guild(5).game_id == "other"
+    assert database["characters"].find_one({"_id": "a"})["game_id"] == DEFAULT_GAME_ID
+
+
+def test_updates_route_characters_to_their_game(store, database):
+    games = registry(store, database)
+    default, other = games.add(Game(DEFAULT_GAME_ID, 1, {})), games.add(Game("other", 2, {}))
+    games.rebuild([{"_id": "a", **character("a", "Alice", 0)}])
+    assert games.of("a") is default
+    assert default.name_index.search("al") == [("Alice", 0)]
+
+    games.update("a", character("a", "Alice", 0, game_id="other", room="Kitchen"))
+    assert games.of("a") is other
+    assert default.name_index.search("al") == []
+    assert other.room_index.occupants("Kitchen") == {"a"}
+
+    games.update("a", None)
+    assert games.of("a") is None
+    assert len(other.name_index) == 0
+
+
+def test_replacing_a_game_moves_its_guild(store, database):
+    games = registry(store, database)
+    games.add(Game("house", 1, {}))
+    games.add(Game("house", 2, {}))
+    assert games.for_guild(1) is None
+    assert games.for_guild(2).guild_id == 2
+    assert len(games) == 1
+
+
+def test_relationship_matrices_are_saved_per_game(store, database):
+    games = registry(store, database)
+    default, other = games.add(Game(DEFAULT_GAME_ID, 1, {})), games.add(Game("other", 2, {}))
+    assert games.relationship_store(default).matrix_id == "relationships"
+    assert games.relationship_store(other).matrix_id == "relationships:other"
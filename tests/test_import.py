@@ -0,0 +1,41 @@
+"""Importing the bot must not touch the network or the database (connections are made in on_ready)."""
+
+import importlib
+import socket
+import sys
+from pathlib import Path
+
+import pymongo
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Modules of the bot, re-imported by the test so that their import-time code runs again
+BOT_MODULES = [path.stem for path in ROOT.glob("*.py")]
+
+
+def _refuse(*args, **kwargs):
+    raise AssertionError("network or database I/O at import time")
+
+
+@pytest.fixture
+def fresh_import(monkeypatch):
+    monkeypatch.syspath_prepend(str(ROOT))
+    monkeypatch.setenv("encryption_key", "5")
+    monkeypatch.setenv("metrics_port", "0")
+    monkeypatch.delenv("memory_db", raising=False)
+    monkeypatch.setattr(pymongo, "MongoClient", _refuse)
+    monkeypatch.setattr(socket, "create_connection", _refuse)
+    monkeypatch.setattr(socket.socket, "connect", _refuse)
+    for name in BOT_MODULES:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    yield
+    for name in BOT_MODULES:
+        sys.modules.pop(name, None)
+
+
+def test_import_main_does_no_io(fresh_import):
+    main = importlib.import_module("main")
+    assert main.character_store is not None
+    # The database is only resolved on first use
+    assert main.get_database.cache_info().currsize == 0
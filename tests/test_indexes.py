@@ -0,0 +1,55 @@
+from indexes import NameIndex, RoomIndex
+from tests.conftest import character
+
+
+def name_index() -> NameIndex:
+    index = NameIndex()
+    index.rebuild([{"_id": "a", **character("a", "alice", 3)},
+                   {"_id": "b", **character("b", "Albert", 1)},
+                   {"_id": "c", **character("c", "Bob", 2)},
+                   {"_id": "d", **character("d", "42", 7)}])
+    return index
+
+
+def test_search_is_a_case_insensitive_prefix_search():
+    index = name_index()
+    assert index.search("AL") == [("Albert", 1), ("alice", 3)]
+    assert index.search("al", limit=1) == [("Albert", 1)]
+    assert index.search("z") == []
+    assert len(index.search("")) == 4
+
+
+def test_search_follows_renames_and_deletions():
+    index = name_index()
+    index.update("a", character("a", "Zoe", 3))
+    index.update("b", None)
+    assert index.search("al") == []
+    assert index.search("z") == [("Zoe", 3)]
+    assert index.name("a") == "Zoe" and index.slot("b") is None
+    assert len(index) == 3
+
+
+def test_resolve_autocomplete_values_and_names():
+    index = name_index()
+    assert index.resolve(index.value(1)) == "b"
+    assert index.resolve("ALICE") == "a"
+    assert index.resolve("Ali") is None
+    assert index.resolve("#9") is None
+
+
+def test_resolve_digit_names_as_names():
+    index = name_index()
+    # "42" is a name, not the character with portrait emoji pair 42 (or 2)
+    assert index.resolve("42") == "d"
+    assert index.resolve("2") is None
+    assert index.resolve("#2") == "c"
+
+
+def test_room_index_tracks_moves():
+    index = RoomIndex()
+    index.rebuild([{"_id": "a", **character("a", "Alice", 1)}, {"_id": "b", **character("b", "Bob", 2)}])
+    index.update("a", character("a", "Alice", 1, room="Kitchen"))
+    index.update("b", None)
+    assert index.occupants("Kitchen") == {"a"}
+    assert index.counts() == {"Kitchen": 1}
+    assert index.room_of("b") is None
@@ -0,0 +1,47 @@
+from leaderboard import leaderboard_embed, leaderboard_pipeline
+from tests.conftest import character
+
+
+def stats(hunger: int, energy: int) -> dict:
+    return {"Hunger": hunger, "Energy": energy, "Activity": 100, "Socialization": 100}
+
+
+def insert_characters(collection) -> None:
+    collection.insert_many([
+        {"_id": "a", **character("a", "Alice", 0, stats=stats(30, 90), traits={"Strength": 5})},
+        {"_id": "b", **character("b", "Bob", 1, room="Kitchen", stats=stats(80, 10), traits={"Strength": 9})},
+        {"_id": "c", **character("c", "Carol", 2, stats=stats(80, 50), status="evicted")},
+        {"_id": "d", **character("d", "Dave", 3, stats=stats(60, 70), traits={"Strength": 7})},
+        # Another game's characters are never ranked
+        {"_id": "e", **character("e", "Eve", 4, game_id="other", stats=stats(100, 100), traits={"Strength": 20})},
+    ])
+
+
+def test_rankings_are_sorted_and_limited(database):
+    collection = database["characters"]
+    insert_characters(collection)
+    [result] = collection.aggregate(leaderboard_pipeline("default", size=3))
+    # Ties are broken by name
+    assert result["Hunger"] == [{"character_name": "Bob", "value": 80}, {"character_name": "Carol", "value": 80},
+                                {"character_name": "Dave", "value": 60}]
+    assert [row["character_name"] for row in result["Energy"]] == ["Alice", "Dave", "Carol"]
+    # Characters without the trait sort last
+    assert [row.get("value") for row in result["Strength"]] == [9, 7, 5]
+    assert result["rooms"] == [{"_id": "Kitchen", "count": 1}, {"_id": "Lounge", "count": 3}]
+    assert result["status"] == [{"_id": "evicted", "count": 1}, {"_id": "in house", "count": 3}]
+
+
+def test_embed_lists_rankings_and_summary(database):
+    collection = database["characters"]
+    insert_characters(collection)
+    [result] = collection.aggregate(leaderboard_pipeline("default", size=2))
+    fields = {field.name: field.value for field in leaderboard_embed(result).fields}
+    assert fields["Hunger"] == "1. Bob (80)\n2. Carol (80)"
+    assert fields["Charisma"] == "-"
+    assert fields["Rooms"] == "Kitchen: 1\nLounge: 3"
+    assert leaderboard_embed(result).footer.text == "4 characters"
+
+
+def test_empty_game_shows_the_empty_embed(database):
+    [result] = database["characters"].aggregate(leaderboard_pipeline("default"))
+    assert leaderboard_embed(result).description == "There are no characters yet."
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+
+import pytest
+
+from metrics import Histogram, MetricsRegistry, RateLimitCounter, registry, timed
+
+
+def test_histogram_quantile_interpolates_within_buckets():
+    histogram = Histogram(buckets=(1.0, 2.0, 4.0))
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    assert histogram.count == 4 and histogram.sum == pytest.approx(6.5)
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert Histogram().quantile(0.99) == 0.0
+
+
+def test_render_uses_prometheus_text_format():
+    metrics = MetricsRegistry()
+    metrics.histogram("latency_seconds", "Latency", handler="ping").observe(0.5)
+    metrics.counter("errors_total", "Errors", handler='say "hi"').inc(2)
+    metrics.add_collector(lambda: [("queue_depth", "Depth", {"room": "Lounge"}, 3)])
+    text = metrics.render()
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'latency_seconds_bucket{handler="ping",le="0.5"} 1' in text
+    assert 'latency_seconds_bucket{handler="ping",le="+Inf"} 1' in text
+    assert 'latency_seconds_count{handler="ping"} 1' in text
+    assert 'errors_total{handler="say \\"hi\\""} 2.0' in text
+    assert 'queue_depth{room="Lounge"} 3.0' in text
+
+
+def test_failing_collector_does_not_break_rendering():
+    metrics = MetricsRegistry()
+    metrics.counter("sends_total").inc()
+    metrics.add_collector(lambda: 1 / 0)
+    assert "sends_total 1.0" in metrics.render()
+
+
+def test_timed_records_calls_and_errors():
+    @timed("test_timed_seconds")
+    async def fail():
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        asyncio.run(fail())
+    name = fail.__qualname__
+    assert registry.histogram("test_timed_seconds", handler=name).count == 1
+    assert registry.counter("test_timed_seconds_errors_total", handler=name).value == 1
+
+
+def test_rate_limit_counter_counts_rate_limit_warnings():
+    metrics = MetricsRegistry()
+    logger = logging.getLogger("tests.discord")
+    handler = RateLimitCounter(metrics)
+    logger.addHandler(handler)
+    try:
+        logger.warning("We are being rate limited. Retrying in 1.00 seconds.")
+        logger.warning("Something else")
+    finally:
+        logger.removeHandler(handler)
+    assert metrics.counter("discord_rate_limits_total", logger="tests.discord").value == 1
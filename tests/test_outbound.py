@@ -0,0 +1,158 @@
+import asyncio
+
+from outbound import MESSAGE_CHARACTER_LIMIT, ChannelSendQueue, OutboundRelay, RateLimiter, split_content
+
+
+class FakeSender:
+    """Records posts, optionally holding them until released or failing those with given content."""
+
+    def __init__(self, fail: tuple[str, ...] = ()) -> None:
+        self.posts = []
+        self.fail = fail
+        self.released = asyncio.Event()
+        self.released.set()
+
+    async def __call__(self, destination, content, author, files=()) -> None:
+        await self.released.wait()
+        if content in self.fail:
+            raise OSError(f"failed to send {content}")
+        self.posts.append((content, author, [file.name for file in files]))
+
+    async def wait_for(self, count: int) -> None:
+        async def posted() -> None:
+            while len(self.posts) < count:
+                await asyncio.sleep(0.001)
+
+        await asyncio.wait_for(posted(), timeout=5)
+
+
+class FakeFile:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+class Ready:
+    """An attachment already downloaded."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __await__(self):
+        yield from asyncio.sleep(0).__await__()
+        return self
+
+    def file(self) -> FakeFile:
+        return FakeFile(self.name)
+
+
+def queue(sender: FakeSender, **options) -> ChannelSendQueue:
+    return ChannelSendQueue("room", sender, rate=1000, per=1.0, **options)
+
+
+def test_split_content():
+    assert split_content("") == []
+    assert split_content("short") == ["short"]
+    lines = "\n".join(["x" * 900] * 5)
+    assert split_content(lines) == ["\n".join(["x" * 900] * 2)] * 2 + ["x" * 900]
+    unbroken = "y" * (MESSAGE_CHARACTER_LIMIT * 2 + 1)
+    assert split_content(unbroken) == ["y" * MESSAGE_CHARACTER_LIMIT] * 2 + ["y"]
+    assert all(len(chunk) <= MESSAGE_CHARACTER_LIMIT for chunk in split_content(lines + unbroken))
+
+
+def test_messages_are_sent_in_order():
+    sender = FakeSender()
+
+    async def scenario():
+        channel = queue(sender, coalesce_backlog=1000)
+        for index in range(20):
+            channel.put(f"message {index}", author=index % 3)
+        await sender.wait_for(20)
+        return channel
+
+    channel = asyncio.run(scenario())
+    assert [content for content, _, _ in sender.posts] == [f"message {index}" for index in range(20)]
+    assert channel.stats()["sent_posts"] == channel.stats()["sent_messages"] == 20
+
+
+def test_backlog_is_coalesced_by_author():
+    sender = FakeSender()
+
+    async def scenario():
+        channel = queue(sender)
+        sender.released.clear()
+        channel.put("a1", author="a")
+        await asyncio.sleep(0.01)
+        # Queued while the first post is being sent
+        for content, author in [("a2", "a"), ("a3", "a"), ("b1", "b"), ("a4", "a")]:
+            channel.put(content, author=author)
+        channel.put("a5", author="a", attachments=[Ready("photo.png")])
+        channel.put("a6", author="a")
+        sender.released.set()
+        await sender.wait_for(5)
+        return channel
+
+    channel = asyncio.run(scenario())
+    assert sender.posts == [("a1", "a", []), ("a2\na3", "a", []), ("b1", "b", []), ("a4", "a", []),
+                            ("a5", "a", ["photo.png"]), ("a6", "a", [])]
+    assert channel.stats()["sent_messages"] == 7
+
+
+def test_long_content_is_split_with_attachments_on_the_last_chunk():
+    sender = FakeSender()
+    content = "z" * (MESSAGE_CHARACTER_LIMIT + 10)
+
+    async def scenario():
+        queue(sender).put(content, attachments=[Ready("a.png")])
+        await sender.wait_for(2)
+
+    asyncio.run(scenario())
+    assert sender.posts == [("z" * MESSAGE_CHARACTER_LIMIT, None, []), ("z" * 10, None, ["a.png"])]
+
+
+def test_worker_survives_failed_sends():
+    sender = FakeSender(fail=("broken",))
+
+    async def scenario():
+        channel = queue(sender, coalesce_backlog=1000)
+        for content in ["before", "broken", "after"]:
+            channel.put(content)
+        await sender.wait_for(2)
+        channel.put("later")
+        await sender.wait_for(3)
+        return channel
+
+    channel = asyncio.run(scenario())
+    assert [content for content, _, _ in sender.posts] == ["before", "after", "later"]
+    assert channel.stats()["failed_posts"] == 1
+
+
+def test_relay_keeps_one_queue_per_destination():
+    sender = FakeSender()
+    rooms = [type("Room", (), {"id": room_id})() for room_id in (1, 2)]
+
+    async def scenario():
+        relay = OutboundRelay(sender, rate=1000, per=1.0)
+        relay.send(rooms[0], "one")
+        relay.send(rooms[1], "two")
+        relay.send(rooms[0], "three")
+        await sender.wait_for(2)
+        return relay
+
+    relay = asyncio.run(scenario())
+    assert set(relay.stats()) == {1, 2}
+    # Queued together, the two messages to the first room are posted at once
+    assert sorted(content for content, _, _ in sender.posts) == ["one\nthree", "two"]
+    assert relay.stats()[1]["sent_messages"] == 2
+
+
+def test_rate_limiter_spaces_out_acquisitions():
+    async def scenario():
+        limiter = RateLimiter(2, 0.05)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(4):
+            await limiter.acquire()
+        return loop.time() - started
+
+    # Two tokens are available at once, and the next two take 0.025s each
+    assert asyncio.run(scenario()) >= 0.045
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from games import DEFAULT_GAME_ID
+from portraits import PortraitAllocator, PortraitsExhausted, counter_id, url_expiry
+from tests.conftest import character
+
+
+@pytest.fixture
+def allocator(store, database):
+    return PortraitAllocator(store, database["counters"], capacity=100)
+
+
+def test_concurrent_allocations_are_unique(allocator):
+    async def scenario():
+        slots = await asyncio.gather(*(allocator.allocate() for _ in range(64)))
+        assert sorted(slots) == list(range(64))
+        await asyncio.gather(*(allocator.release(slot) for slot in [40, 3, 17]))
+        # Released slots are handed out again, lowest first, before any new one
+        assert await asyncio.gather(*(allocator.allocate() for _ in range(4))) == [3, 17, 40, 64]
+
+    asyncio.run(scenario())
+
+
+def test_allocations_are_per_game(allocator):
+    async def scenario():
+        slots = [await allocator.allocate(game_id) for game_id in ["a", "b", "a"]]
+        assert slots == [0, 0, 1]
+
+    asyncio.run(scenario())
+
+
+def test_sync_skips_taken_slots(store, allocator):
+    async def scenario():
+        for slot in [0, 1, 3]:
+            await store.create(str(slot), character(str(slot), f"C{slot}", slot))
+        assert [await allocator.allocate() for _ in range(2)] == [2, 4]
+
+    asyncio.run(scenario())
+
+
+def test_exhausted(store, database):
+    allocator = PortraitAllocator(store, database["counters"], capacity=2)
+
+    async def scenario():
+        await allocator.allocate()
+        await allocator.allocate()
+        with pytest.raises(PortraitsExhausted):
+            await allocator.allocate()
+
+    asyncio.run(scenario())
+
+
+def test_reconcile_drops_taken_slots(store, database, allocator):
+    async def scenario():
+        await allocator.sync()
+        # A counter out of step with the characters hands out slots that are in use
+        for slot in [0, 1, 5]:
+            await store.create(str(slot), character(str(slot), f"C{slot}", slot))
+        database["counters"].update_one({"_id": counter_id(DEFAULT_GAME_ID)}, {"$set": {"next": 2, "free": [1]}})
+        await allocator.reconcile()
+        assert database["counters"].find_one({"_id": counter_id(DEFAULT_GAME_ID)}) == \
+            {"_id": counter_id(DEFAULT_GAME_ID), "next": 6, "free": [2, 3, 4]}
+        assert await allocator.allocate() == 2
+
+    asyncio.run(scenario())
+
+
+def test_url_expiry():
+    assert url_expiry("https://cdn.discordapp.com/a/1.jpg?ex=6553c3a0&is=1&hm=2") == 0x6553c3a0
+    assert url_expiry("https://cdn.discordapp.com/a/1.jpg") is None
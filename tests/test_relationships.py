@@ -0,0 +1,119 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from relationships import MAX_SCORE, MIN_SCORE, RelationshipMatrix, RelationshipStore
+
+
+class FailingCollection:
+    """Fails every update_one while `failing` is set."""
+
+    def __init__(self, collection) -> None:
+        self.collection = collection
+        self.failing = False
+
+    def update_one(self, *args, **kwargs):
+        if self.failing:
+            raise ConnectionError("connection lost")
+        return self.collection.update_one(*args, **kwargs)
+
+    def __getattr__(self, attribute):
+        return getattr(self.collection, attribute)
+
+
+def test_updates_are_clipped_and_batched():
+    matrix = RelationshipMatrix(4, seed=0)
+    assert matrix.update(0, 1, 250) == MAX_SCORE
+    matrix.apply_interactions([2, 2, 3], [1, 1, 0], -60)
+    assert matrix.get(2, 1) == MIN_SCORE and matrix.get(3, 0) == -60
+
+
+def test_grow_keeps_scores():
+    matrix = RelationshipMatrix(2, seed=0)
+    matrix.add_character(0)
+    matrix.add_character(1)
+    scores = matrix.scores.copy()
+    # A slot beyond the capacity grows the matrix
+    matrix.add_character(4)
+    assert matrix.capacity == 5
+    assert np.array_equal(matrix.scores[:2, :2], scores)
+    assert list(matrix.active) == [True, True, False, False, True]
+    matrix.grow(3)
+    assert matrix.capacity == 5
+
+
+def test_remove_clears_the_slot():
+    matrix = RelationshipMatrix(3, seed=0)
+    matrix.sync_members([{"_id": "a", "portrait_emoji_pair": 0}, {"_id": "b", "portrait_emoji_pair": 1},
+                         {"_id": "c", "portrait_emoji_pair": 2}])
+    matrix.update(0, 1, 50)
+    matrix.update_character("b", None)
+    assert not matrix.active[1]
+    assert not matrix.row(1).any() and not matrix.column(1).any()
+    assert [slot for slot, _ in matrix.likes_most(0, count=5)] == [2]
+
+
+def test_byte_round_trip(tmp_path):
+    matrix = RelationshipMatrix(3, seed=1)
+    for slot in (0, 2):
+        matrix.add_character(slot)
+    path = tmp_path / "relationships.bin"
+    matrix.save_file(path)
+    # A smaller matrix grows to the saved capacity
+    loaded = RelationshipMatrix(1)
+    loaded.load_file(path)
+    assert np.array_equal(loaded.scores, matrix.scores)
+    assert np.array_equal(loaded.active, matrix.active)
+    assert not loaded.dirty
+    # A larger one keeps its extra slots empty
+    larger = RelationshipMatrix(5)
+    larger.load_bytes(matrix.to_bytes(), matrix.capacity)
+    assert np.array_equal(larger.scores[:3, :3], matrix.scores) and not larger.scores[3:].any()
+
+
+@pytest.fixture
+def relationships(database):
+    return FailingCollection(database["relationships"])
+
+
+def test_save_only_marks_saved_after_a_successful_write(store, relationships):
+    matrix = RelationshipMatrix(2, seed=0)
+    saved = RelationshipStore(store, relationships, matrix)
+
+    async def scenario():
+        matrix.add_character(0)
+        relationships.failing = True
+        with pytest.raises(ConnectionError):
+            await saved.save()
+        assert matrix.dirty
+        relationships.failing = False
+        await saved.save()
+        assert not matrix.dirty
+        loaded = RelationshipMatrix(2)
+        await RelationshipStore(store, relationships, loaded).load()
+        assert np.array_equal(loaded.scores, matrix.scores)
+
+    asyncio.run(scenario())
+
+
+def test_changes_during_a_save_are_saved_next(store, relationships):
+    matrix = RelationshipMatrix(2, seed=0)
+    saved = RelationshipStore(store, relationships, matrix)
+    update_one = relationships.update_one
+
+    def update_during_write(*args, **kwargs):
+        result = update_one(*args, **kwargs)
+        matrix.update(0, 1, 5)
+        return result
+
+    async def scenario():
+        matrix.add_character(0)
+        relationships.update_one = update_during_write
+        await saved.save()
+        assert matrix.dirty
+        relationships.update_one = update_one
+        await saved.save()
+        assert not matrix.dirty
+
+    asyncio.run(scenario())
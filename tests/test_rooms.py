@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+import config
+import rooms
+from rooms import move_character, room_unavailable_embed
+from tests.conftest import character
+
+
+class RecordingRelay:
+    def __init__(self) -> None:
+        self.sent = []
+
+    def send(self, destination, content, **kwargs) -> None:
+        self.sent.append((destination, content))
+
+
+@pytest.fixture
+def relay(monkeypatch):
+    relay = RecordingRelay()
+    monkeypatch.setattr(rooms, "outbound_relay", relay)
+    return relay
+
+
+def create(game, name: str, slot: int) -> str:
+    character_id = config.encrypt_id(10 ** 17 + slot)
+    asyncio.run(config.character_store.create(character_id, character(character_id, name, slot,
+                                                                      game_id=game.game_id)))
+    return character_id
+
+
+def test_move_announces_in_both_rooms(games, relay, monkeypatch):
+    game, _ = games
+    channels = {channel_id: f"channel {room}" for room, channel_id in game.channel_ids.items()}
+    monkeypatch.setattr(config.client, "get_channel", channels.get)
+    character_id = create(game, "Alice", 0)
+
+    moved = asyncio.run(move_character(character_id, "Kitchen"))
+    assert moved["current_room"] == "Kitchen"
+    assert game.room_index.room_of(character_id) == "Kitchen"
+    assert relay.sent == [("channel Lounge", "*Alice left for the Kitchen.*"),
+                          ("channel Kitchen", "*Alice entered the room.*")]
+
+
+@pytest.mark.parametrize("channel_ids", [{"Lounge": 201}, {"Lounge": 201, "Kitchen": 202}])
+def test_move_to_a_room_without_a_channel_changes_nothing(games, relay, monkeypatch, channel_ids):
+    # The room is either missing from the game's channel map, or its channel cannot be found
+    game, _ = games
+    game.channel_ids = channel_ids
+    monkeypatch.setattr(config.client, "get_channel", {201: "channel Lounge"}.get)
+    character_id = create(game, "Alice", 0)
+
+    assert asyncio.run(move_character(character_id, "Kitchen")) is room_unavailable_embed
+    assert config.character_store.collection.find_one({"_id": character_id})["current_room"] == "Lounge"
+    assert asyncio.run(config.character_store.get(character_id))["current_room"] == "Lounge"
+    assert game.room_index.room_of(character_id) == "Lounge"
+    assert not relay.sent
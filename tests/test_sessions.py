@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+import sessions
+from sessions import SetupSession, SetupSessionManager
+
+TRAITS = ["Strength", "Dexterity", "Constitution", "Intelligence", "Charisma"]
+
+
+@pytest.fixture
+def collection(database):
+    return database["setup_sessions"]
+
+
+def manager(store, collection, timeout: float = 60) -> SetupSessionManager:
+    return SetupSessionManager(store, collection, TRAITS, timeout=timeout)
+
+
+def test_sessions_survive_a_restart(store, collection):
+    async def scenario():
+        before = manager(store, collection)
+        session = await before.start("player", "game")
+        session.stage = SetupSession.TRAITS
+        session.character_name = "Alice"
+        session.starting_room = "Kitchen"
+        session.starting_traits["Strength"] = 20
+        session.current_trait, session.points_so_far, session.prompt_message_id = 1, 20, 1234
+        await before.save(session)
+
+        after = manager(store, collection)
+        [loaded] = await after.load()
+        return session, loaded, after
+
+    session, loaded, after = asyncio.run(scenario())
+    assert after.get("player") is loaded
+    for slot in SetupSession.__slots__:
+        assert getattr(loaded, slot) == pytest.approx(getattr(session, slot), abs=1e-3), slot
+    assert after.is_active(loaded)
+
+
+def test_idle_sessions_are_not_loaded(store, collection):
+    async def scenario():
+        before = manager(store, collection)
+        idle = await before.start("idle")
+        await before.start("recent")
+        idle.updated_at = time.time() - 120
+        collection.replace_one({"_id": "idle"}, idle.to_document())
+        return await manager(store, collection).load()
+
+    assert [session.session_id for session in asyncio.run(scenario())] == ["recent"]
+
+
+def test_replaced_and_idle_sessions_are_inactive(store, collection):
+    async def scenario():
+        sessions_ = manager(store, collection)
+        first = await sessions_.start("player")
+        second = await sessions_.start("player")
+        assert not sessions_.is_active(first) and sessions_.is_active(second)
+        second.updated_at -= 120
+        assert not sessions_.is_active(second)
+        await sessions_.end(first)
+        # Ending a replaced session leaves the current one in place
+        assert sessions_.get("player") is second
+
+    asyncio.run(scenario())
+
+
+def test_idle_sessions_expire(store, collection, monkeypatch):
+    monkeypatch.setattr(sessions, "SWEEP_INTERVAL", 0.01)
+
+    async def scenario():
+        sessions_ = manager(store, collection, timeout=0.2)
+        await sessions_.start("idle")
+        sweeping = asyncio.create_task(sessions_.expire_idle())
+        await asyncio.sleep(0.12)
+        await sessions_.start("active")
+        await asyncio.sleep(0.14)
+        sweeping.cancel()
+        return sessions_
+
+    sessions_ = asyncio.run(scenario())
+    assert list(sessions_.sessions) == ["active"]
+    assert [document["_id"] for document in collection.find({})] == ["active"]
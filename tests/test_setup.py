@@ -0,0 +1,52 @@
+import asyncio
+
+import config
+import setup
+from setup import InitialDuplicateStartOverView, character_in_other_game_embed, keynote_embed
+from tests.conftest import character
+from tests.fakes import FakeInteraction, FakeUser
+
+
+def start_over(user: FakeUser, guild_id: int) -> FakeInteraction:
+    """Click Start Over on the view sent in reply to /setup in a guild."""
+    async def click() -> FakeInteraction:
+        view = InitialDuplicateStartOverView(FakeInteraction(user, guild_id))
+        interaction = FakeInteraction(user, guild_id)
+        await view.start_over.callback(interaction)
+        return interaction
+
+    return asyncio.run(click())
+
+
+def test_start_over_never_deletes_a_character_in_another_game(games):
+    first, second = games
+    user = FakeUser("Player")
+    character_id = config.encrypt_id(user.id)
+    asyncio.run(config.character_store.create(character_id, character(character_id, "Alice", 0,
+                                                                      game_id=first.game_id)))
+
+    interaction = start_over(user, second.guild_id)
+    assert interaction.response.messages[0]["embed"] is character_in_other_game_embed
+    assert asyncio.run(config.character_store.get(character_id))["game_id"] == first.game_id
+    assert config.games.of(character_id) is first
+    assert not user.dms
+
+
+def test_start_over_in_the_same_game_restarts_setup(games, monkeypatch):
+    first, _ = games
+    user = FakeUser("Player")
+    character_id = config.encrypt_id(user.id)
+    asyncio.run(config.character_store.create(character_id, character(character_id, "Alice", 0,
+                                                                      game_id=first.game_id)))
+    released = []
+
+    async def release(slot, game_id):
+        released.append((slot, game_id))
+
+    monkeypatch.setattr(setup.portrait_allocator, "release", release)
+    start_over(user, first.guild_id)
+    assert asyncio.run(config.character_store.get(character_id)) is None
+    assert released == [(0, first.game_id)]
+    assert user.dms[0]["embed"] is keynote_embed
+    assert setup.setup_sessions.get(character_id).game_id == first.game_id
+    asyncio.run(setup.setup_sessions.end(setup.setup_sessions.get(character_id)))
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from store import CharacterStore, LazyCollection, MemoryDatabase, duplicate_key_field
+from tests.conftest import character
+
+
+def test_create_get_and_cache(store):
+    async def scenario():
+        created = await store.create("1", character("1", "Alice", 0))
+        assert created["_id"] == "1"
+        assert await store.get("1") == created
+        assert store.cache.get("1") == created
+        assert await store.get("2") is None
+        assert await store.get("1", projection={"character_name": 1}) == {"_id": "1", "character_name": "Alice"}
+
+    asyncio.run(scenario())
+
+
+def test_upsert_move_delete(store):
+    async def scenario():
+        await store.upsert("1", character("1", "Alice", 0))
+        assert (await store.upsert("1", {"status": "evicted"}))["status"] == "evicted"
+        assert (await store.move("1", "Lounge", "Kitchen"))["current_room"] == "Kitchen"
+        # Only moves a character still in from_room
+        assert await store.move("1", "Lounge", "Backyard") is None
+        assert (await store.get("1"))["current_room"] == "Kitchen"
+        assert (await store.delete("1"))["character_name"] == "Alice"
+        assert await store.delete("1") is None
+        assert await store.get("1") is None
+
+    asyncio.run(scenario())
+
+
+def test_delete_scoped_to_game(store):
+    async def scenario():
+        await store.create("1", character("1", "Alice", 0, game_id="a"))
+        assert await store.delete("1", game_id="b") is None
+        assert await store.get("1") is not None
+        assert await store.delete("1", game_id="a") is not None
+
+    asyncio.run(scenario())
+
+
+def test_list_count_and_aggregate(store):
+    async def scenario():
+        for index, room in enumerate(["Lounge", "Lounge", "Kitchen"]):
+            await store.create(str(index), character(str(index), f"C{index}", index, room=room))
+        assert len(await store.list({"current_room": "Lounge"})) == 2
+        assert await store.list({"current_room": "Kitchen"}, {"_id": 1}) == [{"_id": "2"}]
+        assert await store.count({"current_room": {"$in": ["Lounge", "Kitchen"]}}) == 3
+        rooms = await store.aggregate([{"$group": {"_id": "$current_room", "count": {"$sum": 1}}},
+                                       {"$sort": {"_id": 1}}])
+        assert rooms == [{"_id": "Kitchen", "count": 1}, {"_id": "Lounge", "count": 2}]
+
+    asyncio.run(scenario())
+
+
+def test_listeners_see_every_write(store):
+    writes = []
+    store.add_listener(lambda character_id, document: writes.append((character_id, document is not None)))
+
+    async def scenario():
+        await store.create("1", character("1", "Alice", 0))
+        await store.move("1", "Lounge", "Kitchen")
+        await store.delete("1")
+
+    asyncio.run(scenario())
+    assert writes == [("1", True), ("1", True), ("1", False)]
+    assert store.membership_version == 2
+
+
+@pytest.mark.parametrize("clash, field", [
+    ({"_id": "1"}, "_id"),
+    ({"character_name": "Alice"}, "character_name"),
+    ({"portrait_emoji_pair": 0}, "portrait_emoji_pair"),
+])
+def test_duplicate_keys(store, clash, field):
+    async def scenario():
+        await store.ensure_indexes()
+        await store.create("1", character("1", "Alice", 0))
+        duplicate = {**character("2", "Bob", 1), **clash}
+        with pytest.raises(DuplicateKeyError) as error:
+            await store.create(duplicate.pop("_id", "2"), duplicate)
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert field in error.details["keyPattern"]
+    assert duplicate_key_field(error) == field
+
+
+def test_names_are_unique_per_game(store):
+    async def scenario():
+        await store.ensure_indexes()
+        await store.create("1", character("1", "Alice", 0, game_id="a"))
+        await store.create("2", character("2", "Alice", 0, game_id="b"))
+        assert await store.count() == 2
+
+    asyncio.run(scenario())
+
+
+def test_lazy_collection_connects_on_first_use():
+    calls = []
+
+    def get_database():
+        calls.append(1)
+        return MemoryDatabase()
+
+    collection = LazyCollection(get_database, "characters")
+    assert not calls
+    collection.insert_one({"_id": 1})
+    assert collection.find_one({"_id": 1}) == {"_id": 1}
+    assert calls == [1]
+
+
+class BlockingCollection:
+    """Wraps a collection, holding find_one on the executor until released."""
+
+    def __init__(self, collection) -> None:
+        self.collection = collection
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def find_one(self, *args, **kwargs):
+        document = self.collection.find_one(*args, **kwargs)
+        self.reading.set()
+        self.release.wait(5)
+        return document
+
+    def __getattr__(self, attribute):
+        return getattr(self.collection, attribute)
+
+
+def test_delete_during_get_is_not_undone(database):
+    collection = BlockingCollection(database["characters"])
+    store = CharacterStore(collection)
+
+    async def scenario():
+        await store.create("1", character("1", "Alice", 0))
+        store.cache.invalidate("1")
+        # The get reads the document, and the delete completes before the read returns
+        get = asyncio.create_task(store.get("1"))
+        await asyncio.to_thread(collection.reading.wait, 5)
+        assert await store.delete("1") is not None
+        collection.release.set()
+        assert (await get)["character_name"] == "Alice"
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        store.close()
+    assert "1" not in store.cache
+    assert database["characters"].find_one({"_id": "1"}) is None
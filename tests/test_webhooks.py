@@ -0,0 +1,69 @@
+import asyncio
+
+import discord
+
+from metrics import registry
+from outbound import default_sender
+from tests.fakes import FakeClient, FakeRoom, http_error
+from webhooks import POOL_PER, POOL_RATE, WEBHOOK_CHANNEL_PER, WEBHOOK_CHANNEL_RATE, WEBHOOK_RATE, WEBHOOKS_PER_ROOM, \
+    WebhookPool
+
+
+def sends_timed() -> int:
+    """Return the number of sends recorded by every sender in the send latency histogram."""
+    return sum(registry.histogram("discord_send_seconds", sender=sender.__qualname__).count
+               for sender in (WebhookPool.send, default_sender))
+
+
+def test_sends_round_robin_under_the_character_name():
+    client = FakeClient()
+    pool = WebhookPool(client, size=3)
+    room = FakeRoom(client.user)
+
+    async def scenario():
+        for index in range(6):
+            await pool.send(room, f"message {index}", ("Alice", None))
+        await pool.send(room, "announcement", None)
+
+    asyncio.run(scenario())
+    assert room.posts[:6] == [("Alice", f"message {index}") for index in range(6)]
+    assert room.posts[6] == (client.user.display_name, "announcement")
+    assert room.created == 3
+    assert [webhook.sends for webhook in room.hooks] == [3, 2, 2]
+
+
+def test_forbidden_falls_back_to_the_bot_and_is_timed_once():
+    client = FakeClient()
+    pool = WebhookPool(client)
+    room = FakeRoom(client.user, manage_webhooks=False)
+    count = sends_timed()
+
+    async def scenario():
+        await pool.send(room, "hello", ("Alice", None))
+        await pool.send(room, "again", ("Alice", None))
+
+    asyncio.run(scenario())
+    assert room.posts == [(None, "**Alice**: hello"), (None, "**Alice**: again")]
+    assert room.id in pool.unavailable
+    assert sends_timed() == count + 2
+
+
+def test_deleted_webhook_is_replaced_and_the_send_retried():
+    client = FakeClient()
+    pool = WebhookPool(client, size=1)
+    room = FakeRoom(client.user)
+
+    async def scenario():
+        await pool.send(room, "first", ("Alice", None))
+        room.hooks[0].errors.append(http_error(discord.NotFound, 404, "Unknown Webhook"))
+        room.hooks.clear()
+        await pool.send(room, "second", ("Alice", None))
+
+    asyncio.run(scenario())
+    assert room.posts == [("Alice", "first"), ("Alice", "second")]
+    assert room.created == 2
+
+
+def test_relay_rate_stays_within_the_channel_and_webhook_limits():
+    assert POOL_RATE * WEBHOOK_CHANNEL_PER / POOL_PER <= WEBHOOK_CHANNEL_RATE
+    assert POOL_RATE <= WEBHOOK_RATE * WEBHOOKS_PER_ROOM
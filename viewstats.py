@@ -1,16 +1,48 @@
-"""Elements for /viewstats command.
-
-THIS FILE ASSUMES THAT THERE IS AT LEAST ONE CHARACTER IN THE DATABASE.
-"""
+"""Elements for /viewstats command."""
 
 from config import *
 
-character_names = [document["character_name"] for document in characters_db.find()]
+# Embed to show when /viewstats is used before any character has been created
+no_characters_embed = Embed(
+    description="There are no characters yet.",
+    color=0xFF0000,
+)
+
+# Embed to show when /viewstats is given a character that does not exist
+character_not_found_embed = Embed(
+    description="There is no character with that name.",
+    color=0xFF0000,
+)
+
+# Rendered /viewstats embeds, invalidated whenever a character is written
+embed_cache = RenderCache(maxsize=512)
+character_store.add_listener(lambda character_id, character: embed_cache.invalidate(character_id))
+metrics.add_collector(lambda: ((f"embed_cache_{name}", "Rendered embed cache counter", {}, value)
+                               for name, value in embed_cache.stats().items()))
 
-view_stats_select_options = [
-    discord.SelectOption(label=character_name, value=str(character_names.index(character_name)))
-    for character_name in character_names
-]
+
+# A select menu holds at most 25 options, two of which are reserved for paging through characters
+SELECT_PAGE_SIZE = 23
+PREVIOUS_OPTION = "previous"
+NEXT_OPTION = "next"
+
+
+def view_stats_select_options(characters: list[dict], select_page: int = 0) -> list[SelectOption]:
+    """Return one page of "Jump to..." select options, valued by portrait emoji pair.
+
+    Args:
+        characters (list[dict]): The characters to choose from, in the order they are listed.
+        select_page (int): The page of the select menu to return.
+    """
+    start = select_page * SELECT_PAGE_SIZE
+    options = []
+    if select_page > 0:
+        options.append(SelectOption(label="◀️ Previous characters", value=PREVIOUS_OPTION))
+    options.extend(SelectOption(label=character["character_name"], value=str(character["portrait_emoji_pair"]))
+                   for character in characters[start:start + SELECT_PAGE_SIZE])
+    if start + SELECT_PAGE_SIZE < len(characters):
+        options.append(SelectOption(label="More characters ▶️", value=NEXT_OPTION))
+    return options
 
 
 # TODO: PaginationView could be moved to config.py if other files need this class
@@ -18,35 +50,31 @@ class PaginationView(discord.ui.View, metaclass=ABCMeta):
     """A parent class for pagination.
 
     This class implements basic PaginationView to be used in many occasions, including an embed,
-    a thumbnail file (if available), and 4 buttons: first, previous, next, last.
+    a thumbnail file (if the portrait has not been uploaded yet), and 4 buttons: first, previous, next, last.
 
     update_interaction is an abstract method to be implemented in the child class.
 
     Optionally, a child class may implement select() method to add a dropdown menu to the view.
     """
 
-    def __init__(self, current_page: int = 0,
+    def __init__(self, snapshot: Snapshot,
+                 current_page: int = 0,
                  timeout: Optional[float] = None,
                  interaction: Optional[discord.Interaction] = None) -> None:
-        # TODO: update_interaction must also update self.characters, self.current_character,
-        #       and self.max_page
         super().__init__(timeout=timeout)
-        assert len([document for document in characters_db.find()]) > 0
-        self.characters = [document for document in characters_db.find()]
+        assert len(snapshot) > 0
+        self.snapshot = snapshot
+        self.characters = snapshot.characters
         self.current_character = self.characters[current_page]
         self.page = current_page
         self.min_page = 0
         self.max_page = len(self.characters) - 1
-        self.thumbnail_file = get_thumbnail_file(self.current_character["portrait_emoji_pair"])
-        self.embed = create_embed(self.current_character["character_name"],
-                                  self.current_character["status"],
-                                  self.current_character["current_room"],
-                                  self.current_character["stats"],
-                                  self.current_character["traits"])
+        self.embed, self.thumbnail_file = character_embed(self.current_character)
         self.update_buttons()
         self.interaction = interaction
 
     @discord.ui.button(label='⏮️', style=ButtonStyle.green, custom_id='first')
+    @timed("view_callback_seconds", label="callback")
     async def first(self, interaction: discord.Interaction, button: discord.ui.Button):
         """Go to the first page.
 
@@ -62,6 +90,7 @@ class PaginationView(discord.ui.View, metaclass=ABCMeta):
             pass
 
     @discord.ui.button(label='◀️', style=ButtonStyle.blurple, custom_id='previous')
+    @timed("view_callback_seconds", label="callback")
     async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
         """Go to the previous page.
 
@@ -77,6 +106,7 @@ class PaginationView(discord.ui.View, metaclass=ABCMeta):
             pass
 
     @discord.ui.button(label='▶️', style=ButtonStyle.blurple, custom_id='next')
+    @timed("view_callback_seconds", label="callback")
     async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
         """Go to the next page.
 
@@ -92,6 +122,7 @@ class PaginationView(discord.ui.View, metaclass=ABCMeta):
             pass
 
     @discord.ui.button(label='⏭️', style=ButtonStyle.green, custom_id='last')
+    @timed("view_callback_seconds", label="callback")
     async def last(self, interaction: discord.Interaction, button: discord.ui.Button):
         """Go to the last page.
 
@@ -128,12 +159,23 @@ class PaginationView(discord.ui.View, metaclass=ABCMeta):
 class ViewStatsView(PaginationView):
     """The main class for viewing stats for each character, in a dictionary format."""
 
-    def __init__(self, current_page: int = 0,
+    def __init__(self, snapshot: Snapshot,
+                 current_page: int = 0,
                  interaction: Optional[Interaction] = None) -> None:
-        super().__init__(current_page=current_page)
+        super().__init__(snapshot, current_page=current_page)
         self.interaction = interaction
+        self.select_page = 0
+        self.index_snapshot()
 
-    @discord.ui.select(placeholder='Jump to...', options=view_stats_select_options.copy())
+    def index_snapshot(self) -> None:
+        """Index the snapshot's characters by portrait emoji pair, and reset the select menu."""
+        self.pages = {character["portrait_emoji_pair"]: page for page, character in enumerate(self.characters)}
+        self.alphabetical = sorted(self.characters, key=lambda character: character["character_name"].casefold())
+        self.select_page = min(self.select_page, max(0, (len(self.alphabetical) - 1) // SELECT_PAGE_SIZE))
+        self.select.options = view_stats_select_options(self.alphabetical, self.select_page)
+
+    @discord.ui.select(placeholder='Jump to...')
+    @timed("view_callback_seconds", label="callback")
     async def select(self, interaction: discord.Interaction, select: discord.ui.Select):
         """Jump to a specific character.
 
@@ -141,27 +183,48 @@ class ViewStatsView(PaginationView):
             interaction (discord.Interaction): The interaction that triggered this button.
             select (discord.ui.Select): The select menu that was clicked.
         """
-        self.page = int(select.values[0])
+        value = select.values[0]
+        if value in (PREVIOUS_OPTION, NEXT_OPTION):
+            self.select_page += -1 if value == PREVIOUS_OPTION else 1
+            self.select.options = view_stats_select_options(self.alphabetical, self.select_page)
+            await interaction.response.edit_message(view=self)
+            return
+        self.page = self.pages.get(int(value), self.page)
         await self.update_interaction(interaction)
         try:
             await interaction.response.edit_message(view=self)
         except discord.errors.InteractionResponded:
             pass
 
+    async def refresh(self) -> None:
+        """Bring the snapshot up to date for the current page, if it is stale.
+
+        A new snapshot is only read when characters were created or deleted since it was taken.
+        Otherwise only the current character is refetched, usually from the store's cache.
+        """
+        if self.snapshot.version == character_store.version:
+            return
+        if self.snapshot.membership_version != character_store.membership_version:
+            self.snapshot = await character_store.snapshot(self.snapshot.query)
+            self.characters = self.snapshot.characters
+            self.max_page = len(self.characters) - 1
+            self.page = max(0, min(self.page, self.max_page))
+            self.index_snapshot()
+            return
+        character = await character_store.get(self.characters[self.page]["_id"])
+        if character is not None:
+            self.characters[self.page] = character
+
     async def update_interaction(self, interaction: discord.Interaction) -> None:
-        # TODO: may not need to update them all when the characters list is set in stone after testing
-        self.characters = [document for document in characters_db.find()]
+        await self.refresh()
+        if not self.characters:
+            await interaction.response.edit_message(embed=no_characters_embed, attachments=[], view=None)
+            return
         self.current_character = self.characters[self.page]
-        self.max_page = len(self.characters) - 1
         self.update_buttons()
-        self.thumbnail_file = get_thumbnail_file(self.current_character["portrait_emoji_pair"])
-        self.embed = create_embed(self.current_character["character_name"],
-                                  self.current_character["status"],
-                                  self.current_character["current_room"],
-                                  self.current_character["stats"],
-                                  self.current_character["traits"])
+        self.embed, self.thumbnail_file = character_embed(self.current_character)
         await interaction.response.edit_message(embed=self.embed,
-                                                attachments=[self.thumbnail_file],
+                                                attachments=[self.thumbnail_file] if self.thumbnail_file else [],
                                                 view=self)
 
 
@@ -169,7 +232,8 @@ def create_embed(character_name: str,
                  status: str,
                  current_room: str,
                  stats: dict,
-                 traits: dict) -> Embed:
+                 traits: dict,
+                 thumbnail_url: str = "attachment://image.jpg") -> Embed:
     """Create an embed for viewing stats.
 
     Args:
@@ -178,9 +242,10 @@ def create_embed(character_name: str,
         current_room (str): The current room of the character.
         stats (dict): The stats of the character.
         traits (dict): The traits of the character.
+        thumbnail_url (str): The URL of the character's portrait.
     """
     embed = Embed(title=f"**{character_name}**", color=0x00ff00)
-    embed.set_thumbnail(url="attachment://image.jpg")
+    embed.set_thumbnail(url=thumbnail_url)
     embed.add_field(name="Status", value=status, inline=True)
     embed.add_field(name="Current Room", value=current_room, inline=True)
     embed.add_field(name="Stats",
@@ -190,3 +255,26 @@ def create_embed(character_name: str,
                     value="\n".join([f"{key}: {value}" for key, value in traits.items()]),
                     inline=False)
     return embed
+
+
+def character_embed(character: dict) -> tuple[Embed, Optional[discord.File]]:
+    """Return the /viewstats embed for a character, and the thumbnail file to attach, if any.
+
+    Rendered embeds are cached per character, keyed by the fields they are rendered from.
+
+    Args:
+        character (dict): The character document.
+    """
+    thumbnail_url, thumbnail_file = portrait_assets.thumbnail(character["portrait_emoji_pair"])
+    fingerprint = (character["character_name"], character["status"], character["current_room"],
+                   tuple(character["stats"].items()), tuple(character["traits"].items()), thumbnail_url)
+    payload = embed_cache.get_payload(character["_id"], fingerprint)
+    if payload is None:
+        payload = create_embed(character["character_name"],
+                               character["status"],
+                               character["current_room"],
+                               character["stats"],
+                               character["traits"],
+                               thumbnail_url).to_dict()
+        embed_cache.put_payload(character["_id"], fingerprint, payload)
+    return Embed.from_dict(payload), thumbnail_file
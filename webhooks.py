@@ -0,0 +1,136 @@
+"""Posting relayed messages through per-room webhooks.
+
+Webhooks let each character post under their own name and portrait instead of as the bot with a
+name prefix. Every webhook also has its own rate limit bucket, so a room with a pool of webhooks
+can take several times the traffic the bot alone could post there.
+"""
+
+import asyncio
+import logging
+from typing import Hashable, Optional, Sequence
+
+import discord
+
+from metrics import timed
+from outbound import send_as_bot
+
+log = logging.getLogger(__name__)
+
+# Name given to the webhooks the bot creates, used to find them again after a restart
+WEBHOOK_NAME = "OI Big Brother relay"
+
+# Number of webhooks per room; sends are spread across them round-robin
+WEBHOOKS_PER_ROOM = 3
+
+# Discord allows roughly 5 messages per 2 seconds per webhook
+WEBHOOK_RATE = 5
+WEBHOOK_PER = 2.0
+
+# Discord also allows roughly 30 messages per minute per channel, across all of its webhooks
+WEBHOOK_CHANNEL_RATE = 30
+WEBHOOK_CHANNEL_PER = 60.0
+
+# Rate limit of the relay posting to a room through its pool: bursts stay within what the pool's
+# webhooks allow together, and are refilled at the channel's limit
+POOL_RATE = WEBHOOK_RATE * WEBHOOKS_PER_ROOM
+POOL_PER = POOL_RATE * WEBHOOK_CHANNEL_PER / WEBHOOK_CHANNEL_RATE
+
+
+class WebhookPool:
+    """Owns a pool of webhooks per channel, creating them once and recreating them when deleted.
+
+    Use WebhookPool.send as the sender of an OutboundRelay, with the author of each message set
+    to a (character name, avatar URL) pair. Messages without an author are posted under the
+    bot's own name. If the bot cannot manage webhooks in a channel, messages are sent as the bot
+    with a name prefix, as before.
+    """
+
+    def __init__(self, client: discord.Client, size: int = WEBHOOKS_PER_ROOM) -> None:
+        """Initialize the pool.
+
+        Args:
+            client (discord.Client): The client whose webhooks are used.
+            size (int): Number of webhooks per channel.
+        """
+        self.client = client
+        self.size = size
+        self.webhooks: dict[int, list[discord.Webhook]] = {}
+        self.unavailable: set[int] = set()
+        self._next: dict[int, int] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+
+    async def webhooks_for(self, channel: discord.TextChannel) -> list[discord.Webhook]:
+        """Return the channel's webhooks, reusing the bot's existing ones and creating the rest.
+
+        Raises:
+            discord.Forbidden: If the bot is missing the Manage Webhooks permission.
+        """
+        webhooks = self.webhooks.get(channel.id)
+        if webhooks:
+            return webhooks
+        async with self._locks.setdefault(channel.id, asyncio.Lock()):
+            webhooks = self.webhooks.get(channel.id)
+            if webhooks:
+                return webhooks
+            webhooks = [webhook for webhook in await channel.webhooks()
+                        if webhook.name == WEBHOOK_NAME and webhook.user == self.client.user and webhook.token]
+            while len(webhooks) < self.size:
+                webhooks.append(await channel.create_webhook(name=WEBHOOK_NAME))
+            self.webhooks[channel.id] = webhooks[:self.size]
+            return self.webhooks[channel.id]
+
+    def _discard(self, channel_id: int) -> None:
+        # The remaining webhooks are found again (and the missing ones recreated) on the next send
+        self.webhooks.pop(channel_id, None)
+
+    @staticmethod
+    async def _send_as_bot(channel: discord.TextChannel, content: str, author: Optional[Hashable],
+                           files: Sequence[discord.File]) -> None:
+        """Post the content as the bot itself, prefixed with the character's name."""
+        name = author[0] if author is not None else None
+        await send_as_bot(channel, f"**{name}**: {content}" if name else content, author, files)
+
+    @timed("discord_send_seconds", label="sender")
+    async def send(self, channel: discord.TextChannel, content: str, author: Optional[Hashable],
+                   files: Sequence[discord.File] = ()) -> None:
+        """Post the content in the channel through the next webhook of its pool.
+
+        Args:
+            channel (discord.TextChannel): The room channel.
+            content (str): The content to post.
+            author (Optional[Hashable]): A (character name, avatar URL or None) pair, or None to
+                post under the bot's name.
+            files (Sequence[discord.File]): Files to attach.
+        """
+        name, avatar_url = author if author is not None else (None, None)
+        if channel.id in self.unavailable:
+            await self._send_as_bot(channel, content, author, files)
+            return
+        for attempt in range(2):
+            try:
+                webhooks = await self.webhooks_for(channel)
+            except discord.Forbidden:
+                log.warning("Missing permission to manage webhooks in %s, relaying as the bot", channel)
+                self.unavailable.add(channel.id)
+                # Not through send(), which would record this one send twice in its histogram
+                await self._send_as_bot(channel, content, author, files)
+                return
+            index = self._next.get(channel.id, 0) % len(webhooks)
+            self._next[channel.id] = index + 1
+            webhook = webhooks[index]
+            try:
+                await webhook.send(content or None, files=list(files),
+                                   username=name or self.client.user.display_name,
+                                   avatar_url=avatar_url or self.client.user.display_avatar.url,
+                                   allowed_mentions=discord.AllowedMentions.none())
+                return
+            except discord.NotFound:
+                # The webhook was deleted, so replace it and try again once
+                self._discard(channel.id)
+                if attempt:
+                    raise
+                for file in files:
+                    # Files read from disk are closed after a send, and cannot be sent again
+                    if file.fp.closed:
+                        raise
+                    file.reset()